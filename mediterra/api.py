@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
 from rest_framework import routers
-from .viewsets import TeacherViewSet, StudentViewSet, GradeViewSet, SpecializationViewSet
+from .viewsets import (TeacherViewSet, StudentViewSet, GradeViewSet, SpecializationViewSet, JobViewSet,
+                       ChangeViewSet, RosterViewSet)
 
 router = routers.DefaultRouter()
 router.register(r'teachers', TeacherViewSet)
 router.register(r'students', StudentViewSet)
 router.register(r'grades', GradeViewSet)
 router.register(r'specializations', SpecializationViewSet)
+router.register(r'roster', RosterViewSet, base_name='roster')
+router.register(r'jobs', JobViewSet)
+router.register(r'changes', ChangeViewSet)
 
 urlpatterns = router.urls
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from django.apps import AppConfig
+
+
+class MediterraConfig(AppConfig):
+    name = 'mediterra'
+
+    def ready(self):
+        from . import signals  # noqa
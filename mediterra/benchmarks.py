@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark cases for the API routes, run by ``manage.py benchmark``.
+
+Every case is one request. It is repeated with the timer running to get latency
+percentiles, then run once more to count queries and, where ``tracemalloc``
+is available, to measure peak memory.
+"""
+from __future__ import unicode_literals, absolute_import
+import math
+from timeit import default_timer
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.six.moves import range
+from rest_framework.test import APIClient
+from .bulk import bulk_insert
+from .models import Teacher, Student, Grade, Specialization
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+API_ROOT = '/api/v1/'
+
+
+class Case(object):
+    """
+    A request against ``path``, formatted with the fixture values.
+
+    ``data`` is the body (query parameters for GET) or a callable building it
+    from the fixture values. ``setup`` runs untimed before every request and
+    its result is available as ``{new}``, e.g. an object to delete.
+    """
+    def __init__(self, name, method, path, data=None, setup=None, status=200):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.setup = setup
+        self.status = status
+
+    def prepare(self, fixture, index):
+        values = dict(fixture, index=index)
+        if self.setup is not None:
+            values['new'] = self.setup(values)
+        data = self.data(values) if callable(self.data) else self.data
+        return API_ROOT + self.path.format(**values), data
+
+
+def get_fixture():
+    """
+    Pick existing objects for the cases to work on.
+    """
+    def middle(model):
+        count = model.objects.count()
+        return model.objects.order_by('pk')[count // 2]
+
+    teacher = middle(Teacher)
+    student = middle(Student)
+    return {
+        'teacher': teacher.pk,
+        'specialization': teacher.specializations.order_by('pk')[0].pk,
+        'grade': middle(Grade).pk,
+        'student': student.pk,
+        'last_name': student.last_name,
+        'search': student.last_name[:3].lower(),
+    }
+
+
+def new_teacher(values):
+    return Teacher.objects.create(first_name='Новый', last_name='Учитель %d' % values['index']).pk
+
+
+def new_student(values):
+    return Student.objects.create(first_name='Новый', last_name='Ученик %d' % values['index']).pk
+
+
+def new_students(values):
+    students = [Student(first_name='Новый', last_name='Ученик %d' % i) for i in range(100)]
+    return [student.pk for student in bulk_insert(Student, students)]
+
+
+def new_grade(values):
+    return Grade.objects.create(title='Новый %d' % values['index'], teacher_id=values['teacher'],
+                                specialization_id=values['specialization']).pk
+
+
+def new_specialization(values):
+    return Specialization.objects.create(title='Новая %d' % values['index']).pk
+
+
+def teacher_data(values):
+    return {'first_name': 'Иван', 'last_name': 'Учитель %d' % values['index'],
+            'specializations': [values['specialization']]}
+
+
+def student_data(values):
+    return {'first_name': 'Петр', 'last_name': 'Ученик %d' % values['index'], 'grades': [values['grade']]}
+
+
+def grade_data(values):
+    return {'title': '1а', 'description': 'Класс %d' % values['index'],
+            'teacher': values['teacher'], 'specialization': values['specialization']}
+
+
+CASES = [
+    Case('teachers:list', 'get', 'teachers/'),
+    Case('teachers:list-1000', 'get', 'teachers/', {'page_size': 1000}),
+    Case('teachers:filter', 'get', 'teachers/', lambda v: {'specializations': v['specialization']}),
+    Case('teachers:detail', 'get', 'teachers/{teacher}/'),
+    Case('teachers:export', 'get', 'teachers/export/', {'format': 'ndjson'}),
+    Case('teachers:create', 'post', 'teachers/', teacher_data, status=201),
+    Case('teachers:update', 'put', 'teachers/{teacher}/', teacher_data),
+    Case('teachers:destroy', 'delete', 'teachers/{new}/', setup=new_teacher, status=204),
+
+    Case('students:list', 'get', 'students/'),
+    Case('students:list-1000', 'get', 'students/', {'page_size': 1000}),
+    Case('students:filter', 'get', 'students/', lambda v: {'last_name': v['last_name']}),
+    Case('students:filter-grade', 'get', 'students/', lambda v: {'grades': v['grade']}),
+    Case('students:search', 'get', 'students/', lambda v: {'search': v['search']}),
+    Case('students:detail', 'get', 'students/{student}/'),
+    Case('students:export', 'get', 'students/export/', {'format': 'ndjson'}),
+    Case('students:create', 'post', 'students/', student_data, status=201),
+    Case('students:update', 'put', 'students/{student}/',
+         lambda v: dict(student_data(v), last_name=v['last_name'])),
+    Case('students:partial-update', 'patch', 'students/{student}/', lambda v: {'grades': [v['grade']]}),
+    Case('students:destroy', 'delete', 'students/{new}/', setup=new_student, status=204),
+    Case('students:bulk-create', 'post', 'students/bulk/',
+         lambda v: [student_data(dict(v, index=i)) for i in range(100)], status=201),
+    Case('students:bulk-update', 'patch', 'students/bulk/',
+         lambda v: [{'id': pk, 'grades': [v['grade']]} for pk in v['new']], setup=new_students),
+    Case('students:bulk-destroy', 'delete', 'students/bulk/', lambda v: v['new'], setup=new_students,
+         status=204),
+
+    Case('grades:list', 'get', 'grades/'),
+    Case('grades:filter', 'get', 'grades/', lambda v: {'teacher': v['teacher']}),
+    Case('grades:search', 'get', 'grades/', {'search': '1'}),
+    Case('grades:detail', 'get', 'grades/{grade}/'),
+    Case('grades:create', 'post', 'grades/', grade_data, status=201),
+    Case('grades:update', 'put', 'grades/{grade}/', grade_data),
+    Case('grades:destroy', 'delete', 'grades/{new}/', setup=new_grade, status=204),
+
+    Case('specializations:list', 'get', 'specializations/'),
+    Case('specializations:detail', 'get', 'specializations/{specialization}/'),
+    Case('specializations:create', 'post', 'specializations/', lambda v: {'title': 'Новая %d' % v['index']},
+         status=201),
+    Case('specializations:destroy', 'delete', 'specializations/{new}/', setup=new_specialization, status=204),
+
+    Case('roster:list', 'get', 'roster/'),
+    Case('roster:detail', 'get', 'roster/{teacher}/'),
+]
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of sorted ``values``.
+    """
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def run_case(case, fixture, repeat=20, warmup=2):
+    client = APIClient()
+    caches[settings.API_CACHE_ALIAS].clear()
+
+    def request(path, data):
+        method = getattr(client, case.method)
+        start = default_timer()
+        if case.method == 'get':
+            response = method(path, data)
+        else:
+            response = method(path, data, format='json')
+        if response.streaming:
+            # Streaming responses do their work while being consumed.
+            for chunk in response.streaming_content:
+                pass
+        return response, default_timer() - start
+
+    for index in range(warmup):
+        request(*case.prepare(fixture, index))
+    timings = []
+    for index in range(warmup, warmup + repeat):
+        response, elapsed = request(*case.prepare(fixture, index))
+        timings.append(elapsed * 1000)
+    timings.sort()
+
+    path, data = case.prepare(fixture, warmup + repeat)
+    if tracemalloc is not None:
+        tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        response, elapsed = request(path, data)
+    peak_memory = None
+    if tracemalloc is not None:
+        peak_memory = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+
+    return {
+        'name': case.name,
+        'method': case.method.upper(),
+        'path': case.path,
+        'status': response.status_code,
+        'queries': len(queries),
+        'repeat': repeat,
+        'latency_ms': {
+            'min': round(timings[0], 3),
+            'p50': round(percentile(timings, 50), 3),
+            'p90': round(percentile(timings, 90), 3),
+            'p99': round(percentile(timings, 99), 3),
+            'max': round(timings[-1], 3),
+            'mean': round(sum(timings) / len(timings), 3),
+        },
+        'peak_memory_kb': peak_memory,
+    }
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Set-based writes for the API and the data loading tools.
+
+Unlike ``QuerySet.bulk_create`` and ``QuerySet.update`` these helpers send
+``post_save`` and ``m2m_changed`` for every affected object, so receivers
+keeping derived data in sync see bulk writes exactly like single ones.
+"""
+from __future__ import unicode_literals, absolute_import
+from collections import defaultdict
+from django.db import DatabaseError, connections, router, transaction
+from django.db.models import CASCADE, Case, ManyToManyRel, Max, Value, When
+from django.db.models.signals import post_save, m2m_changed
+
+# SQLite refuses statements with more than 999 parameters.
+MAX_QUERY_PARAMS = 999
+
+
+def in_bulk(queryset, pks):
+    """
+    ``QuerySet.in_bulk`` split into batches that fit the parameter limit.
+    """
+    pks = list(pks)
+    objects = {}
+    for start in range(0, len(pks), MAX_QUERY_PARAMS):
+        objects.update(queryset.in_bulk(pks[start:start + MAX_QUERY_PARAMS]))
+    return objects
+
+
+def insert_rows(model, columns, rows):
+    """
+    Insert ``rows`` with a raw ``executemany``, skipping model instances.
+    """
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        quote(model._meta.db_table), ', '.join(quote(column) for column in columns),
+        ', '.join(['%s'] * len(columns)))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+    return len(rows)
+
+
+def bulk_insert(model, objs, batch_size=None, send_signals=True):
+    """
+    Insert ``objs`` with ``bulk_create`` and make sure each object gets its
+    primary key, even on backends that cannot return ids from a bulk insert.
+    """
+    objs = list(objs)
+    if not objs:
+        return objs
+    using = router.db_for_write(model)
+    connection = connections[using]
+    manager = model._default_manager.db_manager(using)
+    with transaction.atomic(using=using):
+        if connection.features.can_return_ids_from_bulk_insert:
+            manager.bulk_create(objs, batch_size=batch_size)
+        else:
+            # Ids are assigned in insertion order above the current maximum.
+            # A concurrent writer would make us read a foreign id, so the
+            # count is checked before the ids are trusted.
+            last_pk = manager.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+            manager.bulk_create(objs, batch_size=batch_size)
+            pks = list(manager.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True))
+            if len(pks) != len(objs):
+                raise DatabaseError('Concurrent insert into %s detected' % model._meta.db_table)
+            for obj, pk in zip(objs, pks):
+                obj.pk = pk
+        if send_signals:
+            for obj in objs:
+                post_save.send(sender=model, instance=obj, created=True, update_fields=None,
+                               raw=False, using=using)
+    return objs
+
+
+def bulk_update(model, objs, fields, send_signals=True):
+    """
+    Write ``fields`` of ``objs`` with one ``UPDATE ... CASE`` statement per batch.
+    """
+    objs = list(objs)
+    fields = [model._meta.get_field(name) for name in fields]
+    if not objs or not fields:
+        return objs
+    using = router.db_for_write(model)
+    manager = model._default_manager.db_manager(using)
+    batch_size = max(1, MAX_QUERY_PARAMS // (2 * len(fields) + 1))
+    with transaction.atomic(using=using):
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            values = {}
+            for field in fields:
+                whens = [When(pk=obj.pk, then=Value(getattr(obj, field.attname))) for obj in batch]
+                values[field.attname] = Case(*whens, output_field=field)
+            manager.filter(pk__in=[obj.pk for obj in batch]).update(**values)
+        if send_signals:
+            update_fields = frozenset(field.name for field in fields)
+            for obj in objs:
+                post_save.send(sender=model, instance=obj, created=False, update_fields=update_fields,
+                               raw=False, using=using)
+    return objs
+
+
+def set_related(instances, name, values, replace=False):
+    """
+    Bring the ``name`` many-to-many relation of every instance in line with
+    ``values`` (a mapping of instance to iterable of related primary keys).
+
+    Current rows are read with one query, then stale rows are removed with one
+    ``DELETE`` and missing rows added with one ``INSERT`` per batch. With
+    ``replace`` unset the relation is only extended, as with ``add()``.
+    """
+    _change_related(instances, name, values, add=True, remove=replace)
+
+
+def remove_related(instances, name, values):
+    """
+    Remove the related primary keys in ``values`` from the ``name`` relation
+    of every instance, as with ``remove()``, with one query to read the
+    current rows and one ``DELETE`` per batch.
+    """
+    _change_related(instances, name, values, add=False, remove=True)
+
+
+def _change_related(instances, name, values, add, remove):
+    instances = [instance for instance in instances if instance in values]
+    if not instances:
+        return
+    model = type(instances[0])
+    field = model._meta.get_field(name)
+    through = field.remote_field.through
+    related_model = field.remote_field.model
+    source = through._meta.get_field(field.m2m_field_name()).attname
+    target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+    using = router.db_for_write(through)
+    manager = through._default_manager.db_manager(using)
+
+    requested = dict((instance.pk, set(values[instance])) for instance in instances)
+    current = defaultdict(dict)
+    pks = list(requested)
+    for start in range(0, len(pks), MAX_QUERY_PARAMS):
+        existing = manager.filter(**{'%s__in' % source: pks[start:start + MAX_QUERY_PARAMS]})
+        for row_pk, source_pk, target_pk in existing.values_list('pk', source, target):
+            current[source_pk][target_pk] = row_pk
+
+    removed = {}
+    added = {}
+    for instance in instances:
+        existing = set(current[instance.pk])
+        if remove:
+            # Adding keeps the requested keys, removing drops them.
+            stale = existing - requested[instance.pk] if add else existing & requested[instance.pk]
+            if stale:
+                removed[instance] = stale
+        missing = requested[instance.pk] - existing
+        if add and missing:
+            added[instance] = missing
+
+    with transaction.atomic(using=using):
+        _send_m2m_changed(through, related_model, 'pre_remove', removed, using)
+        row_pks = [current[instance.pk][pk] for instance, stale in removed.items() for pk in stale]
+        for start in range(0, len(row_pks), MAX_QUERY_PARAMS):
+            # Through rows have no dependents and the signals are sent here,
+            # so the collector of ``delete()`` and its extra SELECT are skipped.
+            manager.filter(pk__in=row_pks[start:start + MAX_QUERY_PARAMS])._raw_delete(using)
+        _send_m2m_changed(through, related_model, 'post_remove', removed, using)
+
+        _send_m2m_changed(through, related_model, 'pre_add', added, using)
+        rows = [through(**{source: instance.pk, target: pk})
+                for instance, missing in added.items() for pk in sorted(missing)]
+        manager.bulk_create(rows)
+        _send_m2m_changed(through, related_model, 'post_add', added, using)
+
+
+def _send_m2m_changed(through, related_model, action, changes, using, reverse=False):
+    for instance, pk_set in changes.items():
+        m2m_changed.send(sender=through, action=action, instance=instance, reverse=reverse,
+                         model=related_model, pk_set=set(pk_set), using=using)
+
+
+def delete_relations(queryset):
+    """
+    Delete the many-to-many rows of the objects in ``queryset``, and of the
+    objects their deletion cascades to, with one ``DELETE`` per relation.
+
+    Receivers of ``m2m_changed`` keep ``delete()`` from deleting these rows
+    directly: it would load them and delete them by id in small batches.
+    The rows are read first and ``m2m_changed`` is sent around the ``DELETE``
+    as for ``remove()``, per object that had any.
+    """
+    using = queryset.db
+    pks = queryset.values_list('pk', flat=True)
+    for field in queryset.model._meta.get_fields():
+        if isinstance(field, ManyToManyRel):
+            through, reverse = field.through, True
+            source, target = field.field.m2m_reverse_field_name(), field.field.m2m_field_name()
+        elif field.many_to_many:
+            through, reverse = field.remote_field.through, False
+            source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+        else:
+            if field.one_to_many and field.on_delete is CASCADE:
+                manager = field.related_model._base_manager.using(using)
+                delete_relations(manager.filter(**{'%s__in' % field.field.name: pks}))
+            continue
+        rows = through._base_manager.using(using).filter(**{'%s__in' % source: pks})
+        source = through._meta.get_field(source).attname
+        target = through._meta.get_field(target).attname
+        related = defaultdict(set)
+        for source_pk, target_pk in rows.values_list(source, target):
+            related[source_pk].add(target_pk)
+        if not related:
+            continue
+        removed = dict((queryset.model(pk=pk), pk_set) for pk, pk_set in related.items())
+        _send_m2m_changed(through, field.related_model, 'pre_remove', removed, using, reverse)
+        rows._raw_delete(using)
+        _send_m2m_changed(through, field.related_model, 'post_remove', removed, using, reverse)
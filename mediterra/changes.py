@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Change feed.
+
+Every write to teachers, students, grades, specializations and their
+many-to-many relations appends a ``Change`` in the writing transaction, so
+the feed holds exactly the committed writes. Clients read it in id order from
+the last id they have seen and apply the changes to their copy of the data.
+
+Objects are named by their API routes, relations by route and field, e.g.
+``students.grades`` with the student as the object and the grade as the
+related object. Creates and updates carry the column values of the object,
+as in the CSV export; relation changes are separate entries. A deleted
+object has its relations removed first, with entries of their own, also for
+the objects its deletion cascades to.
+
+Ids must be handed out in commit order, or a client could read an id before
+a smaller one commits and skip it. SQLite serializes writers; elsewhere the
+feed table is locked against other writers from the first change of a
+transaction to its commit, while reads go on.
+"""
+from __future__ import unicode_literals, absolute_import
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from .bulk import insert_rows
+from .models import Teacher, Student, Grade, Specialization, Change
+
+FEED_MODELS = OrderedDict([
+    (Teacher, 'teachers'),
+    (Student, 'students'),
+    (Grade, 'grades'),
+    (Specialization, 'specializations'),
+])
+
+FEED_RELATIONS = OrderedDict([
+    (Teacher.specializations.through, ('teachers.specializations', Teacher.specializations.field)),
+    (Student.grades.through, ('students.grades', Student.grades.field)),
+])
+
+FEED_NAMES = list(FEED_MODELS.values()) + [name for name, field in FEED_RELATIONS.values()]
+
+COLUMNS = ['model', 'action', 'object_id', 'related_id', 'data', 'created_at']
+
+# Sent after changes are inserted, in the same transaction, for receivers
+# keeping derived tables in sync with the feed.
+changes_recorded = Signal(providing_args=['changes'])
+
+_local = threading.local()
+
+
+@contextmanager
+def collect_changes():
+    """
+    Hold back the changes recorded in the block and insert them together
+    at its end, so bulk writes add a single query.
+    """
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+    _local.pending = []
+    try:
+        yield
+        insert_changes(_local.pending)
+    finally:
+        _local.pending = None
+
+
+def insert_changes(changes):
+    """
+    Insert ``changes``, tuples of the ``COLUMNS`` but the time, without
+    going through model instances.
+    """
+    if changes:
+        connection = connections[router.db_for_write(Change)]
+        created_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        with transaction.atomic(using=connection.alias, savepoint=False):
+            lock_feed(connection)
+            insert_rows(Change, COLUMNS, [change + (created_at,) for change in changes])
+            changes_recorded.send(sender=Change, changes=changes)
+
+
+def lock_feed(connection):
+    """
+    Keep other transactions from inserting changes until this one ends.
+    """
+    if connection.vendor == 'postgresql':
+        # Conflicts with inserts but not with reads; taking it again in the
+        # same transaction is a no-op.
+        with connection.cursor() as cursor:
+            cursor.execute('LOCK TABLE %s IN EXCLUSIVE MODE' % connection.ops.quote_name(Change._meta.db_table))
+
+
+def add_changes(changes):
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.extend(changes)
+    else:
+        insert_changes(changes)
+
+
+def get_data(instance):
+    """
+    Column values of ``instance`` as a JSON object, foreign keys as ids.
+    """
+    data = OrderedDict((field.name, getattr(instance, field.attname)) for field in instance._meta.concrete_fields)
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def record_save(model, instance, created):
+    action = Change.CREATE if created else Change.UPDATE
+    add_changes([(FEED_MODELS[model], action, instance.pk, None, get_data(instance))])
+
+
+def record_delete(model, instance):
+    add_changes([(FEED_MODELS[model], Change.DELETE, instance.pk, None, '')])
+
+
+def get_related_pks(through, instance, reverse):
+    """
+    Primary keys of the objects currently related to ``instance``.
+    """
+    field = FEED_RELATIONS[through][1]
+    source = through._meta.get_field(field.m2m_field_name()).attname
+    target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+    if reverse:
+        source, target = target, source
+    return list(through._default_manager.filter(**{source: instance.pk}).values_list(target, flat=True))
+
+
+def record_relation(through, action, instance, reverse, pk_set):
+    """
+    Record ``action``, ``Change.ADD`` or ``Change.REMOVE``, of the related
+    ``pk_set`` of ``instance``.
+    """
+    name = FEED_RELATIONS[through][0]
+    pairs = [(instance.pk, pk) for pk in sorted(pk_set)]
+    if reverse:
+        pairs = [(object_id, related_id) for related_id, object_id in pairs]
+    add_changes([(name, action, object_id, related_id, '') for object_id, related_id in pairs])
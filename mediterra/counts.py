@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Related object counts: students per grade, grades per teacher and teachers
+per specialization.
+
+Counts are annotated as correlated subqueries, so a page of results costs
+one index lookup per row whatever the size of the related tables, and they
+are always current. Filtering or ordering by a count evaluates it for every
+row of the table.
+"""
+from __future__ import unicode_literals, absolute_import
+from collections import OrderedDict
+from django.db.models import IntegerField
+from django.db.models.expressions import RawSQL
+from .models import Teacher, Student, Grade, Specialization
+
+
+class RelatedCount(object):
+    """
+    Number of rows of ``model`` whose ``field_name`` foreign key points to
+    the annotated object.
+    """
+    def __init__(self, label, model, field_name):
+        self.label = label
+        self.model = model
+        self.field_name = field_name
+
+    def as_expression(self):
+        field = self.model._meta.get_field(self.field_name)
+        target = field.target_field
+        sql = '(SELECT COUNT(*) FROM {table} WHERE {table}.{column} = {outer}.{key})'.format(
+            table=self.model._meta.db_table, column=field.column,
+            outer=target.model._meta.db_table, key=target.column)
+        return RawSQL(sql, [], output_field=IntegerField())
+
+
+COUNTS = {
+    Grade: OrderedDict([
+        ('student_count', RelatedCount('Количество учеников', Student.grades.through, 'grade')),
+    ]),
+    Teacher: OrderedDict([
+        ('grade_count', RelatedCount('Количество классов', Grade, 'teacher')),
+    ]),
+    Specialization: OrderedDict([
+        ('teacher_count', RelatedCount('Количество учителей', Teacher.specializations.through, 'specialization')),
+    ]),
+}
+
+
+def get_counts(model):
+    return COUNTS.get(model, OrderedDict())
+
+
+def annotate_counts(queryset, names=None):
+    """
+    Annotate ``queryset`` with the counts of its model listed in ``names``
+    (all of them by default) that it does not have yet.
+    """
+    annotations = dict((name, count.as_expression()) for name, count in get_counts(queryset.model).items()
+                       if (names is None or name in names) and name not in queryset.query.annotations)
+    return queryset.annotate(**annotations) if annotations else queryset
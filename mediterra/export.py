@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from collections import OrderedDict, defaultdict
+from rest_framework.utils import model_meta
+from .bulk import MAX_QUERY_PARAMS
+
+
+def get_export_fields(model):
+    """
+    Return ``(field names, to-many relations)`` for ``model`` in the order
+    ``ModelSerializer`` with ``fields = '__all__'`` emits them.
+    """
+    info = model_meta.get_field_info(model)
+    names = [info.pk.name] + list(info.fields) + list(info.forward_relations)
+    to_many = [name for name, relation in info.forward_relations.items() if relation.to_many]
+    return names, to_many
+
+
+def fetch_related_pks(model, name, pks):
+    """
+    Map each of ``pks`` to the list of primary keys of its ``name`` relation
+    with one query on the through table per batch of ``pks``. Related keys are
+    listed in the default ordering of the related model, as the serializers
+    list them.
+    """
+    field = model._meta.get_field(name)
+    through = field.remote_field.through
+    source = field.m2m_field_name()
+    target = field.m2m_reverse_field_name()
+    ordering = [through._meta.get_field(source).attname]
+    for item in field.remote_field.model._meta.ordering or ['pk']:
+        ordering.append('%s%s__%s' % ('-' if item.startswith('-') else '', target, item.lstrip('-')))
+    related = defaultdict(list)
+    pks = list(pks)
+    for start in range(0, len(pks), MAX_QUERY_PARAMS):
+        rows = through.objects.filter(**{'%s__in' % source: pks[start:start + MAX_QUERY_PARAMS]}).order_by(*ordering)
+        for source_pk, target_pk in rows.values_list(source, target).iterator():
+            related[source_pk].append(target_pk)
+    return related
+
+
+def build_rows(model, rows, names=None):
+    """
+    Shape ``values()`` dicts of ``model`` like the output of a ``ModelSerializer``
+    with ``fields = '__all__'``, adding to-many relations with one query each.
+    ``names`` selects the output fields, which may include annotations of the
+    rows; rows must still include the primary key.
+    """
+    fields, to_many = get_export_fields(model)
+    if names is None:
+        names = fields
+    to_many = [name for name in to_many if name in names]
+    pks = [row[fields[0]] for row in rows]
+    related = dict((name, fetch_related_pks(model, name, pks)) for name in to_many)
+    result = []
+    for row in rows:
+        for name in to_many:
+            row[name] = related[name].get(row[fields[0]], [])
+        result.append(OrderedDict((name, row[name]) for name in names))
+    return result
+
+
+def iter_rows(queryset, chunk_size=2000):
+    """
+    Yield the rows of ``queryset`` as dicts, walking the primary key in chunks
+    of ``chunk_size`` so that memory stays flat whatever the table size.
+    """
+    model = queryset.model
+    names, to_many = get_export_fields(model)
+    columns = [name for name in names if name not in to_many]
+    queryset = queryset.prefetch_related(None).order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(chunk.values_list(*columns)[:chunk_size].iterator())
+        if not rows:
+            break
+        pks = [row[0] for row in rows]
+        related = dict((name, fetch_related_pks(model, name, pks)) for name in to_many)
+        for row in rows:
+            values = dict(zip(columns, row))
+            for name in to_many:
+                values[name] = related[name].get(row[0], [])
+            yield OrderedDict((name, values[name]) for name in names)
+        if len(rows) < chunk_size:
+            break
+        last_pk = pks[-1]
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Small integer values shared by the processes of a host, one file per key in
+``settings.STATE_DIR``.
+
+Files are read and written under an exclusive ``flock``, so concurrent
+processes never lose an update, and overwritten in place, so their number
+follows the number of keys in use rather than the traffic. Keys no longer
+used leave their file behind until it is deleted from outside.
+"""
+from __future__ import unicode_literals, absolute_import
+import errno
+import hashlib
+import os
+from contextlib import contextmanager
+from django.conf import settings
+from django.utils.encoding import force_bytes
+
+try:
+    import fcntl
+except ImportError:
+    # Without flock updates are not atomic, which only a single process,
+    # such as the development server, can afford.
+    fcntl = None
+
+
+def get_store():
+    return FileStore(settings.STATE_DIR)
+
+
+class FileStore(object):
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_path(self, key):
+        return os.path.join(self.directory, hashlib.md5(force_bytes(key)).hexdigest())
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Open the file of ``key``, creating it empty, and hold an exclusive
+        lock on it in the block.
+        """
+        path = self.get_path(key)
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            try:
+                os.makedirs(self.directory)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield fd
+        finally:
+            # Closing the file releases the lock.
+            os.close(fd)
+
+    def read(self, fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            return [int(value) for value in os.read(fd, 64).split()]
+        except ValueError:
+            # Left over by a process killed while writing.
+            return []
+
+    def write(self, fd, values):
+        data = force_bytes(' '.join('%d' % value for value in values))
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, data)
+        os.ftruncate(fd, len(data))
+
+    def incr(self, key, window):
+        """
+        Count one more event of ``key`` in ``window``, a number, and return
+        the count; counts of other windows are dropped.
+        """
+        with self.lock(key) as fd:
+            values = self.read(fd)
+            count = values[1] + 1 if len(values) == 2 and values[0] == window else 1
+            self.write(fd, [window, count])
+        return count
+
+    def get(self, key, default=None):
+        try:
+            fd = os.open(self.get_path(key), os.O_RDONLY)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            return default
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+            values = self.read(fd)
+        finally:
+            os.close(fd)
+        return values[0] if len(values) == 1 else default
+
+    def set(self, key, value):
+        with self.lock(key) as fd:
+            self.write(fd, [value])
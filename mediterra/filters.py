@@ -1,24 +1,83 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
 import django_filters
-from .models import Teacher, Student, Grade
+from django_filters.constants import EMPTY_VALUES
+from rest_framework.filters import BaseFilterBackend
+from .counts import annotate_counts
+from .models import Teacher, Student, Grade, Specialization
+from .search import SEARCH_FIELDS, get_terms, search
+
+
+class CountFilter(django_filters.NumberFilter):
+    """
+    Filter on one of the counts of ``counts.py``, annotating it when needed.
+    """
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        return super(CountFilter, self).filter(annotate_counts(qs, [self.name]), value)
+
+
+class CountOrderingFilter(django_filters.OrderingFilter):
+    """
+    ``OrderingFilter`` that annotates the counts it orders by.
+    """
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        qs = annotate_counts(qs, [self.get_ordering_value(param).lstrip('-') for param in value])
+        return super(CountOrderingFilter, self).filter(qs, value)
 
 
 class TeacherFilter(django_filters.rest_framework.FilterSet):
+    grade_count = CountFilter(name='grade_count')
+    grade_count__gte = CountFilter(name='grade_count', lookup_expr='gte')
+    grade_count__lte = CountFilter(name='grade_count', lookup_expr='lte')
+    ordering = CountOrderingFilter(fields=['last_name', 'first_name', 'grade_count'])
+
     class Meta:
         model = Teacher
-        fields = '__all__'
+        fields = ['first_name', 'last_name', 'specializations']
 
 
 class StudentFilter(django_filters.rest_framework.FilterSet):
     class Meta:
         model = Student
-        fields = '__all__'
+        fields = ['first_name', 'last_name', 'grades']
 
 
 class GradeFilter(django_filters.rest_framework.FilterSet):
     teacher = django_filters.ModelMultipleChoiceFilter(queryset=Teacher.objects.all())
+    student_count = CountFilter(name='student_count')
+    student_count__gte = CountFilter(name='student_count', lookup_expr='gte')
+    student_count__lte = CountFilter(name='student_count', lookup_expr='lte')
+    ordering = CountOrderingFilter(fields=['title', 'student_count'])
 
     class Meta:
         model = Grade
-        fields = '__all__'
+        fields = ['teacher', 'specialization', 'title']
+
+
+class SpecializationFilter(django_filters.rest_framework.FilterSet):
+    teacher_count = CountFilter(name='teacher_count')
+    teacher_count__gte = CountFilter(name='teacher_count', lookup_expr='gte')
+    teacher_count__lte = CountFilter(name='teacher_count', lookup_expr='lte')
+    ordering = CountOrderingFilter(fields=['title', 'teacher_count'])
+
+    class Meta:
+        model = Specialization
+        fields = ['title']
+
+
+class SearchFilter(BaseFilterBackend):
+    """
+    Word prefix search with ``?search=``, ordered by relevance and then by
+    the default ordering of the model.
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if queryset.model not in SEARCH_FIELDS or not get_terms(query):
+            return queryset
+        return search(queryset, query).order_by('search_rank', *queryset.model._meta.ordering)
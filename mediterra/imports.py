@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk imports of teachers, grades, students and enrollments.
+
+Files are read as a stream: CSV in the layout of the CSV export or, with
+``openpyxl`` installed, the first sheet of an XLSX workbook. A header row
+names the fields, then every row is one object, with related objects as
+primary keys and to-many relations as space separated primary keys.
+
+Rows are handled in chunks, each in its own transaction. A chunk is parsed,
+the objects it references and the objects it updates are looked up with a few
+queries, and the rest is written with ``bulk_insert``, ``bulk_update`` and
+``set_related``. Objects are matched on their ``id`` when the file has the
+column and the object exists, otherwise on a natural key, such as the last and
+first name of a student, so importing a file again updates what it created.
+Rows that fail validation, including rows for an object already imported from
+the file, are reported and skipped; the rest of the chunk is saved.
+"""
+from __future__ import unicode_literals, absolute_import
+import csv
+import os
+from collections import OrderedDict, defaultdict
+from itertools import islice
+from timeit import default_timer
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connections, router
+from django.utils import six
+from django.utils.encoding import force_text
+from .bulk import MAX_QUERY_PARAMS, bulk_insert, bulk_update, in_bulk, set_related
+from .changes import collect_changes
+from .jobs import run_atomic
+from .models import Teacher, Student, Grade, TeacherSpecializations
+from .versions import bump_once
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+CHUNK_SIZE = 2000
+
+FILE_FORMATS = ['.csv'] + (['.xlsx'] if openpyxl is not None else [])
+
+
+def read_csv(lines):
+    """
+    Yield the rows of UTF-8 encoded CSV ``lines`` as lists of strings.
+    """
+    if six.PY2:
+        rows = ([value.decode('utf-8') for value in row] for row in csv.reader(lines))
+    else:
+        rows = csv.reader(line.decode('utf-8') for line in lines)
+    for number, row in enumerate(rows):
+        if number == 0 and row:
+            row[0] = row[0].lstrip('\ufeff')
+        yield row
+
+
+def read_xlsx(fileobj):
+    """
+    Yield the rows of the first sheet of an XLSX workbook as lists of strings.
+    """
+    workbook = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        for cells in workbook.worksheets[0].iter_rows(values_only=True):
+            row = []
+            for value in cells:
+                if value is None:
+                    value = ''
+                elif isinstance(value, float) and value.is_integer():
+                    value = int(value)
+                row.append(force_text(value))
+            yield row
+    finally:
+        workbook.close()
+
+
+def read_file(fileobj, name):
+    """
+    Yield the rows of ``fileobj``, read according to the extension of ``name``.
+    """
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in FILE_FORMATS:
+        raise ValueError('Поддерживаются файлы %s.' % ', '.join(FILE_FORMATS))
+    if extension == '.xlsx':
+        return read_xlsx(fileobj)
+    return read_csv(fileobj)
+
+
+class Row(object):
+    def __init__(self, number):
+        self.number = number
+        self.pk = None
+        self.data = {}
+        self.errors = OrderedDict()
+
+    def add_error(self, name, message):
+        self.errors.setdefault(name, []).append(message)
+
+    def copy(self):
+        row = Row(self.number)
+        row.pk = self.pk
+        row.data = dict(self.data)
+        row.errors = OrderedDict((name, list(messages)) for name, messages in self.errors.items())
+        return row
+
+
+class Importer(object):
+    """
+    Parses rows into values of the fields of ``model`` and checks that the
+    objects they reference exist. Subclasses save the valid rows.
+    """
+    model = None
+    ignored_columns = ('id',)
+    error_messages = {
+        'unknown_columns': 'Неизвестные столбцы: {names}.',
+        'missing_columns': 'Нет обязательных столбцов: {names}.',
+        'does_not_exist': 'Объект с id "{pk_value}" не существует.',
+    }
+
+    def __init__(self, header):
+        self.columns = []
+        unknown = []
+        for name in header:
+            field = None
+            if name not in self.ignored_columns:
+                field = self.get_field(name)
+                if field is None:
+                    unknown.append(name)
+            self.columns.append(field)
+        if unknown:
+            raise ValueError(self.error_messages['unknown_columns'].format(names=', '.join(unknown)))
+        self.fields = [field for field in self.columns if field is not None]
+        missing = [field.name for field in self.get_required_fields() if field not in self.fields]
+        if missing:
+            raise ValueError(self.error_messages['missing_columns'].format(names=', '.join(missing)))
+        self.saved_pks = set()
+        self.imported_pks = set()
+
+    def get_field(self, name):
+        try:
+            field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if field.auto_created or not field.editable or field.one_to_one or field.one_to_many:
+            return None
+        return field
+
+    def get_required_fields(self):
+        return [field for field in self.model._meta.fields if field.many_to_one]
+
+    def parse(self, number, values):
+        row = Row(number)
+        values = list(values) + [''] * (len(self.columns) - len(values))
+        for field, value in zip(self.columns, values):
+            if field is None:
+                continue
+            try:
+                row.data[field.name] = self.to_python(field, value.strip())
+            except ValidationError as exc:
+                for message in exc.messages:
+                    row.add_error(field.name, message)
+        return row
+
+    def to_python(self, field, value):
+        if field.many_to_many:
+            pks = [field.related_model._meta.pk.to_python(pk) for pk in value.split()]
+            if not pks and not field.blank:
+                raise ValidationError(field.error_messages['blank'])
+            return pks
+        if field.many_to_one:
+            if not value:
+                raise ValidationError(field.error_messages['blank'])
+            return field.related_model._meta.pk.to_python(value)
+        return field.clean(value, None)
+
+    def check_references(self, rows):
+        """
+        Check that the objects referenced by ``rows`` exist, with one query
+        per related model and batch of primary keys.
+        """
+        for field in self.fields:
+            if not field.is_relation:
+                continue
+            values = [(row, row.data[field.name] if field.many_to_many else [row.data[field.name]])
+                      for row in rows if field.name in row.data]
+            pks = list(set(pk for row, row_pks in values for pk in row_pks))
+            existing = set()
+            manager = field.related_model._default_manager
+            for start in range(0, len(pks), MAX_QUERY_PARAMS):
+                existing.update(manager.filter(pk__in=pks[start:start + MAX_QUERY_PARAMS])
+                                .values_list('pk', flat=True))
+            for row, row_pks in values:
+                for pk in row_pks:
+                    if pk not in existing:
+                        row.add_error(field.name, self.error_messages['does_not_exist'].format(pk_value=pk))
+
+    def import_chunk(self, rows):
+        """
+        Save the valid ``rows`` and record errors on the others.
+        """
+        self.saved_pks = set()
+        rows = [row for row in rows if not row.errors]
+        self.check_references(rows)
+        self.save([row for row in rows if not row.errors])
+
+    def save(self, rows):
+        raise NotImplementedError
+
+    def commit(self):
+        """
+        Remember the objects saved by the last chunk once its transaction has
+        been committed.
+        """
+        self.imported_pks.update(self.saved_pks)
+
+
+class ModelImporter(Importer):
+    """
+    Creates or updates objects matched on their primary key in the ``id``
+    column or, without one or for unknown ids, on the ``key`` fields. New
+    objects need every field that cannot be blank, existing ones get only the
+    columns of the file. Each object can be imported once per file; the
+    primary keys seen are kept for the whole import.
+    """
+    key = ()
+    error_messages = dict(Importer.error_messages, **{
+        'required': 'Обязательное поле.',
+        'multiple_objects': 'Найдено несколько объектов с такими значениями полей {names}, укажите id.',
+        'duplicate': 'Объект уже загружен из предыдущей строки файла, различите объекты столбцом id.',
+    })
+
+    def __init__(self, header):
+        super(ModelImporter, self).__init__(header)
+        header = list(header)
+        self.pk_index = header.index('id') if 'id' in header else None
+
+    def get_required_fields(self):
+        return [self.model._meta.get_field(name) for name in self.key]
+
+    def get_key(self, row):
+        return tuple(row.data[name] for name in self.key)
+
+    def parse(self, number, values):
+        row = super(ModelImporter, self).parse(number, values)
+        value = values[self.pk_index].strip() if self.pk_index is not None and self.pk_index < len(values) else ''
+        if value:
+            try:
+                row.pk = self.model._meta.pk.to_python(value)
+            except ValidationError as exc:
+                for message in exc.messages:
+                    row.add_error('id', message)
+        return row
+
+    def find_existing(self, rows):
+        """
+        Return the objects with the primary keys of ``rows`` by primary key,
+        and the objects matching the keys of the other rows by key, as lists.
+        Keys are looked up as a whole, with one query per batch of keys.
+        """
+        by_pk = in_bulk(self.model._default_manager.all(), [row.pk for row in rows if row.pk is not None])
+        keys = list(set(self.get_key(row) for row in rows if row.pk not in by_pk))
+        connection = connections[router.db_for_read(self.model)]
+        columns = ['%s = %%s' % connection.ops.quote_name(self.model._meta.get_field(name).column)
+                   for name in self.key]
+        condition = '(%s)' % ' AND '.join(columns)
+        attnames = [self.model._meta.get_field(name).attname for name in self.key]
+        by_key = defaultdict(list)
+        batch_size = MAX_QUERY_PARAMS // len(self.key)
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            # A raw OR of the key conditions, as building one ``Q`` per key is
+            # several times slower than running the query.
+            queryset = self.model._default_manager.extra(
+                where=[' OR '.join([condition] * len(batch))], params=[value for key in batch for value in key])
+            for instance in queryset.order_by('pk'):
+                by_key[tuple(getattr(instance, attname) for attname in attnames)].append(instance)
+        return by_pk, by_key
+
+    def clean(self, row, instance, data):
+        """
+        Check ``data``, the values ``row`` adds to those of the earlier rows
+        with its key, to be written to ``instance`` (None for a new object).
+        """
+        if instance is None:
+            for field in self.model._meta.get_fields():
+                if not getattr(field, 'editable', False) or field.auto_created or field.blank:
+                    continue
+                if field.name not in data:
+                    row.add_error(field.name, self.error_messages['required'])
+
+    def save(self, rows):
+        by_pk, by_key = self.find_existing(rows)
+        changes = OrderedDict()
+        for row in rows:
+            instance = by_pk.get(row.pk)
+            if instance is None:
+                instances = by_key.get(self.get_key(row), [])
+                if len(instances) > 1:
+                    row.add_error('non_field_errors', self.error_messages['multiple_objects'].format(
+                        names=', '.join(self.key)))
+                    continue
+                instance = instances[0] if instances else None
+            # New objects are told apart by their key until they are saved.
+            target = self.get_key(row) if instance is None else instance.pk
+            if target in changes or target in self.imported_pks:
+                row.add_error('non_field_errors', self.error_messages['duplicate'])
+                continue
+            data = dict(row.data)
+            self.clean(row, instance, data)
+            if not row.errors:
+                changes[target] = instance, data
+
+        fields = [field for field in self.fields if not field.many_to_many]
+        created, updated = [], []
+        for key, (instance, data) in changes.items():
+            if instance is None:
+                instance = self.model(**dict((field.attname, data[field.name])
+                                             for field in self.fields if field.name in data
+                                             and not field.many_to_many))
+                created.append(instance)
+            else:
+                changed = False
+                for field in fields:
+                    if field.name in data and getattr(instance, field.attname) != data[field.name]:
+                        setattr(instance, field.attname, data[field.name])
+                        changed = True
+                if changed:
+                    updated.append(instance)
+            changes[key] = instance, data
+        bulk_insert(self.model, created)
+        bulk_update(self.model, updated, [field.name for field in fields])
+        self.saved_pks = set(instance.pk for instance, data in changes.values())
+        for field in self.fields:
+            if field.many_to_many:
+                values = dict((instance, data[field.name]) for instance, data in changes.values()
+                              if field.name in data)
+                set_related(list(values), field.name, values, replace=True)
+
+
+class TeacherImporter(ModelImporter):
+    model = Teacher
+    key = ('last_name', 'first_name')
+
+
+class StudentImporter(ModelImporter):
+    model = Student
+    key = ('last_name', 'first_name')
+
+
+class GradeImporter(ModelImporter):
+    """
+    Grades are matched on their title and teacher and, as in ``Grade.clean``,
+    must have one of the specializations of their teacher.
+    """
+    model = Grade
+    key = ('title', 'teacher')
+
+    def save(self, rows):
+        self.teacher_specializations = TeacherSpecializations()
+        self.teacher_specializations.load(row.data['teacher'] for row in rows)
+        super(GradeImporter, self).save(rows)
+
+    def clean(self, row, instance, data):
+        super(GradeImporter, self).clean(row, instance, data)
+        if row.errors:
+            return
+        grade = Grade(teacher_id=data['teacher'],
+                      specialization_id=data.get('specialization', getattr(instance, 'specialization_id', None)))
+        try:
+            grade.check_specialization(self.teacher_specializations)
+        except ValidationError as exc:
+            for message in exc.messages:
+                row.add_error('specialization', message)
+
+
+class EnrollmentImporter(Importer):
+    """
+    Adds students to grades, one enrollment per row; existing enrollments
+    are kept.
+    """
+    model = Student.grades.through
+
+    def save(self, rows):
+        values = defaultdict(set)
+        for row in rows:
+            values[row.data['student']].add(row.data['grade'])
+        students = [Student(pk=pk) for pk in sorted(values)]
+        set_related(students, 'grades', dict((student, values[student.pk]) for student in students))
+
+
+IMPORTERS = OrderedDict([
+    ('teachers', TeacherImporter),
+    ('grades', GradeImporter),
+    ('students', StudentImporter),
+    ('enrollments', EnrollmentImporter),
+])
+
+
+def import_rows(target, rows, chunk_size=CHUNK_SIZE, report=None):
+    """
+    Import ``rows``, lists of strings starting with the header, into
+    ``target``, one of ``IMPORTERS``. Only one chunk of rows is held in
+    memory at a time; empty rows are skipped.
+
+    ``report`` is called in the transaction of every chunk with the number of
+    its rows and ``(row number, errors)`` for the failed ones. Returns the
+    numbers of rows and failed rows and the seconds spent.
+    """
+    start = default_timer()
+    rows = iter(rows)
+    header = next(rows, None)
+    if not header:
+        raise ValueError('Файл пуст.')
+    importer = IMPORTERS[target](header)
+    number = processed = failed = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        parsed = []
+        for values in chunk:
+            number += 1
+            if any(value.strip() for value in values):
+                parsed.append(importer.parse(number, values))
+        failed += run_atomic(import_chunk, importer, parsed, report)
+        importer.commit()
+        processed += len(parsed)
+    return processed, failed, default_timer() - start
+
+
+def import_chunk(importer, rows, report=None):
+    # Retried while the database is locked, so errors found by an attempt
+    # must not stay on the rows.
+    rows = [row.copy() for row in rows]
+    with bump_once(), collect_changes():
+        importer.import_chunk(rows)
+    errors = [(row.number, row.errors) for row in rows if row.errors]
+    if report is not None:
+        report(len(rows), errors)
+    return len(errors)
+
+
+def run_import(job, progress):
+    job.file.open('rb')
+    try:
+        rows, failed, seconds = import_rows(job.target, read_file(job.file, job.file.name), report=progress.add)
+    finally:
+        job.file.close()
+    return 'Обработано строк: %d, с ошибками: %d, %d строк/с.' % (rows, failed, rows / max(seconds, 1e-6))
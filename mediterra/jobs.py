@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Background jobs.
+
+Jobs are rows of the ``Job`` table. ``manage.py worker`` claims pending jobs
+and runs them in a pool of processes, each job with the handler registered
+for its kind in ``HANDLERS``. A handler is called with the job and a
+``Progress`` recording processed rows and per-row errors as it goes, so the
+API can report on the job while it runs.
+
+A job whose worker is killed would stay running forever, so workers fail the
+running jobs of dead workers of their host, and any job running for longer
+than ``settings.JOB_TIMEOUT`` seconds, which also covers pool processes that
+died with their job.
+"""
+from __future__ import unicode_literals, absolute_import
+import errno
+import json
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+from django.db import OperationalError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Job, JobError
+
+logger = logging.getLogger('mediterra.jobs')
+
+HANDLERS = {
+    Job.IMPORT: 'mediterra.imports.run_import',
+}
+
+# Attempts at a transaction while the database is locked, and seconds before
+# the first retry; the delay grows up to ten times that.
+LOCKED_ATTEMPTS = 50
+LOCKED_DELAY = 0.1
+
+WORKER_GONE_MESSAGE = 'Обработчик задачи остановлен до ее завершения.'
+TIMEOUT_MESSAGE = 'Задача не завершилась за {timeout} с.'
+
+
+def get_worker_name():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def is_alive(worker):
+    """
+    Whether the worker named ``worker`` is still running. Workers of other
+    hosts cannot be checked and are taken to be.
+    """
+    host, _, pid = worker.rpartition(':')
+    if os.name != 'posix' or host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+def reclaim_jobs(timeout):
+    """
+    Fail the running jobs of dead workers and the jobs started more than
+    ``timeout`` seconds ago, and return their ids.
+    """
+    started_before = timezone.now() - timedelta(seconds=timeout)
+    failed = []
+    running = Job.objects.filter(status=Job.RUNNING).order_by('id').values_list('pk', 'worker', 'started_at')
+    for pk, worker, started_at in running:
+        if not is_alive(worker):
+            message = WORKER_GONE_MESSAGE
+        elif started_at is not None and started_at < started_before:
+            message = TIMEOUT_MESSAGE.format(timeout=timeout)
+        else:
+            continue
+        # The worker may finish the job in the meantime.
+        if Job.objects.filter(pk=pk, status=Job.RUNNING, worker=worker).update(
+                status=Job.FAILED, message=message, finished_at=timezone.now()):
+            logger.warning('Job %s failed: %s', pk, message)
+            failed.append(pk)
+    return failed
+
+
+def claim_jobs(limit):
+    """
+    Mark up to ``limit`` pending jobs as running and return them, oldest
+    first. A job is claimed with a conditional update, so concurrent workers
+    never run the same job.
+    """
+    claimed = []
+    if limit < 1:
+        return claimed
+    pks = list(Job.objects.filter(status=Job.PENDING).order_by('id').values_list('pk', flat=True)[:limit * 2])
+    for pk in pks:
+        if Job.objects.filter(pk=pk, status=Job.PENDING).update(
+                status=Job.RUNNING, worker=get_worker_name(), started_at=timezone.now()):
+            claimed.append(pk)
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def run_atomic(func, *args):
+    """
+    Call ``func`` in a transaction. SQLite has a single writer and fails
+    instead of waiting when two transactions that read first then try to
+    write, so the transaction is retried while the database is locked.
+    """
+    for attempt in range(1, LOCKED_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                return func(*args)
+        except OperationalError as exc:
+            if attempt == LOCKED_ATTEMPTS or 'locked' not in str(exc):
+                raise
+        time.sleep(LOCKED_DELAY * min(attempt, 10))
+
+
+class Progress(object):
+    """
+    Saves the progress of a running job.
+    """
+    def __init__(self, job):
+        self.job = job
+
+    def add(self, rows, errors=()):
+        """
+        Count ``rows`` more processed rows and save ``errors``, a list of
+        ``(row number, error details)`` for the rows that failed. Called in
+        the transaction writing the rows, progress is saved with them.
+        """
+        errors = list(errors)
+        JobError.objects.bulk_create([JobError(job=self.job, row=row, errors=json.dumps(details))
+                                      for row, details in errors])
+        Job.objects.filter(pk=self.job.pk).update(processed_rows=F('processed_rows') + rows,
+                                                  failed_rows=F('failed_rows') + len(errors))
+
+
+def run_job(pk):
+    """
+    Run the claimed job ``pk`` and record how it ended. Returns the final status.
+    """
+    job = Job.objects.get(pk=pk)
+    try:
+        handler = import_string(HANDLERS[job.kind])
+        message = handler(job, Progress(job)) or ''
+    except Exception as exc:
+        logger.exception('Job %s failed', job.pk)
+        job.status, job.message = Job.FAILED, '%s: %s' % (type(exc).__name__, exc)
+    else:
+        job.status, job.message = Job.DONE, message
+    job.finished_at = timezone.now()
+    # A job failed by ``reclaim_jobs`` meanwhile keeps its status.
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=job.worker).update(
+        status=job.status, message=job.message, finished_at=job.finished_at)
+    return job.status
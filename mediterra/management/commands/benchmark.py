@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import io
+import json
+import os
+import platform
+import subprocess
+from datetime import datetime
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from ...benchmarks import CASES, get_fixture, run_case
+from ...models import Student
+from ...seeding import DEFAULT_VOLUMES, seed
+
+
+def get_revision():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                         stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+class Command(BaseCommand):
+    help = ('Seed a test database and measure latency, query count and peak memory of the API routes. '
+            'The database is created and destroyed like the one of "manage.py test", '
+            'so the TEST settings of the default database apply.')
+
+    def add_arguments(self, parser):
+        for name, default in sorted(DEFAULT_VOLUMES.items()):
+            parser.add_argument('--%s' % name, type=int, default=default,
+                                help='Number of %s to seed (default %d).' % (name, default))
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated data.')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per case.')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per case.')
+        parser.add_argument('--case', action='append', dest='cases', default=[],
+                            help='Only run cases whose name contains this value; can be repeated.')
+        parser.add_argument('--output', default='benchmark.json', help='File to save the results to.')
+        parser.add_argument('--compare', help='Results of an earlier run to compare with.')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the seeded database between runs.')
+
+    def handle(self, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1.')
+        cases = [case for case in CASES
+                 if not options['cases'] or any(name in case.name for name in options['cases'])]
+        if not cases:
+            raise CommandError('No cases match %s.' % ', '.join(options['cases']))
+        baseline = None
+        if options['compare']:
+            with io.open(options['compare'], encoding='utf-8') as f:
+                baseline = dict((result['name'], result) for result in json.load(f)['results'])
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            volumes = dict((name, options[name]) for name in DEFAULT_VOLUMES)
+            if not Student.objects.exists():
+                self.stdout.write('Seeding %s' % ', '.join('%s=%d' % item for item in sorted(volumes.items())))
+                seed(random_seed=options['seed'], **volumes)
+            fixture = get_fixture()
+            results = []
+            for case in cases:
+                result = run_case(case, fixture, options['repeat'], options['warmup'])
+                results.append(result)
+                self.report(result, baseline and baseline.get(case.name))
+                if result['status'] != case.status:
+                    self.stderr.write('%s: expected status %d, got %d' % (case.name, case.status, result['status']))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        data = {
+            'revision': get_revision(),
+            'date': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'volumes': volumes,
+            'seed': options['seed'],
+            'results': results,
+        }
+        with io.open(options['output'], 'w', encoding='utf-8') as f:
+            f.write(json.dumps(data, ensure_ascii=False, indent=2, separators=(',', ': '), sort_keys=True))
+        self.stdout.write('Results saved to %s' % os.path.abspath(options['output']))
+
+    def report(self, result, baseline=None):
+        latency = result['latency_ms']
+        line = '%-32s %3d  p50 %8.2f ms  p90 %8.2f ms  p99 %8.2f ms  %4d queries' % (
+            result['name'], result['status'], latency['p50'], latency['p90'], latency['p99'], result['queries'])
+        if result['peak_memory_kb'] is not None:
+            line += '  %7d KiB' % result['peak_memory_kb']
+        if baseline:
+            change = (latency['p50'] / baseline['latency_ms']['p50'] - 1) * 100
+            line += '  p50 %+.0f%%, queries %+d' % (change, result['queries'] - baseline['queries'])
+        self.stdout.write(line)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import json
+from django.core.management.base import BaseCommand, CommandError
+from ...imports import CHUNK_SIZE, FILE_FORMATS, IMPORTERS, import_rows, read_file
+
+
+class Command(BaseCommand):
+    help = ('Import a CSV or XLSX file in chunks, in the layout of the CSV export. '
+            'Objects are matched on natural keys, so a file can be imported again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=list(IMPORTERS), help='Kind of objects in the file.')
+        parser.add_argument('path', help='File to import (%s).' % ', '.join(FILE_FORMATS))
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Rows written per transaction (default %d).' % CHUNK_SIZE)
+
+    def handle(self, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('The chunk size must be positive.')
+
+        def report(rows, errors):
+            for number, details in errors:
+                self.stderr.write('Row %d: %s' % (number, json.dumps(details, ensure_ascii=False)))
+
+        try:
+            with open(options['path'], 'rb') as fileobj:
+                rows, failed, seconds = import_rows(options['target'], read_file(fileobj, options['path']),
+                                                    chunk_size=options['chunk_size'], report=report)
+        except (IOError, ValueError) as exc:
+            raise CommandError(exc)
+        self.stdout.write('%d rows, %d failed, %.2f s, %d rows/s' % (rows, failed, seconds, rows / max(seconds, 1e-6)))
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from django.core.management.base import BaseCommand, CommandError
+from ...seeding import DEFAULT_VOLUMES, seed
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with generated specializations, teachers, grades and students. '
+            'The same volumes and seed produce the same data on an empty database.')
+
+    def add_arguments(self, parser):
+        for name, default in sorted(DEFAULT_VOLUMES.items()):
+            parser.add_argument('--%s' % name, type=int, default=default,
+                                help='Number of %s to create (default %d).' % (name, default))
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated data.')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Students written per batch.')
+
+    def handle(self, **options):
+        volumes = dict((name, options[name]) for name in DEFAULT_VOLUMES)
+        if min(volumes.values()) < 0 or options['chunk_size'] < 1:
+            raise CommandError('Volumes cannot be negative and the chunk size must be positive.')
+        if volumes['grades'] and not volumes['teachers']:
+            raise CommandError('Grades need at least one teacher.')
+        if volumes['teachers'] and not volumes['specializations']:
+            raise CommandError('Teachers need at least one specialization.')
+
+        def report(table, rows, seconds):
+            if options['verbosity'] > 1:
+                self.stdout.write('%s: %d rows, %.1f s' % (table, rows, seconds))
+
+        stats = seed(random_seed=options['seed'], chunk_size=options['chunk_size'], report=report, **volumes)
+        total_rows = total_seconds = 0
+        for table, (rows, seconds) in stats.items():
+            self.stdout.write('%-36s %10d rows %8.2f s %10d rows/s' % (table, rows, seconds, rows / max(seconds, 1e-6)))
+            total_rows += rows
+            total_seconds += seconds
+        self.stdout.write('%-36s %10d rows %8.2f s %10d rows/s' % (
+            'total', total_rows, total_seconds, total_rows / max(total_seconds, 1e-6)))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import multiprocessing
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from ...jobs import claim_jobs, reclaim_jobs, run_job
+from ...models import Job
+
+# Seconds between checks for jobs of dead workers or past the timeout.
+RECLAIM_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = ('Run background jobs, such as imports, in a pool of processes. '
+            'Several workers can share a database: every job is run once.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                            help='Jobs run at the same time (default: number of CPUs); '
+                                 '0 runs them one by one in this process.')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds between checks for new jobs.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no jobs are pending or running.')
+
+    def handle(self, **options):
+        if options['processes'] < 0 or options['interval'] <= 0:
+            raise CommandError('--processes cannot be negative and --interval must be positive.')
+        pool = None
+        if options['processes']:
+            # Forked processes must not share the connections of this one.
+            connections.close_all()
+            pool = multiprocessing.Pool(options['processes'])
+        running = {}
+        reclaimed_at = None
+        abandoned = False
+        try:
+            while True:
+                if reclaimed_at is None or time.time() - reclaimed_at >= RECLAIM_INTERVAL:
+                    # A job of this worker fails here when its pool process
+                    # died with it: its result would never be ready.
+                    for pk in reclaim_jobs(settings.JOB_TIMEOUT):
+                        abandoned = running.pop(pk, None) is not None or abandoned
+                        self.report(pk, Job.FAILED)
+                    reclaimed_at = time.time()
+                for pk, result in list(running.items()):
+                    if result.ready():
+                        del running[pk]
+                        self.report(pk, result.get())
+                claimed = claim_jobs(max(options['processes'], 1) - len(running))
+                for pk in claimed:
+                    self.stdout.write('Job %d started' % pk)
+                    if pool is None:
+                        self.report(pk, run_job(pk))
+                    else:
+                        running[pk] = pool.apply_async(run_job, (pk,))
+                if options['once'] and not claimed and not running:
+                    break
+                if pool is not None:
+                    # The pool forks replacements for exited processes at any time.
+                    connections.close_all()
+                if not claimed:
+                    time.sleep(options['interval'])
+        finally:
+            if pool is not None:
+                # The pool waits forever for the results of abandoned jobs.
+                if abandoned:
+                    pool.terminate()
+                else:
+                    pool.close()
+                pool.join()
+
+    def report(self, pk, status):
+        self.stdout.write('Job %d %s' % (pk, status))
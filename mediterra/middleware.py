@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Per-request metrics: query count, SQL time, serializer time and render time.
+
+Metrics are sent back in a ``Server-Timing`` header and logged as one JSON
+object per request to the ``mediterra.requests`` logger. Requests to the
+mediterra viewsets that repeat the same SQL statement many times are logged as
+probable N+1 queries, throttled requests (see ``throttling.py``) with the
+exhausted budget.
+"""
+from __future__ import unicode_literals, absolute_import
+import json
+import logging
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from timeit import default_timer
+from django.conf import settings
+from django.db import connections
+from django.db.backends.utils import CursorWrapper
+
+logger = logging.getLogger('mediterra.requests')
+
+_local = threading.local()
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def get_metrics():
+    """
+    Metrics of the request handled by the current thread, if any.
+    """
+    return getattr(_local, 'metrics', None)
+
+
+@contextmanager
+def measure(name):
+    metrics = get_metrics()
+    if metrics is None:
+        yield
+        return
+    start = default_timer()
+    try:
+        yield
+    finally:
+        metrics.add_time(name, default_timer() - start)
+
+
+class RequestMetrics(object):
+    def __init__(self):
+        self.start = default_timer()
+        self.times = {}
+        self.queries = 0
+        self.shapes = Counter()
+        self.throttled = None
+
+    def add_time(self, name, seconds):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+
+    def add_query(self, sql, seconds):
+        self.queries += 1
+        self.add_time('db', seconds)
+        # Statements differing only in the length of an IN list have one shape.
+        self.shapes[IN_LIST_RE.sub('IN (...)', sql)] += 1
+
+    def repeated_queries(self, threshold):
+        return [(sql, count) for sql, count in self.shapes.most_common() if count >= threshold]
+
+    def server_timing(self):
+        parts = ['db;dur=%.1f;desc="%d queries"' % (self.times.get('db', 0.0) * 1000, self.queries)]
+        for name in ('serialize', 'render'):
+            if name in self.times:
+                parts.append('%s;dur=%.1f' % (name, self.times[name] * 1000))
+        parts.append('total;dur=%.1f' % (self.times['total'] * 1000))
+        return ', '.join(parts)
+
+
+class TimedCursorWrapper(CursorWrapper):
+    """
+    Reports every statement and its duration to the request metrics.
+    """
+    def __init__(self, cursor, db, metrics):
+        super(TimedCursorWrapper, self).__init__(cursor, db)
+        self.metrics = metrics
+
+    def execute(self, sql, params=None):
+        start = default_timer()
+        try:
+            return super(TimedCursorWrapper, self).execute(sql, params)
+        finally:
+            self.metrics.add_query(sql, default_timer() - start)
+
+    def executemany(self, sql, param_list):
+        start = default_timer()
+        try:
+            return super(TimedCursorWrapper, self).executemany(sql, param_list)
+        finally:
+            self.metrics.add_query(sql, default_timer() - start)
+
+
+class InstrumentationMiddleware(object):
+    """
+    Collects ``RequestMetrics`` for every request.
+
+    Cursors are wrapped through the debug cursor hook of each connection, so
+    statements are timed without ``DEBUG`` and nothing is added to
+    ``connection.queries`` unless it was already being recorded.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = _local.metrics = RequestMetrics()
+        request.view_class = None
+        restore = [self.instrument(connection, metrics) for connection in connections.all()]
+        try:
+            response = self.get_response(request)
+        finally:
+            for undo in restore:
+                undo()
+            _local.metrics = None
+        metrics.add_time('total', default_timer() - metrics.start)
+        response['Server-Timing'] = metrics.server_timing()
+        self.log(request, response, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.view_class = getattr(view_func, 'cls', None)
+
+    def process_template_response(self, request, response):
+        metrics = get_metrics()
+        start = default_timer()
+
+        def rendered(response):
+            metrics.add_time('render', default_timer() - start)
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def instrument(self, connection, metrics):
+        logged = connection.force_debug_cursor
+
+        def make_debug_cursor(cursor):
+            if logged or settings.DEBUG:
+                cursor = type(connection).make_debug_cursor(connection, cursor)
+            return TimedCursorWrapper(cursor, connection, metrics)
+
+        connection.make_debug_cursor = make_debug_cursor
+        connection.force_debug_cursor = True
+
+        def undo():
+            del connection.make_debug_cursor
+            connection.force_debug_cursor = logged
+
+        return undo
+
+    def log(self, request, response, metrics):
+        data = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': metrics.queries,
+        }
+        for name, seconds in metrics.times.items():
+            data['%s_ms' % name] = round(seconds * 1000, 1)
+        if metrics.throttled is not None:
+            data['throttled'] = metrics.throttled
+        logger.info(json.dumps(data, sort_keys=True), extra={'metrics': data})
+        if metrics.throttled is not None:
+            logger.warning('Throttled %s %s over the %s budget', request.method, request.path, metrics.throttled,
+                           extra={'metrics': data})
+
+        view_class = request.view_class
+        if view_class is None or not view_class.__module__.startswith('mediterra.'):
+            return
+        for sql, count in metrics.repeated_queries(settings.N_PLUS_ONE_THRESHOLD):
+            logger.warning('Possible N+1 query in %s: %d times %s', view_class.__name__, count, sql,
+                           extra={'metrics': data, 'sql': sql, 'count': count})
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.7 on 2026-10-18 07:35
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediterra', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='grade',
+            options={'ordering': ['title', 'id'], 'verbose_name': 'Класс', 'verbose_name_plural': 'Классы'},
+        ),
+        migrations.AlterModelOptions(
+            name='specialization',
+            options={'ordering': ['title', 'id'], 'verbose_name': 'Специализация', 'verbose_name_plural': 'Специализации'},
+        ),
+        migrations.AlterModelOptions(
+            name='student',
+            options={'ordering': ['last_name', 'first_name', 'id'], 'verbose_name': 'Ученик', 'verbose_name_plural': 'Ученики'},
+        ),
+        migrations.AlterModelOptions(
+            name='teacher',
+            options={'ordering': ['last_name', 'first_name', 'id'], 'verbose_name': 'Учитель', 'verbose_name_plural': 'Учителя'},
+        ),
+        migrations.AlterIndexTogether(
+            name='grade',
+            index_together=set([('title', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='specialization',
+            index_together=set([('title', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='student',
+            index_together=set([('last_name', 'first_name', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='teacher',
+            index_together=set([('last_name', 'first_name', 'id')]),
+        ),
+    ]
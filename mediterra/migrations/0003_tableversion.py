@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.7 on 2026-10-18 07:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+TABLES = [
+    'mediterra_teacher',
+    'mediterra_teacher_specializations',
+    'mediterra_student',
+    'mediterra_student_grades',
+    'mediterra_grade',
+    'mediterra_specialization',
+]
+
+
+def create_versions(apps, schema_editor):
+    TableVersion = apps.get_model('mediterra', 'TableVersion')
+    TableVersion.objects.bulk_create([TableVersion(table=table, version='') for table in TABLES])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediterra', '0002_keyset_ordering'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=255, unique=True, verbose_name='Таблица')),
+                ('version', models.CharField(max_length=32, verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия таблицы',
+                'verbose_name_plural': 'Версии таблиц',
+            },
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
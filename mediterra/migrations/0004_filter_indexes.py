@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.7 on 2026-10-18 07:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediterra', '0003_tableversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='student',
+            name='first_name',
+            field=models.CharField(db_index=True, max_length=255, verbose_name='Имя'),
+        ),
+        migrations.AlterField(
+            model_name='teacher',
+            name='first_name',
+            field=models.CharField(db_index=True, max_length=255, verbose_name='Имя'),
+        ),
+    ]
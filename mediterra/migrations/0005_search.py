@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, DatabaseError
+
+# The searched tables and columns as of this migration, rather than those of
+# search.py, which follow the current models.
+SEARCH_TABLES = [
+    ('mediterra_teacher', ('last_name', 'first_name')),
+    ('mediterra_student', ('last_name', 'first_name')),
+    ('mediterra_grade', ('title', 'description')),
+]
+
+
+def get_search_sql(table, columns):
+    """
+    Statements creating the FTS5 table of ``table``, the triggers keeping it
+    in sync and filling it.
+    """
+    fts = '%s_fts' % table
+    names = ', '.join('"%s"' % column for column in columns)
+    new = ', '.join('new."%s"' % column for column in columns)
+    old = ', '.join('old."%s"' % column for column in columns)
+    insert = 'INSERT INTO "%s" (rowid, %s) VALUES (new."id", %s);' % (fts, names, new)
+    delete = 'INSERT INTO "%s" ("%s", rowid, %s) VALUES (\'delete\', old."id", %s);' % (fts, fts, names, old)
+    statements = [
+        'CREATE VIRTUAL TABLE "%s" USING fts5(%s, content="%s", content_rowid="id", prefix=\'2 3\')' % (
+            fts, names, table),
+    ]
+    for event, body in (('insert', insert), ('delete', delete), ('update', delete + ' ' + insert)):
+        statements.append('CREATE TRIGGER "%s_%s" AFTER %s ON "%s" BEGIN %s END' % (
+            fts, event, event.upper(), table, body))
+    statements.append('INSERT INTO "%s" ("%s") VALUES (\'rebuild\')' % (fts, fts))
+    return statements
+
+
+def create_search_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, columns in SEARCH_TABLES:
+        statements = get_search_sql(table, columns)
+        try:
+            schema_editor.execute(statements[0])
+        except DatabaseError:
+            # SQLite built without FTS5: search falls back to prefix LIKE.
+            return
+        for statement in statements[1:]:
+            schema_editor.execute(statement)
+
+
+def drop_search_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, columns in SEARCH_TABLES:
+        fts = '%s_fts' % table
+        for event in ('insert', 'delete', 'update'):
+            schema_editor.execute('DROP TRIGGER IF EXISTS "%s_%s"' % (fts, event))
+        schema_editor.execute('DROP TABLE IF EXISTS "%s"' % fts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediterra', '0004_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_tables, drop_search_tables),
+    ]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.7 on 2026-10-18 08:09
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediterra', '0005_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('import', 'Импорт')], max_length=32, verbose_name='Тип')),
+                ('target', models.CharField(blank=True, max_length=32, verbose_name='Данные')),
+                ('file', models.FileField(blank=True, upload_to='jobs/%Y/%m/%d/', verbose_name='Файл')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершено'), ('failed', 'Ошибка')], default='pending', max_length=16, verbose_name='Статус')),
+                ('processed_rows', models.PositiveIntegerField(default=0, verbose_name='Обработано строк')),
+                ('failed_rows', models.PositiveIntegerField(default=0, verbose_name='Строк с ошибками')),
+                ('message', models.TextField(blank=True, verbose_name='Сообщение')),
+                ('worker', models.CharField(blank=True, max_length=255, verbose_name='Обработчик')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начато')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершено')),
+            ],
+            options={
+                'verbose_name': 'Задача',
+                'verbose_name_plural': 'Задачи',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='JobError',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.PositiveIntegerField(verbose_name='Строка')),
+                ('errors', models.TextField(verbose_name='Ошибки')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='errors', to='mediterra.Job', verbose_name='Задача')),
+            ],
+            options={
+                'verbose_name': 'Ошибка задачи',
+                'verbose_name_plural': 'Ошибки задач',
+                'ordering': ['row', 'id'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='job',
+            index_together=set([('status', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='joberror',
+            index_together=set([('job', 'row', 'id')]),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.7 on 2026-10-18 08:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediterra', '0006_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=64, verbose_name='Данные')),
+                ('action', models.CharField(choices=[('create', 'Создание'), ('update', 'Изменение'), ('delete', 'Удаление'), ('add', 'Добавление связи'), ('remove', 'Удаление связи')], max_length=16, verbose_name='Действие')),
+                ('object_id', models.IntegerField(verbose_name='Объект')),
+                ('related_id', models.IntegerField(blank=True, null=True, verbose_name='Связанный объект')),
+                ('data', models.TextField(blank=True, verbose_name='Значения полей')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время')),
+            ],
+            options={
+                'verbose_name': 'Изменение',
+                'verbose_name_plural': 'Изменения',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='change',
+            index_together=set([('model', 'id')]),
+        ),
+    ]
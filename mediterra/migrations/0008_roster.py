@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.7 on 2026-10-18 08:33
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# The tables as of this migration, rather than the statements of roster.py,
+# which follow the current models.
+FILL_ROSTER = [
+    'INSERT INTO "mediterra_rosterentry" ("teacher_id", "grade_id", "grade_title", "specialization_id", '
+    '"specialization_title", "student_id", "student_first_name", "student_last_name") '
+    'SELECT g."teacher_id", g."id", g."title", s."id", s."title", NULL, \'\', \'\' '
+    'FROM "mediterra_grade" g INNER JOIN "mediterra_specialization" s ON s."id" = g."specialization_id"',
+    'INSERT INTO "mediterra_rosterentry" ("teacher_id", "grade_id", "grade_title", "specialization_id", '
+    '"specialization_title", "student_id", "student_first_name", "student_last_name") '
+    'SELECT g."teacher_id", g."id", g."title", s."id", s."title", st."id", st."first_name", st."last_name" '
+    'FROM "mediterra_student_grades" sg INNER JOIN "mediterra_grade" g ON g."id" = sg."grade_id" '
+    'INNER JOIN "mediterra_specialization" s ON s."id" = g."specialization_id" '
+    'INNER JOIN "mediterra_student" st ON st."id" = sg."student_id"',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediterra', '0007_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RosterEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('teacher_id', models.IntegerField(verbose_name='Учитель')),
+                ('grade_id', models.IntegerField(db_index=True, verbose_name='Класс')),
+                ('grade_title', models.CharField(max_length=255, verbose_name='Название класса')),
+                ('specialization_id', models.IntegerField(db_index=True, verbose_name='Специализация')),
+                ('specialization_title', models.CharField(max_length=255, verbose_name='Название специализации')),
+                ('student_id', models.IntegerField(blank=True, db_index=True, null=True, verbose_name='Ученик')),
+                ('student_first_name', models.CharField(blank=True, max_length=255, verbose_name='Имя ученика')),
+                ('student_last_name', models.CharField(blank=True, max_length=255, verbose_name='Фамилия ученика')),
+            ],
+            options={
+                'verbose_name': 'Запись журнала',
+                'verbose_name_plural': 'Записи журнала',
+                'ordering': ['teacher_id', 'grade_title', 'grade_id', 'student_last_name', 'student_first_name', 'student_id'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='rosterentry',
+            index_together=set([('teacher_id', 'grade_title', 'grade_id', 'student_last_name', 'student_first_name', 'student_id')]),
+        ),
+        migrations.RunSQL(FILL_ROSTER, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def drop_description_index(apps, schema_editor):
+    # 0004 used to index the description, which PostgreSQL limits to about
+    # 2.7kB per value; databases migrated back then still have the index.
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, 'mediterra_grade')
+    for name, constraint in constraints.items():
+        if constraint['index'] and not constraint['unique'] and constraint['columns'] == ['description']:
+            schema_editor.execute('DROP INDEX %s' % schema_editor.quote_name(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediterra', '0008_roster'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_description_index, migrations.RunPython.noop),
+    ]
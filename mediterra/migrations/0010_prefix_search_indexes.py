@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Search falls back to prefix LIKE off SQLite. Under a non-C collation the
+# plain btree indexes cannot serve LIKE on PostgreSQL, pattern indexes can.
+# first_name has a db_index, for which Django creates one already.
+PATTERN_INDEXES = [
+    ('mediterra_teacher', 'last_name'),
+    ('mediterra_student', 'last_name'),
+    ('mediterra_grade', 'title'),
+    ('mediterra_specialization', 'title'),
+]
+
+
+def create_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in PATTERN_INDEXES:
+        schema_editor.execute('CREATE INDEX "%s_%s_like" ON "%s" ("%s" varchar_pattern_ops)' % (
+            table, column, table, column))
+
+
+def drop_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in PATTERN_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS "%s_%s_like"' % (table, column))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediterra', '0009_drop_description_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_pattern_indexes, drop_pattern_indexes),
+    ]
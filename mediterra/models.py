@@ -1,69 +1,276 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
-from django.db import models
+from django.db import models, router, transaction
 from django.core.exceptions import ValidationError
 from django.utils.six import python_2_unicode_compatible
+from .bulk import MAX_QUERY_PARAMS, delete_relations
+
+
+class RelationsQuerySet(models.QuerySet):
+    def delete(self):
+        with transaction.atomic(using=self.db, savepoint=False):
+            delete_relations(self)
+            return super(RelationsQuerySet, self).delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class DeleteRelationsMixin(object):
+    """
+    Deletes the rows of many-to-many relations along with the object with
+    set-based queries (see ``bulk.delete_relations``), also from querysets.
+    """
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            delete_relations(type(self)._base_manager.using(using).filter(pk=self.pk))
+            return super(DeleteRelationsMixin, self).delete(using, keep_parents)
 
 
 @python_2_unicode_compatible
-class Specialization(models.Model):
+class Specialization(DeleteRelationsMixin, models.Model):
     title = models.CharField('Название', max_length=255)
 
+    objects = RelationsQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Специализация'
         verbose_name_plural = 'Специализации'
-        ordering = ['title']
+        ordering = ['title', 'id']
+        index_together = [['title', 'id']]
 
     def __str__(self):
         return self.title
 
 
 @python_2_unicode_compatible
-class Teacher(models.Model):
-    first_name = models.CharField('Имя', max_length=255)
+class Teacher(DeleteRelationsMixin, models.Model):
+    first_name = models.CharField('Имя', max_length=255, db_index=True)
     last_name = models.CharField('Фамилия', max_length=255)
     specializations = models.ManyToManyField(Specialization, verbose_name='Специализации')
 
+    objects = RelationsQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Учитель'
         verbose_name_plural = 'Учителя'
-        ordering = ['last_name', 'first_name']
+        ordering = ['last_name', 'first_name', 'id']
+        index_together = [['last_name', 'first_name', 'id']]
 
     def __str__(self):
         return ' '.join((self.last_name, self.first_name))
 
 
+class TeacherSpecializations(object):
+    """
+    Specialization ids of teachers, loaded for any number of teachers at once.
+    """
+    def __init__(self):
+        self._specializations = {}
+
+    def load(self, teacher_ids):
+        missing = list(set(teacher_ids).difference(self._specializations))
+        for teacher_id in missing:
+            self._specializations[teacher_id] = set()
+        for start in range(0, len(missing), MAX_QUERY_PARAMS):
+            through = Teacher.specializations.through.objects.filter(
+                teacher_id__in=missing[start:start + MAX_QUERY_PARAMS])
+            for teacher_id, specialization_id in through.values_list('teacher_id', 'specialization_id'):
+                self._specializations[teacher_id].add(specialization_id)
+
+    def get(self, teacher_id):
+        self.load([teacher_id])
+        return self._specializations[teacher_id]
+
+
 @python_2_unicode_compatible
-class Grade(models.Model):
+class Grade(DeleteRelationsMixin, models.Model):
     teacher = models.ForeignKey(Teacher, verbose_name='Учитель')
     specialization = models.ForeignKey(Specialization, verbose_name='Специализация')
     title = models.CharField('Название', max_length=255)
     description = models.TextField('Описание', blank=True)
 
+    objects = RelationsQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Класс'
         verbose_name_plural = 'Классы'
-        ordering = ['title']
+        ordering = ['title', 'id']
+        index_together = [['title', 'id']]
 
     def __str__(self):
         return self.title
 
     def clean(self):
-        if self.teacher and self.specialization \
-                and not self.teacher.specializations.filter(pk=self.specialization.pk).exists():
+        self.check_specialization()
+
+    def check_specialization(self, teacher_specializations=None):
+        """
+        Check that the teacher has the specialization of the grade. Pass a shared
+        ``TeacherSpecializations`` to validate many grades with one query.
+        """
+        if self.teacher_id is None or self.specialization_id is None:
+            return
+        if teacher_specializations is None:
+            teacher_specializations = TeacherSpecializations()
+        if self.specialization_id not in teacher_specializations.get(self.teacher_id):
             raise ValidationError('Специализация класса должна совпадать с одной из специализаций учителя')
 
 
 @python_2_unicode_compatible
-class Student(models.Model):
-    first_name = models.CharField('Имя', max_length=255)
+class Student(DeleteRelationsMixin, models.Model):
+    first_name = models.CharField('Имя', max_length=255, db_index=True)
     last_name = models.CharField('Фамилия', max_length=255)
     grades = models.ManyToManyField(Grade, verbose_name='Классы', blank=True)
 
+    objects = RelationsQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Ученик'
         verbose_name_plural = 'Ученики'
-        ordering = ['last_name', 'first_name']
+        ordering = ['last_name', 'first_name', 'id']
+        index_together = [['last_name', 'first_name', 'id']]
 
     def __str__(self):
         return ' '.join((self.last_name, self.first_name))
+
+
+@python_2_unicode_compatible
+class TableVersion(models.Model):
+    """
+    Random token replaced on every write to a table, used for ETags and cache keys.
+    """
+    table = models.CharField('Таблица', max_length=255, unique=True)
+    version = models.CharField('Версия', max_length=32)
+
+    class Meta:
+        verbose_name = 'Версия таблицы'
+        verbose_name_plural = 'Версии таблиц'
+
+    def __str__(self):
+        return self.table
+
+
+@python_2_unicode_compatible
+class Job(models.Model):
+    """
+    Background task run by ``manage.py worker``.
+    """
+    IMPORT = 'import'
+    KINDS = [
+        (IMPORT, 'Импорт'),
+    ]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Завершено'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    kind = models.CharField('Тип', max_length=32, choices=KINDS)
+    target = models.CharField('Данные', max_length=32, blank=True)
+    file = models.FileField('Файл', upload_to='jobs/%Y/%m/%d/', blank=True)
+    status = models.CharField('Статус', max_length=16, choices=STATUSES, default=PENDING)
+    processed_rows = models.PositiveIntegerField('Обработано строк', default=0)
+    failed_rows = models.PositiveIntegerField('Строк с ошибками', default=0)
+    message = models.TextField('Сообщение', blank=True)
+    worker = models.CharField('Обработчик', max_length=255, blank=True)
+    created_at = models.DateTimeField('Создано', auto_now_add=True)
+    started_at = models.DateTimeField('Начато', null=True, blank=True)
+    finished_at = models.DateTimeField('Завершено', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Задача'
+        verbose_name_plural = 'Задачи'
+        ordering = ['-id']
+        index_together = [['status', 'id']]
+
+    def __str__(self):
+        return '%s #%s' % (self.get_kind_display(), self.pk)
+
+
+@python_2_unicode_compatible
+class JobError(models.Model):
+    """
+    Error in one row of the input of a job.
+    """
+    job = models.ForeignKey(Job, verbose_name='Задача', related_name='errors')
+    row = models.PositiveIntegerField('Строка')
+    errors = models.TextField('Ошибки')
+
+    class Meta:
+        verbose_name = 'Ошибка задачи'
+        verbose_name_plural = 'Ошибки задач'
+        ordering = ['row', 'id']
+        index_together = [['job', 'row', 'id']]
+
+    def __str__(self):
+        return '%s, строка %d' % (self.job, self.row)
+
+
+@python_2_unicode_compatible
+class Change(models.Model):
+    """
+    Entry of the change feed: a write to an object or a many-to-many relation
+    of the API. Ids grow with every entry and serve as feed cursors.
+    """
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    ADD = 'add'
+    REMOVE = 'remove'
+    ACTIONS = [
+        (CREATE, 'Создание'),
+        (UPDATE, 'Изменение'),
+        (DELETE, 'Удаление'),
+        (ADD, 'Добавление связи'),
+        (REMOVE, 'Удаление связи'),
+    ]
+
+    model = models.CharField('Данные', max_length=64)
+    action = models.CharField('Действие', max_length=16, choices=ACTIONS)
+    object_id = models.IntegerField('Объект')
+    related_id = models.IntegerField('Связанный объект', null=True, blank=True)
+    data = models.TextField('Значения полей', blank=True)
+    created_at = models.DateTimeField('Время', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Изменение'
+        verbose_name_plural = 'Изменения'
+        ordering = ['id']
+        index_together = [['model', 'id']]
+
+    def __str__(self):
+        return '%s %s #%s' % (self.get_action_display(), self.model, self.object_id)
+
+
+@python_2_unicode_compatible
+class RosterEntry(models.Model):
+    """
+    Row of the roster table maintained by ``roster.py``: a student of a grade,
+    or the grade itself with ``student_id`` empty.
+    """
+    teacher_id = models.IntegerField('Учитель')
+    grade_id = models.IntegerField('Класс', db_index=True)
+    grade_title = models.CharField('Название класса', max_length=255)
+    specialization_id = models.IntegerField('Специализация', db_index=True)
+    specialization_title = models.CharField('Название специализации', max_length=255)
+    student_id = models.IntegerField('Ученик', null=True, blank=True, db_index=True)
+    student_first_name = models.CharField('Имя ученика', max_length=255, blank=True)
+    student_last_name = models.CharField('Фамилия ученика', max_length=255, blank=True)
+
+    class Meta:
+        verbose_name = 'Запись журнала'
+        verbose_name_plural = 'Записи журнала'
+        ordering = ['teacher_id', 'grade_title', 'grade_id', 'student_last_name', 'student_first_name', 'student_id']
+        index_together = [['teacher_id', 'grade_title', 'grade_id', 'student_last_name', 'student_first_name',
+                           'student_id']]
+
+    def __str__(self):
+        return '%s, %s' % (self.grade_title, ' '.join((self.student_last_name, self.student_first_name)))
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import json
+from collections import OrderedDict
+from functools import reduce
+from operator import and_, or_
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Max, Q
+from django.utils import six
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, CursorPagination, _positive_int, _reverse_ordering
+from rest_framework.response import Response
+from .bulk import MAX_QUERY_PARAMS
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over the full, unique ordering of the queryset.
+
+    DRF's ``CursorPagination`` seeks on the first ordering field only and
+    falls back to an OFFSET for ties. Here the cursor position holds the values
+    of every ordering field, and the page is selected with a row comparison
+    ``(a, b, id) > (x, y, z)``, so every page is a range scan on the composite
+    index backing the ordering.
+    """
+    page_size_query_param = 'page_size'
+    # Related objects of a page are prefetched with one ``IN`` list.
+    max_page_size = MAX_QUERY_PARAMS
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering.append('id')
+        return tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            values = self.decode_position(current_position, queryset)
+            queryset = queryset.filter(self.get_position_filter(values, reverse))
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_position_filter(self, values, reverse):
+        """
+        Expand ``(f1, f2, f3) > (v1, v2, v3)`` into
+        ``f1 >= v1 AND (f1 > v1 OR (f1 = v1 AND (f2 > v2 OR (f2 = v2 AND f3 > v3))))``.
+        The leading ``f1 >= v1`` term lets the database seek on the index.
+        """
+        if len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        fields = []
+        for order, value in zip(self.ordering, values):
+            descending = order.startswith('-') != reverse
+            fields.append((order.lstrip('-'), value, 'lt' if descending else 'gt'))
+
+        conditions = []
+        for i, (name, value, lookup) in enumerate(fields):
+            equal = [Q(**{prev_name: prev_value}) for prev_name, prev_value, _ in fields[:i]]
+            conditions.append(reduce(and_, equal + [Q(**{'%s__%s' % (name, lookup): value})]))
+
+        name, value, lookup = fields[0]
+        seek = Q(**{'%s__%s' % (name, 'lte' if lookup == 'lt' else 'gte'): value})
+        return seek & reduce(or_, conditions)
+
+    def get_ordering_field(self, queryset, name):
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        opts = queryset.model._meta
+        parts = name.split('__')
+        for part in parts[:-1]:
+            opts = opts.get_field(part).related_model._meta
+        return opts.pk if parts[-1] == 'pk' else opts.get_field(parts[-1])
+
+    def decode_position(self, position, queryset):
+        """
+        Values of the ordering fields in ``position``, converted by their
+        fields: cursors come from the client and may be forged.
+        """
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering) \
+                or not all(isinstance(value, six.string_types + six.integer_types + (float,)) for value in values):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            return [self.get_ordering_field(queryset, order.lstrip('-')).to_python(value)
+                    for order, value in zip(self.ordering, values)]
+        except (ValueError, TypeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for order in ordering:
+            field_name = order.lstrip('-')
+            if isinstance(instance, dict):
+                values.append(instance[field_name])
+            else:
+                values.append(getattr(instance, field_name))
+        return json.dumps(values, separators=(',', ':'))
+
+
+class ChangeFeedPagination(BasePagination):
+    """
+    Pages of the change feed after ``?since=``, the id of the last change a
+    client has seen: ``0`` (the default) reads from the start and ``latest``
+    from now on. ``next`` is the cursor of the following page.
+    """
+    since_query_param = 'since'
+    latest = 'latest'
+    page_size_query_param = 'limit'
+    page_size = 500
+    max_page_size = 5000
+    invalid_since_message = 'Ожидался id изменения или "latest".'
+
+    def get_since(self, request, queryset):
+        value = request.query_params.get(self.since_query_param, '0')
+        if value == self.latest:
+            return queryset.model._default_manager.aggregate(since=Max('id'))['since'] or 0
+        try:
+            return _positive_int(value)
+        except ValueError:
+            raise ValidationError({self.since_query_param: [self.invalid_since_message]})
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                 cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.since = self.get_since(request, queryset)
+        page_size = self.get_page_size(request)
+        results = list(queryset.filter(id__gt=self.since).order_by('id')[:page_size + 1])
+        self.page = results[:page_size]
+        self.has_more = len(results) > page_size
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.page[-1].id if self.page else self.since),
+            ('has_more', self.has_more),
+            ('results', data),
+        ]))
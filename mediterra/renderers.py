@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+import csv
+import json
+from django.utils import six
+from django.utils.encoding import force_bytes, force_text
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_encoder = encoders.JSONEncoder()
+
+
+def json_dumps(data):
+    """
+    Encode ``data`` as compact UTF-8 JSON with orjson or ujson when installed,
+    producing the same bytes as DRF's ``JSONRenderer`` for API data.
+    """
+    if orjson is not None:
+        ret = orjson.dumps(data, default=_encoder.default)
+    else:
+        ret = None
+        if ujson is not None:
+            try:
+                ret = ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False)
+            except (TypeError, OverflowError):
+                # Types only the DRF encoder knows, such as lazy strings.
+                pass
+        if ret is None:
+            ret = json.dumps(data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+        ret = force_bytes(ret)
+    # Keep the output a strict JavaScript subset, as DRF does.
+    if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+        ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return ret
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    ``JSONRenderer`` encoding compact responses with ``json_dumps``; indented
+    or ASCII-only output is left to the standard library.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None or self.ensure_ascii or not self.compact:
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        return json_dumps(data)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Binary MessagePack for internal clients, available when ``msgpack`` is
+    installed. Values without a MessagePack type are encoded as in JSON.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        return msgpack.packb(data, use_bin_type=True, default=_encoder.default)
+
+
+class StreamingRenderer(BaseRenderer):
+    """
+    Renderer for row streams. ``render_rows`` turns an iterable of dicts into
+    an iterator of encoded chunks for ``StreamingHttpResponse``; ``render``
+    is only used for regular responses such as errors.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return b''.join(self.render_rows(rows))
+
+    def render_rows(self, rows):
+        raise NotImplementedError('Streaming renderer class requires .render_rows() to be implemented')
+
+
+class NDJSONRenderer(StreamingRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render_rows(self, rows):
+        for row in rows:
+            yield json_dumps(row) + b'\n'
+
+
+class Echo(object):
+    def write(self, value):
+        return value
+
+
+class CSVRenderer(StreamingRenderer):
+    """
+    Renders rows as CSV with a header taken from the keys of the first row.
+    To-many values are written as space separated primary keys.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render_rows(self, rows):
+        writer = csv.writer(Echo())
+        header = None
+        for row in rows:
+            if header is None:
+                header = list(row)
+                yield force_bytes(writer.writerow(self.prepare(header)))
+            yield force_bytes(writer.writerow(self.prepare(row[name] for name in header)))
+
+    def prepare(self, values):
+        values = [self.format_value(value) for value in values]
+        if six.PY2:
+            return [force_bytes(value) for value in values]
+        return values
+
+    def format_value(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, (list, tuple)):
+            return ' '.join(force_text(item) for item in value)
+        return force_text(value)
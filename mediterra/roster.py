@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Teacher rosters: the grades of every teacher with their specialization and
+students.
+
+The roster is kept denormalized in the ``RosterEntry`` table, one row per
+grade and one per student of a grade, indexed in roster order, so the roster
+of any number of teachers is read with one index range scan. The table is
+brought up to date from the change feed (see ``changes.py``) in the
+transaction of the write, with set-based statements: the rows of changed
+grades and students are deleted and selected again from the source tables,
+renamed specializations are updated in place.
+"""
+from __future__ import unicode_literals, absolute_import
+from collections import OrderedDict
+from django.db import connections, router
+from .bulk import MAX_QUERY_PARAMS
+from .changes import FEED_MODELS, FEED_RELATIONS
+from .models import Student, Grade, Specialization, Change, RosterEntry
+
+COLUMNS = ['teacher_id', 'grade_id', 'grade_title', 'specialization_id', 'specialization_title', 'student_id',
+           'student_first_name', 'student_last_name']
+
+# Grades get a row of their own, so that grades without students are listed.
+GRADE_ROWS = (
+    "SELECT g.{teacher_id}, g.{id}, g.{title}, s.{id}, s.{title}, NULL, '', '' "
+    "FROM {grade} g INNER JOIN {specialization} s ON s.{id} = g.{specialization_id}"
+)
+
+STUDENT_ROWS = (
+    'SELECT g.{teacher_id}, g.{id}, g.{title}, s.{id}, s.{title}, st.{id}, st.{first_name}, st.{last_name} '
+    'FROM {student_grade} sg INNER JOIN {grade} g ON g.{id} = sg.{grade_id} '
+    'INNER JOIN {specialization} s ON s.{id} = g.{specialization_id} '
+    'INNER JOIN {student} st ON st.{id} = sg.{student_id}'
+)
+
+INSERT = 'INSERT INTO {roster} ({columns}) '
+
+REFRESH_GRADES = [
+    'DELETE FROM {roster} WHERE {grade_id} IN ({pks})',
+    INSERT + GRADE_ROWS + ' WHERE g.{id} IN ({pks})',
+    INSERT + STUDENT_ROWS + ' WHERE sg.{grade_id} IN ({pks})',
+]
+
+REFRESH_STUDENTS = [
+    'DELETE FROM {roster} WHERE {student_id} IN ({pks})',
+    INSERT + STUDENT_ROWS + ' WHERE sg.{student_id} IN ({pks})',
+]
+
+RENAME_SPECIALIZATIONS = [
+    'UPDATE {roster} SET {specialization_title} = (SELECT s.{title} FROM {specialization} s '
+    'WHERE s.{id} = {roster}.{specialization_id}) WHERE {specialization_id} IN ({pks})',
+]
+
+REBUILD = [
+    'DELETE FROM {roster}',
+    INSERT + GRADE_ROWS,
+    INSERT + STUDENT_ROWS,
+]
+
+
+def get_names(connection):
+    """
+    Quoted table and column names for the statement templates.
+    """
+    quote = connection.ops.quote_name
+    StudentGrade = Student.grades.through
+    names = {
+        'roster': RosterEntry._meta.db_table,
+        'grade': Grade._meta.db_table,
+        'specialization': Specialization._meta.db_table,
+        'student': Student._meta.db_table,
+        'student_grade': StudentGrade._meta.db_table,
+        'id': Grade._meta.pk.column,
+        'title': Grade._meta.get_field('title').column,
+        'first_name': Student._meta.get_field('first_name').column,
+        'last_name': Student._meta.get_field('last_name').column,
+        'teacher_id': Grade._meta.get_field('teacher').column,
+        'specialization_id': Grade._meta.get_field('specialization').column,
+        'specialization_title': RosterEntry._meta.get_field('specialization_title').column,
+        'grade_id': StudentGrade._meta.get_field('grade').column,
+        'student_id': StudentGrade._meta.get_field('student').column,
+    }
+    names = dict((key, quote(name)) for key, name in names.items())
+    names['columns'] = ', '.join(quote(RosterEntry._meta.get_field(name).column) for name in COLUMNS)
+    return names
+
+
+def execute(statements, pks=None, using=None):
+    """
+    Run the ``statements`` templates, once per batch of ``pks`` when they are
+    given, with ``{pks}`` standing for the placeholders of the batch.
+    """
+    connection = connections[using or router.db_for_write(RosterEntry)]
+    names = get_names(connection)
+    with connection.cursor() as cursor:
+        if pks is None:
+            for statement in statements:
+                cursor.execute(statement.format(**names))
+            return
+        pks = sorted(pks)
+        for start in range(0, len(pks), MAX_QUERY_PARAMS):
+            batch = pks[start:start + MAX_QUERY_PARAMS]
+            for statement in statements:
+                cursor.execute(statement.format(pks=', '.join(['%s'] * len(batch)), **names), batch)
+
+
+def rebuild_roster(using=None):
+    """
+    Fill the roster table from scratch, for data written without signals.
+    """
+    execute(REBUILD, using=using)
+
+
+def apply_changes(changes):
+    """
+    Bring the roster in line with ``changes``, change feed tuples of the
+    ``changes.COLUMNS``.
+    """
+    grades, students, specializations = set(), set(), set()
+    enrollments = FEED_RELATIONS[Student.grades.through][0]
+    for model, action, object_id, related_id, data in changes:
+        if model == FEED_MODELS[Grade]:
+            grades.add(object_id)
+        elif model == enrollments or model == FEED_MODELS[Student] and action != Change.CREATE:
+            # New students are only listed once they are enrolled.
+            students.add(object_id)
+        elif model == FEED_MODELS[Specialization] and action == Change.UPDATE:
+            specializations.add(object_id)
+    # Refreshed grades bring their students along, refreshing the students
+    # afterwards replaces those rows rather than duplicating them.
+    if grades:
+        execute(REFRESH_GRADES, grades)
+    if students:
+        execute(REFRESH_STUDENTS, students)
+    if specializations:
+        execute(RENAME_SPECIALIZATIONS, specializations)
+
+
+def get_rosters(teachers):
+    """
+    Rosters of ``teachers``, read from the roster table with one query per
+    batch of teachers.
+    """
+    grades = OrderedDict((teacher.pk, OrderedDict()) for teacher in teachers)
+    pks = list(grades)
+    for start in range(0, len(pks), MAX_QUERY_PARAMS):
+        rows = RosterEntry.objects.filter(teacher_id__in=pks[start:start + MAX_QUERY_PARAMS]).values_list(*COLUMNS)
+        for (teacher_id, grade_id, grade_title, specialization_id, specialization_title, student_id,
+             first_name, last_name) in rows:
+            grade = grades[teacher_id].get(grade_id)
+            if grade is None:
+                grade = grades[teacher_id][grade_id] = OrderedDict([
+                    ('id', grade_id),
+                    ('title', grade_title),
+                    ('specialization', OrderedDict([('id', specialization_id), ('title', specialization_title)])),
+                    ('students', []),
+                ])
+            if student_id is not None:
+                grade['students'].append(OrderedDict([
+                    ('id', student_id), ('first_name', first_name), ('last_name', last_name)]))
+    return [OrderedDict([
+        ('id', teacher.pk),
+        ('first_name', teacher.first_name),
+        ('last_name', teacher.last_name),
+        ('grades', list(grades[teacher.pk].values())),
+    ]) for teacher in teachers]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Read replicas.
+
+``settings.DATABASE_REPLICAS`` lists aliases of read-only copies of the
+``default`` database. ``ReplicaMiddleware`` sends all reads of a ``GET`` or
+``HEAD`` request to the API viewsets to a replica; everything else, including
+management commands and background jobs, stays on the primary.
+
+Replicas lag behind the primary, each by its own delay. A client therefore
+always reads from the same replica, picked by its address, so that what it
+reads never goes back in time, e.g. an export never misses changes of the
+feed read before it. A client that has just written would not see its own
+writes there: unsafe requests pin the client to the primary for
+``settings.REPLICA_PIN_SECONDS``, by a cookie and, for clients dropping
+cookies, by its address in the file store (see ``filestore.py``).
+"""
+from __future__ import unicode_literals, absolute_import
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.encoding import force_bytes
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.viewsets import ViewSetMixin
+from .filestore import get_store
+from .throttling import get_ident
+
+_local = threading.local()
+
+PIN_COOKIE = 'mediterra_primary'
+
+
+@contextmanager
+def read_from(alias):
+    """
+    Route the reads of the current thread to the ``alias`` replica in the
+    block, or to the primary with ``alias`` None.
+    """
+    previous = getattr(_local, 'alias', None)
+    _local.alias = alias
+    try:
+        yield
+    finally:
+        _local.alias = previous
+
+
+class PrimaryReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        return getattr(_local, 'alias', None) or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+def get_replica(ident):
+    """
+    Replica of the client with the ``ident`` address.
+    """
+    replicas = settings.DATABASE_REPLICAS
+    return replicas[int(hashlib.md5(force_bytes(ident)).hexdigest(), 16) % len(replicas)]
+
+
+class ReplicaMiddleware(object):
+    """
+    Reads from the replica of the client for safe requests to the mediterra
+    viewsets from clients that are not pinned to the primary, and pins
+    clients after unsafe requests. Streamed responses keep reading from the
+    same replica as they are sent.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.replica = None
+        with read_from(None):
+            response = self.get_response(request)
+        if request.replica is not None and response.streaming:
+            response.streaming_content = self.stream(response.streaming_content, request.replica)
+        if request.method not in SAFE_METHODS and settings.DATABASE_REPLICAS:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+            get_store().set(self.get_pin_key(request), int(time.time()) + settings.REPLICA_PIN_SECONDS)
+        return response
+
+    def get_pin_key(self, request):
+        return 'replica_pin_%s' % get_ident(request)
+
+    def is_pinned(self, request):
+        return (PIN_COOKIE in request.COOKIES
+                or get_store().get(self.get_pin_key(request), 0) > time.time())
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if (request.method in SAFE_METHODS and settings.DATABASE_REPLICAS
+                and view_class is not None and issubclass(view_class, ViewSetMixin)
+                and view_class.__module__.startswith('mediterra.') and not self.is_pinned(request)):
+            request.replica = _local.alias = get_replica(get_ident(request))
+
+    def stream(self, content, alias):
+        with read_from(alias):
+            for chunk in content:
+                yield chunk
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Type-ahead search over people and grades.
+
+On SQLite with FTS5 every searchable model has a ``<table>_fts`` external
+content virtual table, kept in sync by triggers and ranked with ``bm25``.
+Triggers rather than signals keep bulk inserts, ``QuerySet.update()`` and raw
+SQL loads searchable at no extra queries.
+Other databases fall back to case-sensitive prefix ``LIKE``. On PostgreSQL
+names and titles have pattern indexes for it (migration 0010), grade
+descriptions have none, so searching grades scans the table.
+"""
+from __future__ import unicode_literals, absolute_import
+import re
+from functools import reduce
+from operator import or_
+from django.db import connections, router, DatabaseError
+from django.db.models import Case, FloatField, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from .models import Teacher, Student, Grade
+
+# Columns in order of relevance.
+SEARCH_FIELDS = {
+    Teacher: ('last_name', 'first_name'),
+    Student: ('last_name', 'first_name'),
+    Grade: ('title', 'description'),
+}
+
+_fts_tables = set()
+
+
+def get_fts_table(model):
+    return '%s_fts' % model._meta.db_table
+
+
+def install_search(connection):
+    """
+    Create the FTS5 tables and the triggers keeping them in sync with the
+    searched tables. Safe to run repeatedly: SQLite drops the triggers when a
+    migration rebuilds a table, in which case they are recreated and the index
+    rebuilt. Does nothing on other databases or without FTS5.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        existing = set(connection.introspection.table_names(cursor))
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        triggers = set(row[0] for row in cursor.fetchall())
+        for model, fields in SEARCH_FIELDS.items():
+            source = model._meta.db_table
+            if source not in existing:
+                continue
+            table = get_fts_table(model)
+            pk = model._meta.pk.column
+            columns = ', '.join(quote(field) for field in fields)
+            new = ', '.join('new.%s' % quote(field) for field in fields)
+            old = ', '.join('old.%s' % quote(field) for field in fields)
+            rebuild = False
+            if table not in existing:
+                try:
+                    cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(%s, content=%s, content_rowid=%s, prefix='2 3')" % (
+                        quote(table), columns, quote(source), quote(pk)))
+                except DatabaseError:
+                    return
+                rebuild = True
+            insert = 'INSERT INTO %s (rowid, %s) VALUES (new.%s, %s);' % (quote(table), columns, quote(pk), new)
+            delete = "INSERT INTO %s (%s, rowid, %s) VALUES ('delete', old.%s, %s);" % (
+                quote(table), quote(table), columns, quote(pk), old)
+            for event, body in (('INSERT', insert), ('DELETE', delete), ('UPDATE', delete + ' ' + insert)):
+                trigger = '%s_%s' % (table, event.lower())
+                if trigger not in triggers:
+                    cursor.execute('CREATE TRIGGER %s AFTER %s ON %s BEGIN %s END' % (
+                        quote(trigger), event, quote(source), body))
+                    rebuild = True
+            if rebuild:
+                cursor.execute("INSERT INTO %s (%s) VALUES ('rebuild')" % (quote(table), quote(table)))
+
+
+def has_fts(model, using=None):
+    using = using or router.db_for_read(model)
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    key = (using, get_fts_table(model))
+    if key not in _fts_tables:
+        if key[1] not in connection.introspection.table_names():
+            return False
+        _fts_tables.add(key)
+    return True
+
+
+def get_terms(query):
+    return re.findall(r'\w+', query, re.UNICODE)
+
+
+def search(queryset, query):
+    """
+    Filter ``queryset`` to objects matching every term of ``query`` as a word
+    prefix and annotate them with ``search_rank``, lower being better.
+    ``query`` must contain at least one term.
+    """
+    terms = get_terms(query)
+    if has_fts(queryset.model, queryset.db):
+        return fts_search(queryset, terms)
+    return prefix_search(queryset, terms)
+
+
+def fts_search(queryset, terms):
+    model = queryset.model
+    quote = connections[queryset.db].ops.quote_name
+    table = quote(get_fts_table(model))
+    match = ' '.join('"%s"*' % term for term in terms)
+    weights = ', '.join('%d.0' % (len(SEARCH_FIELDS[model]) - i) for i in range(len(SEARCH_FIELDS[model])))
+    rank = RawSQL(
+        'SELECT bm25(%s, %s) FROM %s WHERE %s MATCH %%s AND %s.rowid = %s.%s' % (
+            table, weights, table, table, table, quote(model._meta.db_table), quote(model._meta.pk.column)),
+        [match],
+        output_field=FloatField()
+    )
+    # ``pk__in=RawSQL(...)`` would render as ``IN ((SELECT ...))``, which
+    # SQLite reads as a single scalar value.
+    where = '%s.%s IN (SELECT rowid FROM %s WHERE %s MATCH %%s)' % (
+        quote(model._meta.db_table), quote(model._meta.pk.column), table, table)
+    return queryset.extra(where=[where], params=[match]).annotate(search_rank=rank)
+
+
+def prefix_search(queryset, terms):
+    fields = SEARCH_FIELDS[queryset.model]
+
+    def matches(field, term):
+        # Prefix LIKE can use an index only when it is case sensitive.
+        variants = set([term, term.capitalize()])
+        return reduce(or_, [Q(**{'%s__startswith' % field: variant}) for variant in variants])
+
+    for term in terms:
+        queryset = queryset.filter(reduce(or_, [matches(field, term) for field in fields]))
+    rank = Case(*[When(matches(field, terms[0]), then=Value(i)) for i, field in enumerate(fields)],
+                default=Value(len(fields)), output_field=IntegerField())
+    return queryset.annotate(search_rank=rank)
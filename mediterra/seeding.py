@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic data for benchmarks and scaling tests.
+
+Data is generated from a seeded ``random.Random`` so that the same volumes and
+seed give the same rows. Grades only get specializations of their teacher, as
+``Grade.clean`` requires.
+"""
+from __future__ import unicode_literals, absolute_import
+import random
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+from django.db import transaction
+from django.utils.six.moves import range
+from .bulk import bulk_insert, insert_rows
+from .models import Teacher, Student, Grade, Specialization, RosterEntry
+from .roster import rebuild_roster
+from .versions import bump_versions
+
+FIRST_NAMES = [
+    'Александр', 'Алексей', 'Андрей', 'Анна', 'Борис', 'Вера', 'Виктор', 'Владимир', 'Галина', 'Дарья',
+    'Дмитрий', 'Евгений', 'Екатерина', 'Елена', 'Иван', 'Ирина', 'Кирилл', 'Ксения', 'Мария', 'Михаил',
+    'Наталья', 'Никита', 'Николай', 'Ольга', 'Павел', 'Петр', 'Светлана', 'Сергей', 'Татьяна', 'Юлия',
+]
+
+LAST_NAMES = [
+    'Алексеев', 'Андреев', 'Белов', 'Васильев', 'Волков', 'Голубев', 'Григорьев', 'Давыдов', 'Егоров',
+    'Зайцев', 'Иванов', 'Ковалев', 'Козлов', 'Кузнецов', 'Лебедев', 'Макаров', 'Морозов', 'Никитин',
+    'Новиков', 'Орлов', 'Павлов', 'Петров', 'Попов', 'Романов', 'Семенов', 'Смирнов', 'Соколов',
+    'Степанов', 'Федоров', 'Яковлев',
+]
+
+SUBJECTS = [
+    'Алгебра', 'Английский язык', 'Астрономия', 'Биология', 'География', 'Геометрия', 'Информатика',
+    'История', 'Литература', 'Музыка', 'Немецкий язык', 'Обществознание', 'Русский язык', 'Физика',
+    'Физкультура', 'Химия', 'Черчение', 'Экономика',
+]
+
+GRADE_LETTERS = 'абвгд'
+
+DEFAULT_VOLUMES = {
+    'specializations': 20,
+    'teachers': 200,
+    'grades': 500,
+    'students': 5000,
+    'enrollments': 3,
+}
+
+
+def make_name(rng):
+    return {'first_name': rng.choice(FIRST_NAMES), 'last_name': rng.choice(LAST_NAMES)}
+
+
+def make_title(rng, number):
+    subject = SUBJECTS[number % len(SUBJECTS)]
+    if number < len(SUBJECTS):
+        return subject
+    return '%s %d' % (subject, number // len(SUBJECTS) + 1)
+
+
+class Timer(object):
+    """
+    Rows written and seconds spent per table.
+    """
+    def __init__(self, report=None):
+        self.stats = OrderedDict()
+        self.report = report
+
+    @contextmanager
+    def measure(self, model):
+        table = model._meta.db_table
+        start = default_timer()
+        counter = {'rows': 0}
+        yield counter
+        rows, seconds = self.stats.get(table, (0, 0.0))
+        self.stats[table] = (rows + counter['rows'], seconds + default_timer() - start)
+        if self.report is not None:
+            self.report(table, *self.stats[table])
+
+
+def seed(specializations, teachers, grades, students, enrollments, random_seed=0, chunk_size=10000,
+         report=None):
+    """
+    Create the given number of objects; every student is enrolled in
+    ``enrollments`` distinct grades, then rebuild the roster table. Students
+    are written in chunks of ``chunk_size`` so memory does not grow with their
+    number.
+
+    ``report`` is called with ``(table, rows, seconds)`` after every chunk.
+    Returns the ``(rows, seconds)`` totals per table.
+    """
+    rng = random.Random(random_seed)
+    timer = Timer(report)
+    TeacherSpecialization = Teacher.specializations.through
+    StudentGrade = Student.grades.through
+    with transaction.atomic():
+        with timer.measure(Specialization) as counter:
+            objs = bulk_insert(Specialization, [Specialization(title=make_title(rng, i))
+                                                for i in range(specializations)], send_signals=False)
+            specialization_ids = [obj.pk for obj in objs]
+            counter['rows'] = len(objs)
+
+        with timer.measure(Teacher) as counter:
+            objs = bulk_insert(Teacher, [Teacher(**make_name(rng)) for i in range(teachers)], send_signals=False)
+            teacher_ids = [obj.pk for obj in objs]
+            counter['rows'] = len(objs)
+
+        with timer.measure(TeacherSpecialization) as counter:
+            teacher_specializations = dict(
+                (teacher_id, sorted(rng.sample(specialization_ids, min(len(specialization_ids), rng.randint(1, 3)))))
+                for teacher_id in teacher_ids)
+            counter['rows'] = insert_rows(TeacherSpecialization, ['teacher_id', 'specialization_id'], [
+                (teacher_id, specialization_id)
+                for teacher_id in teacher_ids for specialization_id in teacher_specializations[teacher_id]])
+
+        with timer.measure(Grade) as counter:
+            objs = []
+            for i in range(grades):
+                teacher_id = rng.choice(teacher_ids)
+                objs.append(Grade(title='%d%s' % (rng.randint(1, 11), rng.choice(GRADE_LETTERS)),
+                                  description='',
+                                  teacher_id=teacher_id,
+                                  specialization_id=rng.choice(teacher_specializations[teacher_id])))
+            grade_ids = [obj.pk for obj in bulk_insert(Grade, objs, send_signals=False)]
+            counter['rows'] = len(objs)
+
+        for start in range(0, students, chunk_size):
+            with timer.measure(Student) as counter:
+                objs = bulk_insert(Student, [Student(**make_name(rng))
+                                             for i in range(min(chunk_size, students - start))],
+                                   send_signals=False)
+                counter['rows'] = len(objs)
+            with timer.measure(StudentGrade) as counter:
+                counter['rows'] = insert_rows(StudentGrade, ['student_id', 'grade_id'], [
+                    (obj.pk, grade_id)
+                    for obj in objs for grade_id in sorted(rng.sample(grade_ids, min(len(grade_ids), enrollments)))])
+
+        with timer.measure(RosterEntry) as counter:
+            rebuild_roster()
+            counter['rows'] = RosterEntry.objects.count()
+
+        bump_versions(Specialization, Teacher, TeacherSpecialization, Grade, Student, StudentGrade)
+
+    return timer.stats
@@ -1,37 +1,425 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
+import json
+import os
+from collections import Mapping, defaultdict
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Teacher, Student, Grade, Specialization
+from rest_framework.fields import empty
+from rest_framework.utils import model_meta
+from .bulk import in_bulk, bulk_insert, bulk_update, set_related
+from .counts import get_counts
+from .imports import FILE_FORMATS, IMPORTERS
+from .middleware import measure
+from .roster import get_rosters
+from .models import (Teacher, Student, Grade, Specialization, TeacherSpecializations, Job, JobError,
+                     Change)
 
 
-class TeacherSerializer(serializers.ModelSerializer):
+def to_pk(model, value):
+    try:
+        return model._meta.pk.to_python(value)
+    except (DjangoValidationError, TypeError, ValueError):
+        return None
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves primary keys against the objects preloaded by the serializer
+    into ``context['preloaded']`` and queries only for the rest.
+    """
+    def to_internal_value(self, data):
+        model = self.get_queryset().model
+        preloaded = self.context.get('preloaded', {}).get(model, {})
+        pk = to_pk(model, data)
+        if pk is not None and pk in preloaded:
+            if preloaded[pk] is None:
+                self.fail('does_not_exist', pk_value=data)
+            return preloaded[pk]
+        return super(PreloadedPrimaryKeyRelatedField, self).to_internal_value(data)
+
+
+def is_top_level(serializer):
+    """
+    Whether ``serializer`` is the root or the child of a root list serializer.
+    """
+    parent = serializer.parent
+    return parent is None or isinstance(parent, serializers.ListSerializer) and parent.parent is None
+
+
+class TimedRepresentationMixin(object):
+    """
+    Adds the time spent representing top level objects to the request metrics.
+    """
+    def to_representation(self, instance):
+        if is_top_level(self):
+            with measure('serialize'):
+                return super(TimedRepresentationMixin, self).to_representation(instance)
+        return super(TimedRepresentationMixin, self).to_representation(instance)
+
+
+class ExpandMixin(object):
+    """
+    Replaces the relations listed in ``context['expand']`` with the nested
+    serializers returned by ``get_expanded_fields``. Only top level objects
+    are expanded.
+    """
+    def get_expanded_fields(self):
+        return {}
+
+    def get_fields(self):
+        fields = super(ExpandMixin, self).get_fields()
+        expand = self.context.get('expand')
+        if expand and is_top_level(self):
+            expanded = self.get_expanded_fields()
+            for name in expand:
+                fields[name] = expanded[name]
+        return fields
+
+
+class CountField(serializers.IntegerField):
+    """
+    Read-only count annotated on the queryset by the view.
+    """
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super(CountField, self).__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        # Objects that were just created are not annotated and have nothing to count.
+        return getattr(instance, self.source, 0)
+
+
+class CountsMixin(object):
+    """
+    Adds the counts of ``counts.py`` to top level objects.
+    """
+    def get_fields(self):
+        fields = super(CountsMixin, self).get_fields()
+        if is_top_level(self):
+            for name, count in get_counts(self.Meta.model).items():
+                fields[name] = CountField(label=count.label)
+        return fields
+
+
+class SparseFieldsMixin(object):
+    """
+    Keeps only the fields listed in ``context['fields']`` on top level objects.
+    """
+    def get_fields(self):
+        fields = super(SparseFieldsMixin, self).get_fields()
+        names = self.context.get('fields')
+        if names is not None and is_top_level(self):
+            for name in list(fields):
+                if name not in names:
+                    del fields[name]
+        return fields
+
+
+class PreloadRelatedMixin(object):
+    """
+    Loads every object referenced by the incoming data with one query per
+    relation before the fields are validated.
+    """
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
+
+    def preload_related(self, items, instances=()):
+        preloaded = self.context.setdefault('preloaded', {})
+        for field in self.fields.values():
+            if field.read_only:
+                continue
+            relation = getattr(field, 'child_relation', field)
+            if not isinstance(relation, PreloadedPrimaryKeyRelatedField):
+                continue
+            queryset = relation.get_queryset()
+            pks = set()
+            for item in items:
+                if not isinstance(item, Mapping):
+                    continue
+                value = field.get_value(item)
+                if value is empty or value is None:
+                    continue
+                if relation is not field:
+                    if not isinstance(value, (list, tuple)):
+                        continue
+                else:
+                    value = [value]
+                pks.update(to_pk(queryset.model, pk) for pk in value)
+            pks.discard(None)
+            cache = preloaded.setdefault(queryset.model, {})
+            missing = pks.difference(cache)
+            if missing:
+                objects = in_bulk(queryset, missing)
+                cache.update((pk, objects.get(pk)) for pk in missing)
+
+    def to_internal_value(self, data):
+        if not isinstance(self.parent, serializers.ListSerializer):
+            self.preload_related([data], [self.instance] if self.instance is not None else [])
+        return super(PreloadRelatedMixin, self).to_internal_value(data)
+
+
+class SetRelatedMixin(object):
+    """
+    Writes to-many relations with ``set_related``, which inserts and deletes
+    only the rows that change, one statement each, instead of going through
+    the related managers.
+    """
+    def pop_related(self, validated_data):
+        info = model_meta.get_field_info(self.Meta.model)
+        return dict((name, [obj.pk for obj in validated_data.pop(name)])
+                    for name, relation in info.forward_relations.items()
+                    if relation.to_many and name in validated_data)
+
+    def create(self, validated_data):
+        related = self.pop_related(validated_data)
+        instance = super(SetRelatedMixin, self).create(validated_data)
+        for name, pks in related.items():
+            set_related([instance], name, {instance: pks})
+        return instance
+
+    def update(self, instance, validated_data):
+        related = self.pop_related(validated_data)
+        instance = super(SetRelatedMixin, self).update(instance, validated_data)
+        for name, pks in related.items():
+            set_related([instance], name, {instance: pks}, replace=True)
+        return instance
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    List serializer writing all items with set-based queries.
+
+    To update, pass a queryset as ``instance``; every item must then carry the
+    ``id`` of the object it changes.
+    """
+    default_error_messages = {
+        'missing_id': 'Не указан id объекта.',
+        'does_not_exist': 'Объект с id "{pk_value}" не существует.',
+        'duplicate_id': 'Объект с id "{pk_value}" указан несколько раз.',
+    }
+
+    def to_internal_value(self, data):
+        if self.instance is None or not isinstance(data, list):
+            if isinstance(data, list):
+                self.child.preload_related(data)
+            return super(BulkListSerializer, self).to_internal_value(data)
+
+        model = self.child.Meta.model
+        pks = [to_pk(model, item.get('id')) if isinstance(item, Mapping) else None for item in data]
+        instances = in_bulk(self.instance, set(pks).difference([None]))
+        self.child.preload_related(data, instances.values())
+
+        ret = []
+        errors = []
+        self.validated_instances = []
+        seen = set()
+        for item, pk in zip(data, pks):
+            instance = instances.get(pk)
+            if pk is None:
+                errors.append({'id': [self.error_messages['missing_id']]})
+            elif instance is None:
+                errors.append({'id': [self.error_messages['does_not_exist'].format(pk_value=pk)]})
+            elif pk in seen:
+                errors.append({'id': [self.error_messages['duplicate_id'].format(pk_value=pk)]})
+            else:
+                seen.add(pk)
+                self.child.instance = instance
+                try:
+                    validated = self.child.run_validation(item)
+                except serializers.ValidationError as exc:
+                    errors.append(exc.detail)
+                else:
+                    ret.append(validated)
+                    self.validated_instances.append(instance)
+                    errors.append({})
+                finally:
+                    self.child.instance = None
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        return ret
+
+    def get_to_many_fields(self):
+        info = model_meta.get_field_info(self.child.Meta.model)
+        return set(name for name, relation in info.forward_relations.items() if relation.to_many)
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        to_many = self.get_to_many_fields()
+        instances = [model(**dict((name, value) for name, value in attrs.items() if name not in to_many))
+                     for attrs in validated_data]
+        bulk_insert(model, instances)
+        for name in to_many:
+            values = dict((instance, [obj.pk for obj in attrs[name]])
+                          for instance, attrs in zip(instances, validated_data) if name in attrs)
+            set_related(instances, name, values)
+        return instances
+
+    def update(self, instance, validated_data):
+        model = self.child.Meta.model
+        to_many = self.get_to_many_fields()
+        instances = self.validated_instances
+        fields = set()
+        related = defaultdict(dict)
+        for obj, attrs in zip(instances, validated_data):
+            for name, value in attrs.items():
+                if name in to_many:
+                    related[name][obj] = [item.pk for item in value]
+                else:
+                    setattr(obj, name, value)
+                    fields.add(name)
+        bulk_update(model, instances, fields)
+        for name, values in related.items():
+            set_related(instances, name, values, replace=True)
+        return instances
+
+
+class TeacherSerializer(TimedRepresentationMixin, SparseFieldsMixin, CountsMixin, ExpandMixin, PreloadRelatedMixin,
+                        SetRelatedMixin, serializers.ModelSerializer):
     class Meta:
         model = Teacher
         fields = '__all__'
 
+    def get_expanded_fields(self):
+        return {
+            'specializations': SpecializationSerializer(many=True, read_only=True),
+            'grades': GradeSerializer(many=True, read_only=True, source='grade_set'),
+        }
 
-class StudentSerializer(serializers.ModelSerializer):
+
+class StudentSerializer(TimedRepresentationMixin, SparseFieldsMixin, ExpandMixin, PreloadRelatedMixin,
+                        SetRelatedMixin, serializers.ModelSerializer):
     class Meta:
         model = Student
         fields = '__all__'
+        list_serializer_class = BulkListSerializer
 
     def __init__(self, *args, **kwargs):
         super(StudentSerializer, self).__init__(*args, **kwargs)
         self.partial = True
 
+    def get_expanded_fields(self):
+        return {
+            'grades': GradeSerializer(many=True, read_only=True),
+        }
+
 
-class GradeSerializer(serializers.ModelSerializer):
+class EnrollmentSerializer(PreloadRelatedMixin, serializers.Serializer):
+    grades = PreloadedPrimaryKeyRelatedField(many=True, allow_empty=False, queryset=Grade.objects.all())
+
+
+class GradeSerializer(TimedRepresentationMixin, SparseFieldsMixin, CountsMixin, ExpandMixin, PreloadRelatedMixin,
+                      serializers.ModelSerializer):
     class Meta:
         model = Grade
         fields = '__all__'
+        list_serializer_class = BulkListSerializer
+
+    def get_expanded_fields(self):
+        return {
+            'teacher': TeacherSerializer(read_only=True),
+            'specialization': SpecializationSerializer(read_only=True),
+            'students': StudentSerializer(many=True, read_only=True, source='student_set'),
+        }
+
+    @property
+    def teacher_specializations(self):
+        return self.context.setdefault('teacher_specializations', TeacherSpecializations())
+
+    def preload_related(self, items, instances=()):
+        super(GradeSerializer, self).preload_related(items, instances)
+        teachers = self.context['preloaded'].get(Teacher, {})
+        teacher_ids = set(teacher.pk for teacher in teachers.values() if teacher is not None)
+        teacher_ids.update(instance.teacher_id for instance in instances)
+        self.teacher_specializations.load(teacher_ids)
 
     def validate(self, attrs):
-        instance = Grade(**attrs)
-        instance.clean()
+        grade = Grade(teacher_id=getattr(self.instance, 'teacher_id', None),
+                      specialization_id=getattr(self.instance, 'specialization_id', None))
+        for name in ('teacher', 'specialization'):
+            if name in attrs:
+                setattr(grade, name, attrs[name])
+        grade.check_specialization(self.teacher_specializations)
         return attrs
 
 
-class SpecializationSerializer(serializers.ModelSerializer):
+class SpecializationSerializer(TimedRepresentationMixin, SparseFieldsMixin, CountsMixin,
+                               serializers.ModelSerializer):
     class Meta:
         model = Specialization
         fields = '__all__'
+
+
+class JobSerializer(serializers.ModelSerializer):
+    default_error_messages = {
+        'invalid_target': 'Для импорта укажите одно из значений: {choices}.',
+        'missing_file': 'Для импорта нужен файл.',
+        'invalid_format': 'Поддерживаются файлы {formats}.',
+    }
+    rows_per_second = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'target', 'file', 'status', 'processed_rows', 'failed_rows', 'rows_per_second',
+                  'message', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = ['status', 'processed_rows', 'failed_rows', 'message', 'started_at', 'finished_at']
+        extra_kwargs = {'file': {'write_only': True}}
+
+    def validate(self, attrs):
+        if attrs['kind'] == Job.IMPORT:
+            if attrs.get('target') not in IMPORTERS:
+                message = self.error_messages['invalid_target'].format(choices=', '.join(IMPORTERS))
+                raise serializers.ValidationError({'target': [message]})
+            if not attrs.get('file'):
+                raise serializers.ValidationError({'file': [self.error_messages['missing_file']]})
+            if os.path.splitext(attrs['file'].name)[1].lower() not in FILE_FORMATS:
+                message = self.error_messages['invalid_format'].format(formats=', '.join(FILE_FORMATS))
+                raise serializers.ValidationError({'file': [message]})
+        return attrs
+
+    def get_rows_per_second(self, obj):
+        if obj.started_at is None:
+            return None
+        seconds = ((obj.finished_at or timezone.now()) - obj.started_at).total_seconds()
+        return int(obj.processed_rows / max(seconds, 1e-6))
+
+
+class JobErrorSerializer(serializers.ModelSerializer):
+    errors = serializers.SerializerMethodField()
+
+    class Meta:
+        model = JobError
+        fields = ['row', 'errors']
+
+    def get_errors(self, obj):
+        return json.loads(obj.errors)
+
+
+class ChangeSerializer(serializers.ModelSerializer):
+    data = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Change
+        fields = ['id', 'model', 'action', 'object_id', 'related_id', 'data', 'created_at']
+
+    def get_data(self, obj):
+        return json.loads(obj.data) if obj.data else None
+
+
+class RosterListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        return get_rosters(list(data))
+
+
+class RosterSerializer(serializers.BaseSerializer):
+    """
+    Read-only roster of a teacher (see ``roster.py``); lists are read for the
+    whole page at once.
+    """
+    class Meta:
+        list_serializer_class = RosterListSerializer
+
+    def to_representation(self, instance):
+        return get_rosters([instance])[0]
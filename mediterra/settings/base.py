@@ -36,9 +36,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mediterra.middleware.InstrumentationMiddleware',
+    'mediterra.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -75,6 +78,71 @@ DATABASES = {
     }
 }
 
+# Aliases in DATABASES of read replicas of 'default'. GET requests to the API
+# read from one of them, except from clients that wrote in the last
+# REPLICA_PIN_SECONDS (see mediterra/routers.py).
+DATABASE_REPLICAS = []
+REPLICA_PIN_SECONDS = 10
+DATABASE_ROUTERS = ['mediterra.routers.PrimaryReplicaRouter']
+
+# PRAGMA statements run on every new SQLite connection, as (name, value) pairs.
+SQLITE_PRAGMAS = []
+
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+
+# The 'api' cache holds rendered API responses (see CacheResponseMixin).
+# Entries are invalidated through table versions stored in the database, so
+# any backend is safe with several processes; FileBasedCache shares entries
+# between them:
+#     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#     'LOCATION': os.path.join(BASE_DIR, 'cache'),
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api',
+        'TIMEOUT': 300,
+    },
+}
+
+API_CACHE_ALIAS = 'api'
+
+# Seconds after which ``manage.py worker`` fails a job that is still running.
+JOB_TIMEOUT = 6 * 60 * 60
+
+# Files of the state shared by the web processes, such as the counters of the
+# API rate limits (see mediterra.filestore).
+STATE_DIR = os.path.join(BASE_DIR, 'state')
+
+# Logging
+# https://docs.djangoproject.com/en/1.10/topics/logging/
+
+# 'mediterra.requests' logs the metrics of every request as JSON at INFO and
+# probable N+1 queries at WARNING.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'mediterra': {
+            'handlers': ['console'],
+            'level': os.environ.get('MEDITERRA_LOG_LEVEL', 'WARNING'),
+        },
+    },
+}
+
+# Requests to the API repeating one SQL statement this many times are logged
+# as probable N+1 queries.
+N_PLUS_ONE_THRESHOLD = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -111,7 +179,38 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Uploaded files, such as the input of import jobs.
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# orjson or ujson speed up JSON when installed; with msgpack installed the
+# API also speaks MessagePack (application/msgpack) for internal clients.
+API_RENDERERS = ['mediterra.renderers.FastJSONRenderer', 'rest_framework.renderers.BrowsableAPIRenderer']
+API_PARSERS = ['mediterra.parsers.FastJSONParser', 'rest_framework.parsers.FormParser',
+               'rest_framework.parsers.MultiPartParser']
+
+try:
+    import msgpack
+except ImportError:
+    pass
+else:
+    API_RENDERERS.insert(1, 'mediterra.renderers.MessagePackRenderer')
+    API_PARSERS.insert(1, 'mediterra.parsers.MessagePackParser')
+
 REST_FRAMEWORK = {
-    'DEFAULT_FILTER_BACKENDS': ('django_filters.rest_framework.DjangoFilterBackend',),
+    'DEFAULT_RENDERER_CLASSES': API_RENDERERS,
+    'DEFAULT_PARSER_CLASSES': API_PARSERS,
+    'DEFAULT_FILTER_BACKENDS': (
+        'django_filters.rest_framework.DjangoFilterBackend',
+        'mediterra.filters.SearchFilter',
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'mediterra.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
+    # Requests per client: lists, exports and bulk writes share the 'list'
+    # budget, everything else the 'detail' one (see mediterra.throttling).
+    'DEFAULT_THROTTLE_CLASSES': ('mediterra.throttling.RouteRateThrottle',),
+    'DEFAULT_THROTTLE_RATES': {
+        'list': '60/min',
+        'detail': '600/min',
+    },
     'TEST_REQUEST_DEFAULT_FORMAT': 'json'
 }
@@ -16,6 +16,14 @@ ALLOWED_HOSTS = '*'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# No rate limits while developing and testing.
+REST_FRAMEWORK = dict(REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={'list': None, 'detail': None})
+
+# A second connection to the development database standing in for a read
+# replica: set DATABASE_REPLICAS = ['replica'] in local.py to route API reads
+# to it. Tests use it as a mirror of the test database.
+DATABASES['replica'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+
 try:
     from .local import *
 except ImportError:
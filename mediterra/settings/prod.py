@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from .base import *
+
+# Production settings, configured from the environment:
+#     DJANGO_SETTINGS_MODULE=mediterra.settings.prod
+#     DJANGO_SECRET_KEY, DJANGO_ALLOWED_HOSTS (comma separated)
+#     DB_ENGINE (sqlite3 or postgresql), DB_NAME, DB_USER, DB_PASSWORD,
+#     DB_HOST, DB_PORT, DB_CONN_MAX_AGE (seconds, 0 closes after each request)
+#     DB_REPLICAS (comma separated hosts of read replicas, or database files
+#     with sqlite3), DB_REPLICA_PIN_SECONDS
+#     MEDIA_ROOT (uploaded files, shared by the web and worker processes)
+#     JOB_TIMEOUT (seconds before a running background job is failed)
+#     STATE_DIR (rate limit counters, shared by the web processes)
+#     API_THROTTLE_LIST, API_THROTTLE_DETAIL (rates such as 60/min, 'none' to
+#     disable), API_NUM_PROXIES (reverse proxies in front, for client addresses)
+# See https://docs.djangoproject.com/en/1.10/howto/deployment/checklist/
+
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+
+# Also keeps the database wrappers from recording every query.
+DEBUG = False
+TEMPLATES[0]['OPTIONS']['debug'] = DEBUG
+
+ALLOWED_HOSTS = [host.strip() for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host.strip()]
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.%s' % DB_ENGINE,
+        'NAME': os.environ.get('DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+        'USER': os.environ.get('DB_USER', ''),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', ''),
+        'PORT': os.environ.get('DB_PORT', ''),
+        # Each worker thread keeps its connection across requests.
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+    }
+}
+
+if DB_ENGINE == 'sqlite3':
+    # WAL lets readers run alongside the writer; with it NORMAL sync is
+    # still safe against corruption and only loses the last commits on power
+    # failure. cache_size is in KiB when negative, mmap_size in bytes.
+    DATABASES['default']['OPTIONS'] = {'timeout': 20}
+    SQLITE_PRAGMAS = [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('cache_size', -64000),
+        ('mmap_size', 256 * 1024 * 1024),
+        ('temp_store', 'MEMORY'),
+    ]
+
+DB_REPLICAS = [location.strip() for location in os.environ.get('DB_REPLICAS', '').split(',') if location.strip()]
+for number, location in enumerate(DB_REPLICAS, 1):
+    alias = 'replica%d' % number
+    DATABASES[alias] = dict(DATABASES['default'], **{'NAME' if DB_ENGINE == 'sqlite3' else 'HOST': location})
+    DATABASE_REPLICAS.append(alias)
+REPLICA_PIN_SECONDS = int(os.environ.get('DB_REPLICA_PIN_SECONDS', REPLICA_PIN_SECONDS))
+
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', MEDIA_ROOT)
+
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', JOB_TIMEOUT))
+
+STATE_DIR = os.environ.get('STATE_DIR', STATE_DIR)
+
+REST_FRAMEWORK = dict(REST_FRAMEWORK, DEFAULT_THROTTLE_RATES=dict(REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']))
+for scope, rate in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'].items():
+    rate = os.environ.get('API_THROTTLE_%s' % scope.upper(), rate)
+    REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'][scope] = None if rate.lower() == 'none' else rate
+if 'API_NUM_PROXIES' in os.environ:
+    REST_FRAMEWORK['NUM_PROXIES'] = int(os.environ['API_NUM_PROXIES'])
+
+LOGGING['loggers']['mediterra']['level'] = os.environ.get('MEDITERRA_LOG_LEVEL', 'INFO')
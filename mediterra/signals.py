@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals, absolute_import
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, pre_delete, post_delete, post_migrate, m2m_changed
+from django.dispatch import receiver
+from .changes import changes_recorded, get_related_pks, record_delete, record_relation, record_save
+from .models import Teacher, Student, Grade, Specialization, Change
+from .roster import apply_changes
+from .search import install_search
+from .versions import bump_versions
+
+MODELS = (Teacher, Student, Grade, Specialization)
+THROUGH_MODELS = (Teacher.specializations.through, Student.grades.through)
+CASCADED_RELATIONS = {
+    Teacher: (Teacher.specializations.through,),
+    Specialization: (Teacher.specializations.through,),
+    Student: (Student.grades.through,),
+    Grade: (Student.grades.through,),
+}
+RELATION_CHANGES = {'post_add': Change.ADD, 'post_remove': Change.REMOVE, 'post_clear': Change.REMOVE}
+
+
+def model_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        bump_versions(sender)
+        record_save(sender, instance, created)
+
+
+def model_deleting(sender, instance, **kwargs):
+    # The rows of the relations of the object go with it, without signals of
+    # their own (see ``bulk.delete_relations``).
+    bump_versions(*CASCADED_RELATIONS[sender])
+
+
+def model_deleted(sender, instance, **kwargs):
+    bump_versions(sender)
+    record_delete(sender, instance)
+
+
+# Connected per model: Django cannot delete the rows of a model with receivers
+# directly, it loads them first to send their signals.
+for model in MODELS:
+    post_save.connect(model_saved, sender=model)
+    pre_delete.connect(model_deleting, sender=model)
+    post_delete.connect(model_deleted, sender=model)
+
+
+@receiver(changes_recorded)
+def update_roster(sender, changes, **kwargs):
+    apply_changes(changes)
+
+
+@receiver(post_migrate)
+def install_search_triggers(sender, using, **kwargs):
+    if sender.name == 'mediterra':
+        install_search(connections[using])
+
+
+def relation_changed(sender, action, instance=None, reverse=False, pk_set=None, **kwargs):
+    if action.startswith('post_'):
+        bump_versions(sender)
+    if action == 'pre_clear':
+        # The cleared rows are read before they are gone and recorded after,
+        # so that receivers of the feed see the relation without them.
+        instance._cleared_pks = get_related_pks(sender, instance, reverse)
+    elif action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_pks', None)
+    if action in RELATION_CHANGES and pk_set:
+        record_relation(sender, RELATION_CHANGES[action], instance, reverse, pk_set)
+
+
+for through in THROUGH_MODELS:
+    m2m_changed.connect(relation_changed, sender=through)
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite' and settings.SQLITE_PRAGMAS:
+        with connection.cursor() as cursor:
+            for name, value in settings.SQLITE_PRAGMAS:
+                cursor.execute('PRAGMA %s = %s' % (name, value))
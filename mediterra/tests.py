@@ -1,9 +1,69 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
+import base64
+import io
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict
+from datetime import date, timedelta
+from itertools import combinations
+from unittest import skipUnless
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import connection, connections, router
+from django.db.models.signals import m2m_changed
+from django.http import QueryDict
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import six, timezone
+from django.utils.six.moves.urllib.parse import urlencode
+from django_filters import OrderingFilter
 from rest_framework import status
-from rest_framework.test import APITestCase
-from .models import Teacher, Student, Grade, Specialization
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
+from .benchmarks import CASES, get_fixture, run_case
+from .bulk import MAX_QUERY_PARAMS, bulk_insert
+from .export import build_rows, iter_rows
+from .filestore import FileStore
+from .imports import import_rows, openpyxl, read_file
+from .jobs import claim_jobs, get_worker_name, reclaim_jobs
+from .filters import CountFilter
+from .parsers import FastJSONParser
+from .renderers import FastJSONRenderer, json_dumps, msgpack
+from .models import Teacher, Student, Grade, Specialization, TeacherSpecializations, Job, Change, RosterEntry
+from .roster import COLUMNS as ROSTER_COLUMNS, rebuild_roster
+from .routers import PIN_COOKIE, get_replica
+from .search import prefix_search
+from .seeding import seed
+from .serializers import GradeSerializer
+from .signals import configure_connection
+from .throttling import RouteRateThrottle
+from .versions import get_versions
+from .viewsets import TeacherViewSet, StudentViewSet, GradeViewSet
+
+
+class QueryParamsMixin(object):
+    def assertParamsFit(self, context):
+        """
+        Check that no ``IN`` list of the captured queries exceeds SQLite's limit.
+        """
+        for query in context.captured_queries:
+            for values in re.findall(r' IN \(([^()]*)\)', query['sql']):
+                self.assertLessEqual(values.count(',') + 1, MAX_QUERY_PARAMS)
 
 
 class TeacherAPITestCase(APITestCase):
@@ -27,20 +87,20 @@ class TeacherAPITestCase(APITestCase):
     def test_get_list(self):
         response = self.client.get(reverse(self.list_url_name))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, [])
+        self.assertEqual(response.data['results'], [])
         self.createTeacher()
         response = self.client.get(reverse(self.list_url_name))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_filter_by_last_name(self):
         self.createTeacher()
         response = self.client.get(reverse(self.list_url_name), {'last_name': self.test_data['last_name']})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
         response = self.client.get(reverse(self.list_url_name), {'last_name': 'Неизвестный'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data['results']), 0)
 
     def test_create(self):
         response = self.client.post(reverse(self.list_url_name),
@@ -94,35 +154,35 @@ class StudentAPITestCase(APITestCase):
     def test_get_list(self):
         response = self.client.get(reverse(self.list_url_name))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, [])
+        self.assertEqual(response.data['results'], [])
         Student.objects.create(**self.test_data)
         response = self.client.get(reverse(self.list_url_name))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_filter_by_last_name(self):
         Student.objects.create(**self.test_data)
         response = self.client.get(reverse(self.list_url_name), {'last_name': self.test_data['last_name']})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
         response = self.client.get(reverse(self.list_url_name), {'last_name': 'Неизвестный'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data['results']), 0)
 
     def test_filter_by_grade(self):
         student1 = Student.objects.create(**self.test_data)
         response = self.client.get(reverse(self.list_url_name), {'grades': self.grade1.pk})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data['results']), 0)
         student1.grades.add(self.grade1)
         student2 = Student.objects.create(first_name='Павел', last_name='Павлов')
         student2.grades.add(self.grade2)
         response = self.client.get(reverse(self.list_url_name), {'grades': self.grade1.pk})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
         response = self.client.get(reverse(self.list_url_name), {'grades': [self.grade1.pk, self.grade2.pk]})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
 
     def test_create(self):
         response = self.client.post(reverse(self.list_url_name), self.test_data)
@@ -201,11 +261,11 @@ class GradeAPITestCase(APITestCase):
     def test_get_list(self):
         response = self.client.get(reverse(self.list_url_name))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, [])
+        self.assertEqual(response.data['results'], [])
         self.createGrade()
         response = self.client.get(reverse(self.list_url_name))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_filter_by_teacher(self):
         grade1 = self.createGrade()
@@ -221,10 +281,10 @@ class GradeAPITestCase(APITestCase):
         )
         response = self.client.get(reverse(self.list_url_name), {'teacher': self.teacher.pk})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
         response = self.client.get(reverse(self.list_url_name), {'teacher': [self.teacher.pk, teacher2.pk]})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
 
     def test_create(self):
         response = self.client.post(reverse(self.list_url_name), {
@@ -284,11 +344,11 @@ class SpecializationAPITestCase(APITestCase):
     def test_get_list(self):
         response = self.client.get(reverse(self.list_url_name))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, [])
+        self.assertEqual(response.data['results'], [])
         self.createSpecialization()
         response = self.client.get(reverse(self.list_url_name))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_create(self):
         response = self.client.post(reverse(self.list_url_name), self.test_data)
@@ -316,3 +376,1588 @@ class SpecializationAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         specialization = Specialization.objects.get(pk=specialization.pk)
         self.assertEqual(specialization.title, update_data['title'])
+
+
+class QueryCountTestCase(APITestCase):
+    """
+    List and detail endpoints must issue a fixed number of queries
+    regardless of how many rows are serialized.
+    """
+    url_names = ['teacher-list', 'student-list', 'grade-list', 'specialization-list']
+
+    def populate(self, count):
+        for i in range(count):
+            specialization = Specialization.objects.create(title='Специализация %d' % i)
+            teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов %d' % i)
+            teacher.specializations.add(specialization)
+            grade = Grade.objects.create(title='%dа' % i, specialization=specialization, teacher=teacher)
+            student = Student.objects.create(first_name='Петр', last_name='Петров %d' % i)
+            student.grades.add(grade)
+
+    def count_queries(self, url_name):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context)
+
+    def test_list_query_count_is_constant(self):
+        self.populate(1)
+        expected = dict((url_name, self.count_queries(url_name)) for url_name in self.url_names)
+        self.populate(10)
+        for url_name in self.url_names:
+            self.assertEqual(self.count_queries(url_name), expected[url_name], url_name)
+
+    def test_list_query_count(self):
+        self.populate(5)
+        # Table versions are read first to build the ETag.
+        self.assertEqual(self.count_queries('teacher-list'), 3)
+        self.assertEqual(self.count_queries('student-list'), 3)
+        self.assertEqual(self.count_queries('grade-list'), 2)
+        self.assertEqual(self.count_queries('specialization-list'), 2)
+
+    def test_delete_query_count(self):
+        self.populate(1)
+        grade = Grade.objects.get()
+        grade.student_set.add(*[Student.objects.create(first_name='Петр', last_name='Петров %d' % i)
+                                for i in range(300)])
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.delete(reverse('grade-detail', args=[grade.pk]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        through = Student.grades.through._meta.db_table
+        deletes = [query['sql'] for query in context.captured_queries
+                   if query['sql'].startswith('DELETE FROM "%s"' % through)]
+        self.assertEqual(len(deletes), 1)
+        self.assertEqual(Student.grades.through.objects.count(), 0)
+
+
+class PaginationTestCase(APITestCase):
+    def setUp(self):
+        super(PaginationTestCase, self).setUp()
+        # Duplicate names make the last_name/first_name prefix of the ordering non-unique.
+        for i in range(7):
+            Student.objects.create(first_name='Петр', last_name='Петров')
+            Student.objects.create(first_name='Павел', last_name='Петров')
+            Student.objects.create(first_name='Иван', last_name='Иванов %d' % i)
+
+    def walk(self, url, key):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data[key]
+        return ids
+
+    def test_forward(self):
+        url = reverse('student-list') + '?page_size=4'
+        expected = list(Student.objects.values_list('id', flat=True))
+        self.assertEqual(self.walk(url, 'next'), expected)
+
+    def test_backward(self):
+        response = self.client.get(reverse('student-list'), {'page_size': 4})
+        url = response.data['next']
+        while True:
+            response = self.client.get(url)
+            if not response.data['next']:
+                break
+            url = response.data['next']
+        ids = self.walk(response.data['previous'], 'previous')
+        expected = list(Student.objects.values_list('id', flat=True))
+        last_page = [item['id'] for item in response.data['results']]
+        self.assertEqual(sorted(ids + last_page), sorted(expected))
+        self.assertEqual(len(ids + last_page), len(expected))
+
+    def test_page_size(self):
+        response = self.client.get(reverse('student-list'))
+        self.assertEqual(len(response.data['results']), 21)
+        self.assertIsNone(response.data['next'])
+        response = self.client.get(reverse('student-list'), {'page_size': 5})
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('student-list'), {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_forged_cursor(self):
+        for position in (['Петров', 'Петр', 'x'], ['Петров', 'Петр', [1]], ['Петров', 1], {'id': 1}):
+            querystring = urlencode({'p': json.dumps(position)})
+            cursor = base64.b64encode(querystring.encode('ascii')).decode('ascii')
+            response = self.client.get(reverse('student-list'), {'cursor': cursor})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+
+    def test_deep_page_query_uses_position(self):
+        response = self.client.get(reverse('student-list'), {'page_size': 20})
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(response.data['next'])
+        sql = context.captured_queries[0]['sql']
+        self.assertNotIn('OFFSET', sql.upper())
+
+
+class ExportTestCase(QueryParamsMixin, APITestCase):
+    def setUp(self):
+        super(ExportTestCase, self).setUp()
+        specialization = Specialization.objects.create(title='Английский язык')
+        teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов')
+        teacher.specializations.add(specialization)
+        self.grade1 = Grade.objects.create(title='5а', specialization=specialization, teacher=teacher)
+        self.grade2 = Grade.objects.create(title='5б', specialization=specialization, teacher=teacher)
+        self.student1 = Student.objects.create(first_name='Петр', last_name='Петров')
+        self.student1.grades.add(self.grade1, self.grade2)
+        self.student2 = Student.objects.create(first_name='Павел', last_name='Павлов')
+
+    def export(self, url_name, **params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson(self):
+        content = self.export('student-export')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(rows, [
+            {'id': self.student1.pk, 'first_name': 'Петр', 'last_name': 'Петров',
+             'grades': [self.grade1.pk, self.grade2.pk]},
+            {'id': self.student2.pk, 'first_name': 'Павел', 'last_name': 'Павлов', 'grades': []},
+        ])
+
+    def test_csv(self):
+        content = self.export('student-export', format='csv')
+        self.assertEqual(content.splitlines(), [
+            'id,first_name,last_name,grades',
+            '%d,Петр,Петров,%d %d' % (self.student1.pk, self.grade1.pk, self.grade2.pk),
+            '%d,Павел,Павлов,' % self.student2.pk,
+        ])
+
+    def test_filter(self):
+        content = self.export('student-export', grades=self.grade2.pk)
+        self.assertEqual([json.loads(line)['id'] for line in content.splitlines()], [self.student1.pk])
+
+    def test_chunks(self):
+        for i in range(5):
+            Student.objects.create(first_name='Иван', last_name='Иванов %d' % i).grades.add(self.grade1)
+        with CaptureQueriesContext(connection) as context:
+            rows = list(iter_rows(Student.objects.all(), chunk_size=3))
+        self.assertEqual([row['id'] for row in rows], sorted(Student.objects.values_list('pk', flat=True)))
+        self.assertEqual(rows[0]['grades'], [self.grade1.pk, self.grade2.pk])
+        # Three chunks, each one query for rows and one for grade ids.
+        self.assertEqual(len(context), 6)
+
+    def test_large_chunks(self):
+        students = bulk_insert(Student, [Student(first_name='Иван', last_name='Иванов %d' % i) for i in range(1500)],
+                               send_signals=False)
+        Student.grades.through.objects.bulk_create([Student.grades.through(student=student, grade=self.grade1)
+                                                    for student in students])
+        with CaptureQueriesContext(connection) as context:
+            rows = list(iter_rows(Student.objects.all()))
+        self.assertEqual(len(rows), 1502)
+        self.assertEqual(rows[-1]['grades'], [self.grade1.pk])
+        # One query for rows and two for grade ids, in batches that fit.
+        self.assertEqual(len(context), 3)
+        self.assertParamsFit(context)
+
+    def test_grades(self):
+        content = self.export('grade-export', format='csv')
+        self.assertEqual(content.splitlines()[0], 'id,title,description,teacher,specialization')
+
+
+class StudentBulkAPITestCase(QueryParamsMixin, APITestCase):
+    url_name = 'student-bulk'
+
+    def setUp(self):
+        super(StudentBulkAPITestCase, self).setUp()
+        specialization = Specialization.objects.create(title='Английский язык')
+        teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов')
+        teacher.specializations.add(specialization)
+        self.grade1 = Grade.objects.create(title='5а', specialization=specialization, teacher=teacher)
+        self.grade2 = Grade.objects.create(title='5б', specialization=specialization, teacher=teacher)
+
+    def test_create(self):
+        data = [
+            {'first_name': 'Петр', 'last_name': 'Петров', 'grades': [self.grade1.pk, self.grade2.pk]},
+            {'first_name': 'Павел', 'last_name': 'Павлов', 'grades': [self.grade2.pk]},
+            {'first_name': 'Иван', 'last_name': 'Иванов'},
+        ]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse(self.url_name), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(Student.objects.count(), 3)
+        student = Student.objects.get(last_name='Петров')
+        self.assertEqual(list(student.grades.all()), [self.grade1, self.grade2])
+        self.assertEqual(list(self.grade2.student_set.order_by('last_name')),
+                         list(Student.objects.filter(last_name__in=['Павлов', 'Петров'])))
+        created = context.captured_queries
+        # Adding rows must not grow the number of queries.
+        Student.objects.all().delete()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse(self.url_name), data * 5)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(context), len(created))
+
+    def test_create_errors(self):
+        data = [
+            {'first_name': 'Петр', 'last_name': 'Петров', 'grades': [self.grade1.pk]},
+            {'first_name': 'Павел', 'last_name': 'Павлов', 'grades': [self.grade2.pk + 100]},
+        ]
+        response = self.client.post(reverse(self.url_name), data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('grades', response.data[1])
+        self.assertEqual(Student.objects.count(), 0)
+
+    def test_update(self):
+        student1 = Student.objects.create(first_name='Петр', last_name='Петров')
+        student1.grades.add(self.grade1)
+        student2 = Student.objects.create(first_name='Павел', last_name='Павлов')
+        response = self.client.patch(reverse(self.url_name), [
+            {'id': student1.pk, 'first_name': 'Сергей', 'grades': [self.grade2.pk]},
+            {'id': student2.pk, 'grades': [self.grade1.pk, self.grade2.pk]},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        student1 = Student.objects.get(pk=student1.pk)
+        self.assertEqual((student1.first_name, student1.last_name), ('Сергей', 'Петров'))
+        self.assertEqual(list(student1.grades.all()), [self.grade2])
+        self.assertEqual(list(student2.grades.all()), [self.grade1, self.grade2])
+
+    def test_update_errors(self):
+        student = Student.objects.create(first_name='Петр', last_name='Петров')
+        response = self.client.patch(reverse(self.url_name), [
+            {'id': student.pk, 'first_name': 'Сергей'},
+            {'first_name': 'Иван'},
+            {'id': student.pk + 100, 'first_name': 'Иван'},
+            {'id': student.pk, 'first_name': 'Иван'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        for errors in response.data[1:]:
+            self.assertIn('id', errors)
+        self.assertEqual(Student.objects.get(pk=student.pk).first_name, 'Петр')
+
+    def test_delete(self):
+        student1 = Student.objects.create(first_name='Петр', last_name='Петров')
+        student1.grades.add(self.grade1)
+        student2 = Student.objects.create(first_name='Павел', last_name='Павлов')
+        student3 = Student.objects.create(first_name='Иван', last_name='Иванов')
+        response = self.client.delete(reverse(self.url_name), [student1.pk, student2.pk])
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(Student.objects.all()), [student3])
+        response = self.client.delete(reverse(self.url_name), [student3.pk, student3.pk + 100])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('id', response.data[1])
+        self.assertEqual(Student.objects.count(), 1)
+
+    def test_large_requests(self):
+        data = [{'first_name': 'Петр', 'last_name': 'Петров %04d' % i} for i in range(1500)]
+        random.Random(0).shuffle(data)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse(self.url_name), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['last_name'] for item in response.data], [item['last_name'] for item in data])
+        self.assertParamsFit(context)
+        pks = [item['id'] for item in response.data][::-1]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(reverse(self.url_name), [{'id': pk, 'grades': [self.grade1.pk]} for pk in pks])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in response.data], pks)
+        self.assertParamsFit(context)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.delete(reverse(self.url_name), pks)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Student.objects.count(), 0)
+        self.assertParamsFit(context)
+
+    def test_signals(self):
+        events = []
+
+        def receiver(sender, instance, action, pk_set, **kwargs):
+            events.append((instance.last_name, action, pk_set))
+
+        m2m_changed.connect(receiver, sender=Student.grades.through)
+        try:
+            self.client.post(reverse(self.url_name), [
+                {'first_name': 'Петр', 'last_name': 'Петров', 'grades': [self.grade1.pk]},
+            ])
+        finally:
+            m2m_changed.disconnect(receiver, sender=Student.grades.through)
+        self.assertEqual(events, [
+            ('Петров', 'pre_add', {self.grade1.pk}),
+            ('Петров', 'post_add', {self.grade1.pk}),
+        ])
+
+
+class EnrollmentTestCase(APITestCase):
+    def setUp(self):
+        specialization = Specialization.objects.create(title='Физика')
+        teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов')
+        teacher.specializations.add(specialization)
+        self.grades = [Grade.objects.create(title='%dа' % i, specialization=specialization, teacher=teacher)
+                       for i in range(5)]
+        self.student = Student.objects.create(first_name='Петр', last_name='Петров')
+        self.student.grades.add(*self.grades[:3])
+        self.events = []
+        m2m_changed.connect(self.receiver, sender=Student.grades.through)
+        self.addCleanup(m2m_changed.disconnect, self.receiver, sender=Student.grades.through)
+
+    def receiver(self, sender, action, pk_set, **kwargs):
+        self.events.append((action, pk_set))
+
+    def post(self, action, grades):
+        return self.client.post(reverse('student-%s' % action, args=[self.student.pk]), {'grades': grades})
+
+    def test_enroll(self):
+        response = self.post('enroll', [self.grades[2].pk, self.grades[3].pk])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['grades'], [grade.pk for grade in self.grades[:4]])
+        self.assertEqual(self.events, [('pre_add', {self.grades[3].pk}), ('post_add', {self.grades[3].pk})])
+
+    def test_unenroll(self):
+        response = self.post('unenroll', [self.grades[0].pk, self.grades[4].pk])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['grades'], [grade.pk for grade in self.grades[1:3]])
+        self.assertEqual(self.events, [('pre_remove', {self.grades[0].pk}), ('post_remove', {self.grades[0].pk})])
+
+    def test_invalid(self):
+        for grades in ([], [self.grades[0].pk, 0]):
+            response = self.post('enroll', grades)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('grades', response.data)
+        self.assertEqual(self.student.grades.count(), 3)
+        self.assertEqual(self.events, [])
+
+    def test_update_writes_only_changes(self):
+        grades = [grade.pk for grade in self.grades[1:4]]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(reverse('student-detail', args=[self.student.pk]), {'grades': grades})
+        self.assertEqual(response.data['grades'], grades)
+        writes = [query['sql'] for query in context.captured_queries
+                  if query['sql'].startswith(('DELETE FROM "mediterra_student_grades"',
+                                              'INSERT INTO "mediterra_student_grades"'))]
+        self.assertEqual(len(writes), 2)
+        self.assertEqual(self.events, [('pre_remove', {self.grades[0].pk}), ('post_remove', {self.grades[0].pk}),
+                                       ('pre_add', {self.grades[3].pk}), ('post_add', {self.grades[3].pk})])
+
+
+class GradeValidationTestCase(APITestCase):
+    def setUp(self):
+        super(GradeValidationTestCase, self).setUp()
+        self.specialization1 = Specialization.objects.create(title='Английский язык')
+        self.specialization2 = Specialization.objects.create(title='Математика')
+        self.teachers = []
+        for i in range(5):
+            teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов %d' % i)
+            teacher.specializations.add(self.specialization1)
+            self.teachers.append(teacher)
+
+    def test_clean(self):
+        grade = Grade(title='5а', teacher=self.teachers[0], specialization=self.specialization2)
+        self.assertRaises(ValidationError, grade.clean)
+        grade.specialization = self.specialization1
+        grade.clean()
+
+    def test_bulk_create_validates_in_one_query(self):
+        data = [{'title': '%dа' % i, 'teacher': teacher.pk, 'specialization': self.specialization1.pk}
+                for i, teacher in enumerate(self.teachers)]
+        serializer = GradeSerializer(data=data, many=True)
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(serializer.is_valid())
+        # One query per relation and one for teacher specializations.
+        self.assertEqual(len(context), 3)
+
+    def test_bulk_create(self):
+        data = [
+            {'title': '5а', 'teacher': self.teachers[0].pk, 'specialization': self.specialization1.pk},
+            {'title': '5б', 'teacher': self.teachers[1].pk, 'specialization': self.specialization2.pk},
+        ]
+        response = self.client.post(reverse('grade-bulk'), data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('non_field_errors', response.data[1])
+        response = self.client.post(reverse('grade-bulk'), data[:1])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Grade.objects.count(), 1)
+
+    def test_partial_update(self):
+        grade = Grade.objects.create(title='5а', teacher=self.teachers[0], specialization=self.specialization1)
+        url = reverse('grade-detail', kwargs={'pk': grade.pk})
+        response = self.client.patch(url, {'title': '6а'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.patch(url, {'specialization': self.specialization2.pk})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(reverse('grade-bulk'), [{'id': grade.pk, 'specialization': self.specialization2.pk}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ResponseCacheTestCase(APITestCase):
+    def setUp(self):
+        super(ResponseCacheTestCase, self).setUp()
+        caches[settings.API_CACHE_ALIAS].clear()
+        self.specialization = Specialization.objects.create(title='Английский язык')
+        self.teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов')
+        self.teacher.specializations.add(self.specialization)
+        self.grade = Grade.objects.create(title='5а', specialization=self.specialization, teacher=self.teacher)
+
+    def test_hit(self):
+        url = reverse('grade-list')
+        response = self.client.get(url, {'teacher': self.teacher.pk})
+        self.assertEqual(len(response.data['results']), 1)
+        with CaptureQueriesContext(connection) as context:
+            cached = self.client.get(url, {'teacher': self.teacher.pk})
+        self.assertEqual(cached.status_code, status.HTTP_200_OK)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(len(context), 1)
+
+    def test_invalidation(self):
+        url = reverse('grade-detail', kwargs={'pk': self.grade.pk})
+        self.assertEqual(self.client.get(url).data['title'], '5а')
+        self.client.patch(url, {'title': '6а'})
+        self.assertEqual(json.loads(self.client.get(url).content.decode('utf-8'))['title'], '6а')
+        Grade.objects.filter(pk=self.grade.pk).delete()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_not_modified(self):
+        url = reverse('specialization-list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        Specialization.objects.create(title='Математика')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_versions(self):
+        versions = get_versions([Grade])
+        self.grade.save()
+        self.assertNotEqual(get_versions([Grade]), versions)
+        versions = get_versions([Student.grades.through])
+        Student.objects.create(first_name='Петр', last_name='Петров').grades.add(self.grade)
+        self.assertNotEqual(get_versions([Student.grades.through]), versions)
+
+
+class ConditionalResponseTestCase(APITestCase):
+    def setUp(self):
+        super(ConditionalResponseTestCase, self).setUp()
+        self.specialization = Specialization.objects.create(title='Английский язык')
+        self.teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов')
+        self.teacher.specializations.add(self.specialization)
+        self.grade = Grade.objects.create(title='5а', specialization=self.specialization, teacher=self.teacher)
+        self.student = Student.objects.create(first_name='Петр', last_name='Петров')
+
+    def test_not_modified_without_query(self):
+        url = reverse('student-list')
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(context), 1)
+
+    def test_modified(self):
+        url = reverse('student-detail', kwargs={'pk': self.student.pk})
+        etag = self.client.get(url)['ETag']
+        self.student.grades.add(self.grade)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['grades'], [self.grade.pk])
+        etag = response['ETag']
+        self.specialization.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['grades'], [])
+
+    def test_etag_depends_on_query(self):
+        url = reverse('teacher-list')
+        response = self.client.get(url)
+        filtered = self.client.get(url, {'last_name': 'Иванов'})
+        self.assertNotEqual(response['ETag'], filtered['ETag'])
+        response = self.client.get(url, {'last_name': 'Иванов'}, HTTP_IF_NONE_MATCH=filtered['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked on SQLite')
+class FilterQueryPlanTestCase(APITestCase):
+    """
+    Runs EXPLAIN QUERY PLAN for every combination of filters exposed by the
+    viewsets and fails when the filtered table is scanned instead of searched.
+    Counts are computed per row and ordering does not filter, so filters on
+    them are left out.
+    """
+    viewsets = [TeacherViewSet, StudentViewSet, GradeViewSet]
+
+    def setUp(self):
+        super(FilterQueryPlanTestCase, self).setUp()
+        specialization = Specialization.objects.create(title='Английский язык')
+        teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов')
+        teacher.specializations.add(specialization)
+        grade = Grade.objects.create(title='5а', specialization=specialization, teacher=teacher)
+        Student.objects.create(first_name='Петр', last_name='Петров').grades.add(grade)
+
+    def get_value(self, filter_):
+        queryset = getattr(filter_, 'queryset', None)
+        if queryset is None and filter_.extra.get('queryset') is not None:
+            queryset = filter_.extra['queryset']
+        if queryset is not None:
+            return str(queryset.model.objects.values_list('pk', flat=True)[0])
+        return 'значение'
+
+    def get_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def test_filters_use_indexes(self):
+        for viewset in self.viewsets:
+            model = viewset.queryset.model
+            filters = dict((name, filter_) for name, filter_ in viewset.filter_class.base_filters.items()
+                           if not isinstance(filter_, (CountFilter, OrderingFilter)))
+            for size in range(1, len(filters) + 1):
+                for names in combinations(sorted(filters), size):
+                    params = QueryDict(mutable=True)
+                    for name in names:
+                        params[name] = self.get_value(filters[name])
+                    queryset = viewset.filter_class(params, queryset=viewset.queryset.all()).qs
+                    queryset = queryset.order_by(*model._meta.ordering)[:101]
+                    plan = self.get_plan(queryset)
+                    scans = [step for step in plan if step.startswith('SCAN %s' % model._meta.db_table)]
+                    self.assertEqual(scans, [], '%s %s: %s' % (model.__name__, names, plan))
+
+
+class SearchTestCase(APITestCase):
+    def setUp(self):
+        self.teacher = Teacher.objects.create(first_name='Петр', last_name='Иванов')
+        self.student = Student.objects.create(first_name='Иван', last_name='Петров')
+        Student.objects.create(first_name='Анна', last_name='Петрова')
+        Student.objects.create(first_name='Петр', last_name='Сидоров')
+        specialization = Specialization.objects.create(title='Математика')
+        Grade.objects.create(title='5а', description='Профильный математический',
+                             specialization=specialization, teacher=self.teacher)
+
+    def search(self, name, query, **params):
+        params['search'] = query
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_prefix(self):
+        data = self.search('teacher-list', 'ива')
+        self.assertEqual([item['id'] for item in data['results']], [self.teacher.pk])
+
+    def test_all_terms_match(self):
+        data = self.search('student-list', 'петров иван')
+        self.assertEqual([item['id'] for item in data['results']], [self.student.pk])
+
+    def test_ranking(self):
+        data = self.search('student-list', 'пет')
+        names = [(item['last_name'], item['first_name']) for item in data['results']]
+        self.assertEqual(names, [('Петров', 'Иван'), ('Петрова', 'Анна'), ('Сидоров', 'Петр')])
+
+    def test_paginated(self):
+        data = self.search('student-list', 'пет', page_size=2)
+        names = [item['last_name'] for item in data['results']]
+        data = self.client.get(data['next']).data
+        names += [item['last_name'] for item in data['results']]
+        self.assertEqual(names, ['Петров', 'Петрова', 'Сидоров'])
+        self.assertIsNone(data['next'])
+
+    def test_grades(self):
+        self.assertEqual(len(self.search('grade-list', '5а')['results']), 1)
+        self.assertEqual(len(self.search('grade-list', 'матем')['results']), 1)
+        self.assertEqual(len(self.search('grade-list', 'физ')['results']), 0)
+
+    def test_index_follows_writes(self):
+        self.student.last_name = 'Смирнов'
+        self.student.save()
+        Student.objects.filter(first_name='Анна').update(last_name='Смирнова')
+        Student.objects.filter(first_name='Петр').delete()
+        self.assertEqual(self.search('student-list', 'пет')['results'], [])
+        self.assertEqual(len(self.search('student-list', 'смирн')['results']), 2)
+
+    def test_prefix_fallback(self):
+        queryset = prefix_search(Student.objects.all(), ['Петров'])
+        self.assertEqual([student.pk for student in queryset.order_by('search_rank', 'pk')],
+                         [self.student.pk, Student.objects.get(first_name='Анна').pk])
+
+    def test_empty_query(self):
+        self.assertEqual(len(self.search('student-list', ' ,')['results']), 3)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Pragmas only apply to SQLite')
+class ConnectionSettingsTestCase(APITestCase):
+    def get_pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA %s' % name)
+            return cursor.fetchone()[0]
+
+    def test_pragmas(self):
+        cache_size = self.get_pragma('cache_size')
+        try:
+            with override_settings(SQLITE_PRAGMAS=[('cache_size', -1234)]):
+                configure_connection(sender=connection.__class__, connection=connection)
+            self.assertEqual(self.get_pragma('cache_size'), -1234)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA cache_size = %d' % cache_size)
+
+
+class SeedTestCase(APITestCase):
+    volumes = {'specializations': 5, 'teachers': 10, 'grades': 20, 'students': 50, 'enrollments': 2}
+
+    def test_counts(self):
+        counts = seed(**self.volumes)
+        self.assertEqual(Student.objects.count(), 50)
+        self.assertEqual(Student.grades.through.objects.count(), 100)
+        self.assertEqual(counts[Student.grades.through._meta.db_table][0], 100)
+
+    def test_grade_specializations(self):
+        seed(**self.volumes)
+        teacher_specializations = TeacherSpecializations()
+        for grade in Grade.objects.all():
+            grade.check_specialization(teacher_specializations)
+
+    def test_load_many_teachers(self):
+        seed(**self.volumes)
+        teacher_specializations = TeacherSpecializations()
+        with self.assertNumQueries(2):
+            teacher_specializations.load(range(1, MAX_QUERY_PARAMS + 2))
+        teacher = Teacher.objects.first()
+        self.assertEqual(teacher_specializations.get(teacher.pk),
+                         set(teacher.specializations.values_list('pk', flat=True)))
+
+    def test_deterministic(self):
+        seed(random_seed=1, **self.volumes)
+        first = list(Student.objects.order_by('pk').values_list('first_name', 'last_name'))
+        Student.objects.all().delete()
+        seed(random_seed=1, **self.volumes)
+        self.assertEqual(list(Student.objects.order_by('pk').values_list('first_name', 'last_name')), first)
+
+
+class BenchmarkTestCase(APITestCase):
+    def test_cases(self):
+        seed(specializations=5, teachers=10, grades=20, students=50, enrollments=2)
+        fixture = get_fixture()
+        for case in CASES:
+            result = run_case(case, fixture, repeat=1, warmup=0)
+            self.assertEqual(result['status'], case.status, case.name)
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super(RecordingHandler, self).__init__(logging.INFO)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class InstrumentationTestCase(APITestCase):
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger('mediterra.requests')
+        self.logger.addHandler(self.handler)
+        self.level = self.logger.level
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.specialization = Specialization.objects.create(title='Английский язык')
+        self.teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов')
+        self.teacher.specializations.add(self.specialization)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+        self.logger.propagate = True
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('teacher-list'))
+        timing = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(sorted(timing), ['db', 'render', 'serialize', 'total'])
+        self.assertIn('desc="%d queries"' % len(queries), timing['db'])
+
+    def test_log(self):
+        self.client.get(reverse('teacher-detail', args=[self.teacher.pk]))
+        metrics = self.handler.records[-1].metrics
+        self.assertEqual(json.loads(self.handler.records[-1].getMessage()), metrics)
+        self.assertEqual(metrics['status'], 200)
+        self.assertEqual(metrics['path'], reverse('teacher-detail', args=[self.teacher.pk]))
+        self.assertGreater(metrics['queries'], 0)
+
+    def test_queries_not_recorded(self):
+        connection.queries_log.clear()
+        self.client.get(reverse('teacher-list'))
+        self.assertEqual(len(connection.queries_log), 0)
+        self.assertFalse(connection.force_debug_cursor)
+
+    @override_settings(N_PLUS_ONE_THRESHOLD=2)
+    def test_repeated_queries(self):
+        # Every written table gets its version bumped with the same UPDATE.
+        response = self.client.post(reverse('teacher-list'), {
+            'first_name': 'Петр', 'last_name': 'Петров', 'specializations': [self.specialization.pk],
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        warnings = [record for record in self.handler.records if record.levelno == logging.WARNING]
+        self.assertEqual(len(warnings), 1)
+        self.assertIn('tableversion', warnings[0].sql)
+
+
+class FastListTestCase(QueryParamsMixin, APITestCase):
+    def setUp(self):
+        specializations = [Specialization.objects.create(title=title) for title in ('Физика', 'Алгебра', 'Химия')]
+        teachers = []
+        for i, (first_name, last_name) in enumerate([('Иван', 'Иванов'), ('Анна', 'Петрова'), ('Петр', 'Иванов')]):
+            teacher = Teacher.objects.create(first_name=first_name, last_name=last_name)
+            teacher.specializations.add(*specializations[:i + 1])
+            teachers.append(teacher)
+        grades = [Grade.objects.create(title=title, specialization=specializations[0], teacher=teachers[2])
+                  for title in ('9б', '5а', '7в')]
+        for i, (first_name, last_name) in enumerate([('Петр', 'Сидоров'), ('Анна', 'Петрова'), ('Иван', 'Петров')]):
+            Student.objects.create(first_name=first_name, last_name=last_name).grades.add(*grades[i:])
+        Student.objects.create(first_name='Олег', last_name='Орлов')
+
+    def get_pages(self, name, params):
+        contents = []
+        url = reverse(name)
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            contents.append(response.content)
+            url, params = response.data['next'], None
+        return contents
+
+    def assert_identical(self, viewset, name, params):
+        self.assertTrue(viewset.fast_list)
+        fast = self.get_pages(name, params)
+        viewset.fast_list = False
+        try:
+            slow = self.get_pages(name, params)
+        finally:
+            viewset.fast_list = True
+        self.assertEqual(fast, slow)
+
+    def test_identical(self):
+        for params in [{}, {'page_size': 2}, {'search': 'пет', 'page_size': 1}, {'last_name': 'Иванов'}]:
+            self.assert_identical(TeacherViewSet, 'teacher-list', params)
+            self.assert_identical(StudentViewSet, 'student-list', params)
+        self.assert_identical(StudentViewSet, 'student-list', {'grades': Grade.objects.all()[0].pk})
+        for fields in ('last_name', 'id,specializations', 'specializations,first_name'):
+            self.assert_identical(TeacherViewSet, 'teacher-list', {'fields': fields, 'page_size': 2})
+        for params in [{'ordering': '-grade_count', 'page_size': 1}, {'grade_count__gte': 1, 'fields': 'id'}]:
+            self.assert_identical(TeacherViewSet, 'teacher-list', params)
+
+    def test_large_pages(self):
+        # Unpaginated lists hand build_rows more rows than fit in one IN list.
+        teacher = Teacher.objects.get(first_name='Петр')
+        rows = [{'id': teacher.pk + i, 'first_name': '', 'last_name': ''} for i in range(1500)]
+        with CaptureQueriesContext(connection) as context:
+            rows = build_rows(Teacher, rows)
+        self.assertEqual(rows[0]['specializations'], list(teacher.specializations.values_list('pk', flat=True)))
+        self.assertEqual(len(context), 2)
+        self.assertParamsFit(context)
+
+
+class RendererTestCase(APITestCase):
+    data = OrderedDict([
+        ('id', 1),
+        ('title', 'Русский язык \u2028 "цитата" / \\'),
+        ('items', [1.5, None, True, {'b': 'б', 'a': []}]),
+        ('date', date(2017, 9, 1)),
+        ('error', ValidationError('ошибка').messages),
+    ])
+
+    def test_same_as_json_renderer(self):
+        self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        self.assertEqual(json_dumps(self.data), JSONRenderer().render(self.data))
+        indented = FastJSONRenderer().render(self.data, 'application/json; indent=4')
+        self.assertEqual(indented, JSONRenderer().render(self.data, 'application/json; indent=4'))
+
+    def test_parser(self):
+        parser = FastJSONParser()
+        data = parser.parse(io.BytesIO(JSONRenderer().render({'title': 'Физика', 'ids': [1, 2]})))
+        self.assertEqual(data, {'title': 'Физика', 'ids': [1, 2]})
+        with self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b'{"title": '))
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack(self):
+        response = self.client.post(reverse('specialization-list'), msgpack.packb({'title': 'Физика'}),
+                                    content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content, raw=False)['title'], 'Физика')
+        response = self.client.get(reverse('specialization-list'), HTTP_ACCEPT='application/msgpack')
+        json_response = self.client.get(reverse('specialization-list'))
+        self.assertEqual(msgpack.unpackb(response.content, raw=False), json.loads(json_response.content.decode()))
+
+
+class ExpandTestCase(APITestCase):
+    def setUp(self):
+        caches[settings.API_CACHE_ALIAS].clear()
+        self.populate(1)
+
+    def populate(self, count):
+        for i in range(count):
+            specialization = Specialization.objects.create(title='Специализация %d' % i)
+            teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов %d' % i)
+            teacher.specializations.add(specialization)
+            grade = Grade.objects.create(title='%dа' % i, specialization=specialization, teacher=teacher)
+            for j in range(2):
+                Student.objects.create(first_name='Петр', last_name='Петров %d' % j).grades.add(grade)
+
+    def get(self, url_name, expand, *args):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name, args=args), {'expand': expand})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, len(queries)
+
+    def test_grade(self):
+        grade = Grade.objects.get()
+        data, queries = self.get('grade-detail', 'teacher,specialization,students', grade.pk)
+        self.assertEqual(data['teacher'], {'id': grade.teacher.pk, 'first_name': 'Иван', 'last_name': 'Иванов 0',
+                                           'specializations': [grade.specialization.pk]})
+        self.assertEqual(data['specialization'], {'id': grade.specialization.pk, 'title': 'Специализация 0'})
+        self.assertEqual([student['last_name'] for student in data['students']], ['Петров 0', 'Петров 1'])
+        self.assertEqual(data['students'][0]['grades'], [grade.pk])
+
+    def test_query_count_is_constant(self):
+        cases = [
+            ('grade-list', 'teacher,specialization,students', 5),
+            ('teacher-list', 'grades,specializations', 4),
+            ('student-list', 'grades', 3),
+        ]
+        for url_name, expand, expected in cases:
+            self.assertEqual(self.get(url_name, expand)[1], expected, url_name)
+        self.populate(5)
+        for url_name, expand, expected in cases:
+            data, queries = self.get(url_name, expand)
+            self.assertEqual(queries, expected, url_name)
+            self.assertTrue(all(isinstance(item[name], (dict, list)) for item in data['results']
+                                for name in expand.split(',')))
+
+    def test_expanded_objects_invalidate_cache(self):
+        self.get('grade-list', 'teacher')
+        Teacher.objects.update(last_name='Сидоров')
+        Teacher.objects.get().save()
+        data, queries = self.get('grade-list', 'teacher')
+        self.assertEqual(data['results'][0]['teacher']['last_name'], 'Сидоров')
+
+    def test_invalid(self):
+        response = self.client.get(reverse('grade-list'), {'expand': 'teacher,owner'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('expand', response.data)
+
+    def test_writes_are_not_expanded(self):
+        grade = Grade.objects.get()
+        url = '%s?expand=teacher' % reverse('grade-detail', args=[grade.pk])
+        response = self.client.patch(url, {'title': '1б'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['teacher'], grade.teacher_id)
+
+
+class SparseFieldsTestCase(APITestCase):
+    def setUp(self):
+        caches[settings.API_CACHE_ALIAS].clear()
+        specialization = Specialization.objects.create(title='Физика')
+        teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов')
+        teacher.specializations.add(specialization)
+        self.grade = Grade.objects.create(title='5а', description='Физико-математический',
+                                          specialization=specialization, teacher=teacher)
+        for i in range(3):
+            Student.objects.create(first_name='Петр', last_name='Петров %d' % i).grades.add(self.grade)
+
+    def get(self, url_name, params, *args):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name, args=args), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, queries
+
+    def test_output(self):
+        data, queries = self.get('grade-list', {'fields': 'id,title'})
+        self.assertEqual(data['results'], [{'id': self.grade.pk, 'title': '5а'}])
+        data, queries = self.get('grade-detail', {'fields': 'title'}, self.grade.pk)
+        self.assertEqual(data, {'title': '5а'})
+        data, queries = self.get('specialization-list', {'fields': 'title'})
+        self.assertEqual(data['results'], [{'title': 'Физика'}])
+
+    def test_columns_are_deferred(self):
+        data, queries = self.get('grade-list', {'fields': 'id,title'})
+        sql = queries[-1]['sql']
+        self.assertIn('"title"', sql)
+        self.assertNotIn('description', sql)
+        self.assertNotIn('teacher_id', sql)
+
+    def test_to_many_is_not_prefetched(self):
+        # The versions query and the students query, plus one per to-many relation.
+        self.assertEqual(len(self.get('student-list', {})[1]), 3)
+        data, queries = self.get('student-list', {'fields': 'last_name'})
+        self.assertEqual(len(queries), 2)
+        self.assertEqual([item['last_name'] for item in data['results']], ['Петров 0', 'Петров 1', 'Петров 2'])
+        data, queries = self.get('student-list', {'fields': 'last_name,grades'})
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(data['results'][0], {'last_name': 'Петров 0', 'grades': [self.grade.pk]})
+
+    def test_pagination(self):
+        data, queries = self.get('student-list', {'fields': 'first_name', 'page_size': 2})
+        self.assertEqual(len(data['results']), 2)
+        response = self.client.get(data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'], [{'first_name': 'Петр'}])
+
+    def test_with_expand(self):
+        data, queries = self.get('grade-detail', {'fields': 'title', 'expand': 'teacher'}, self.grade.pk)
+        self.assertEqual(data['title'], '5а')
+        self.assertEqual(data['teacher']['last_name'], 'Иванов')
+        self.assertEqual(sorted(data), ['teacher', 'title'])
+
+    def test_invalid(self):
+        response = self.client.get(reverse('grade-list'), {'fields': 'title,owner'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fields', response.data)
+
+    def test_writes_return_all_fields(self):
+        url = '%s?fields=title' % reverse('grade-detail', args=[self.grade.pk])
+        response = self.client.patch(url, {'description': ''})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['teacher'], self.grade.teacher_id)
+
+
+class CountsTestCase(APITestCase):
+    def setUp(self):
+        caches[settings.API_CACHE_ALIAS].clear()
+        self.specializations = [Specialization.objects.create(title=title) for title in ('Физика', 'Химия')]
+        self.teachers = []
+        for i, last_name in enumerate(['Иванов', 'Петров', 'Сидоров']):
+            teacher = Teacher.objects.create(first_name='Иван', last_name=last_name)
+            teacher.specializations.add(*self.specializations[:i])
+            self.teachers.append(teacher)
+        self.grades = [Grade.objects.create(title=title, specialization=self.specializations[0],
+                                            teacher=self.teachers[2]) for title in ('5а', '6а', '7а')]
+        self.grades.append(Grade.objects.create(title='8а', specialization=self.specializations[0],
+                                                teacher=self.teachers[1]))
+        for i in range(3):
+            Student.objects.create(first_name='Петр', last_name='Петров %d' % i).grades.add(*self.grades[i:])
+
+    def get(self, url_name, params=None, *args):
+        response = self.client.get(reverse(url_name, args=args), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_counts(self):
+        data = self.get('grade-list')
+        self.assertEqual([(item['title'], item['student_count']) for item in data['results']],
+                         [('5а', 1), ('6а', 2), ('7а', 3), ('8а', 3)])
+        data = self.get('teacher-list')
+        self.assertEqual([item['grade_count'] for item in data['results']], [0, 1, 3])
+        data = self.get('specialization-list')
+        self.assertEqual([item['teacher_count'] for item in data['results']], [2, 1])
+        self.assertEqual(self.get('grade-detail', None, self.grades[0].pk)['student_count'], 1)
+
+    def test_counts_follow_writes(self):
+        self.assertEqual(self.get('grade-detail', None, self.grades[0].pk)['student_count'], 1)
+        self.assertEqual(self.get('teacher-detail', None, self.teachers[0].pk)['grade_count'], 0)
+        Student.objects.get(last_name='Петров 1').grades.add(self.grades[0])
+        Grade.objects.create(title='9а', specialization=self.specializations[0], teacher=self.teachers[0])
+        self.assertEqual(self.get('grade-detail', None, self.grades[0].pk)['student_count'], 2)
+        self.assertEqual(self.get('teacher-detail', None, self.teachers[0].pk)['grade_count'], 1)
+
+    def test_counts_follow_cascade_deletes(self):
+        def get_counts(url_name, field):
+            response = self.client.get(reverse(url_name), {'fields': 'id,%s' % field})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # Cached responses come without ``data``.
+            results = json.loads(response.content.decode('utf-8'))['results']
+            return [item[field] for item in results], response['ETag']
+
+        grade_counts, grade_etag = get_counts('grade-list', 'student_count')
+        specialization_counts, specialization_etag = get_counts('specialization-list', 'teacher_count')
+        self.assertEqual(grade_counts, [1, 2, 3, 3])
+        self.assertEqual(specialization_counts, [2, 1])
+        student = Student.objects.get(last_name='Петров 0')
+        self.assertEqual(self.client.delete(reverse('student-detail', args=[student.pk])).status_code,
+                         status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.delete(reverse('teacher-detail', args=[self.teachers[1].pk])).status_code,
+                         status.HTTP_204_NO_CONTENT)
+
+        counts, etag = get_counts('grade-list', 'student_count')
+        self.assertEqual(counts, [0, 1, 2])
+        self.assertNotEqual(etag, grade_etag)
+        counts, etag = get_counts('specialization-list', 'teacher_count')
+        self.assertEqual(counts, [1, 1])
+        self.assertNotEqual(etag, specialization_etag)
+
+    def test_created_objects(self):
+        response = self.client.post(reverse('specialization-list'), {'title': 'Биология'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['teacher_count'], 0)
+
+    def test_nested_objects_have_no_counts(self):
+        data = self.get('grade-detail', {'expand': 'teacher,specialization'}, self.grades[0].pk)
+        self.assertNotIn('grade_count', data['teacher'])
+        self.assertNotIn('teacher_count', data['specialization'])
+
+    def test_filter(self):
+        data = self.get('grade-list', {'student_count__gte': 2, 'student_count__lte': 2})
+        self.assertEqual([item['title'] for item in data['results']], ['6а'])
+        data = self.get('teacher-list', {'grade_count': 0})
+        self.assertEqual([item['last_name'] for item in data['results']], ['Иванов'])
+        data = self.get('specialization-list', {'teacher_count__gte': 2, 'fields': 'title'})
+        self.assertEqual(data['results'], [{'title': 'Физика'}])
+
+    def test_ordering_pages(self):
+        titles = []
+        url, params = reverse('grade-list'), {'ordering': '-student_count,title', 'page_size': 1, 'fields': 'title'}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            titles.extend(item['title'] for item in response.data['results'])
+            url, params = response.data['next'], None
+        self.assertEqual(titles, ['7а', '8а', '6а', '5а'])
+
+    def test_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get('grade-list', {'student_count__gte': 1})
+        # The versions query and the grades query.
+        self.assertEqual(len(queries), 2)
+        self.assertIn('COUNT(*)', queries[-1]['sql'])
+        with CaptureQueriesContext(connection) as queries:
+            self.get('grade-list', {'fields': 'title'})
+        self.assertNotIn('COUNT(*)', queries[-1]['sql'])
+
+
+class JobTestCase(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        logger = logging.getLogger('mediterra.jobs')
+        handler = logging.NullHandler()
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(setattr, logger, 'propagate', logger.propagate)
+        logger.propagate = False
+        self.specialization = Specialization.objects.create(title='Физика')
+        teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов')
+        teacher.specializations.add(self.specialization)
+        self.grades = [Grade.objects.create(title=title, specialization=self.specialization, teacher=teacher)
+                       for title in ('5а', '6а')]
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def submit(self, target, content, **data):
+        data.update(kind='import', target=target, file=SimpleUploadedFile('data.csv', content.encode('utf-8')))
+        return self.client.post(reverse('job-list'), data, format='multipart')
+
+    def work(self):
+        call_command('worker', processes=0, once=True, stdout=six.StringIO())
+
+    def test_import(self):
+        content = 'id,first_name,last_name,grades\r\n'
+        content += '1,Петр,Петров,%d %d\r\n' % tuple(grade.pk for grade in self.grades)
+        content += '2,,Сидоров,\r\n'
+        content += '3,Анна,"Иванова, мл.",%d\r\n' % self.grades[1].pk
+        content += '4,Олег,Орлов,0\r\n'
+        response = self.submit('students', '\ufeff' + content)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], Job.PENDING)
+        url = response['Location']
+        self.assertTrue(url.endswith(reverse('job-detail', args=[response.data['id']])))
+
+        self.work()
+        response = self.client.get(url)
+        self.assertEqual(response.data['status'], Job.DONE)
+        self.assertEqual((response.data['processed_rows'], response.data['failed_rows']), (4, 2))
+        self.assertIsNotNone(response.data['finished_at'])
+        self.assertEqual(sorted(Student.objects.values_list('last_name', flat=True)), ['Иванова, мл.', 'Петров'])
+        self.assertEqual(list(Student.objects.get(last_name='Петров').grades.order_by('pk')), self.grades)
+
+        response = self.client.get(reverse('job-errors', args=[response.data['id']]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(error['row'], sorted(error['errors'])) for error in response.data['results']],
+                         [(2, ['first_name']), (4, ['grades'])])
+
+    def test_invalid_file_fails_job(self):
+        response = self.submit('teachers', 'first_name,nickname\r\nИван,Ваня\r\n')
+        self.work()
+        job = Job.objects.get(pk=response.data['id'])
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('nickname', job.message)
+        self.assertFalse(Teacher.objects.filter(first_name='Ваня').exists())
+
+    def test_invalid_request(self):
+        response = self.submit('specializations', 'title\r\n')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('target', response.data)
+        response = self.client.post(reverse('job-list'), {
+            'kind': 'import', 'target': 'students', 'file': SimpleUploadedFile('data.txt', b'first_name\r\n'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('file', response.data)
+        response = self.client.post(reverse('job-list'), {'kind': 'import', 'target': 'students'}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('file', response.data)
+        self.assertFalse(Job.objects.exists())
+
+    def test_jobs_are_claimed_once(self):
+        pks = [self.submit('students', 'first_name,last_name\r\n').data['id'] for i in range(3)]
+        self.assertEqual(claim_jobs(2), pks[:2])
+        self.assertEqual(claim_jobs(2), pks[2:])
+        self.assertEqual(claim_jobs(2), [])
+        self.assertEqual(set(Job.objects.values_list('status', flat=True)), set([Job.RUNNING]))
+
+    def test_reclaim(self):
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        now = timezone.now()
+        workers = [
+            ('%s:%d' % (socket.gethostname(), process.pid), now),
+            (get_worker_name(), now),
+            ('other:1', now - timedelta(hours=2)),
+            ('other:1', now),
+        ]
+        pks = [Job.objects.create(kind=Job.IMPORT, target='students', status=Job.RUNNING, worker=worker,
+                                  started_at=started_at).pk for worker, started_at in workers]
+        self.assertEqual(reclaim_jobs(3600), [pks[0], pks[2]])
+        jobs = Job.objects.in_bulk(pks)
+        self.assertEqual([jobs[pk].status for pk in pks], [Job.FAILED, Job.RUNNING, Job.FAILED, Job.RUNNING])
+        self.assertIn('остановлен', jobs[pks[0]].message)
+        self.assertIn('3600', jobs[pks[2]].message)
+        # The worker fails them on start, before claiming new jobs.
+        with override_settings(JOB_TIMEOUT=0):
+            self.work()
+        self.assertEqual(set(Job.objects.values_list('status', flat=True)), set([Job.FAILED]))
+
+
+class ImportTestCase(APITestCase):
+    def setUp(self):
+        self.physics, self.chemistry = [Specialization.objects.create(title=title) for title in ('Физика', 'Химия')]
+        self.teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов')
+        self.teacher.specializations.add(self.physics)
+        self.grade = Grade.objects.create(title='5а', specialization=self.physics, teacher=self.teacher)
+
+    def run_import(self, target, rows, chunk_size=2):
+        errors = []
+        result = import_rows(target, rows, chunk_size=chunk_size, report=lambda count, failed: errors.extend(failed))
+        return result[:2], errors
+
+    def test_upsert_on_natural_key(self):
+        rows = [['last_name', 'first_name', 'grades'], ['Петров', 'Петр', ''], ['Сидоров', 'Олег', str(self.grade.pk)]]
+        self.assertEqual(self.run_import('students', rows), ((2, 0), []))
+        self.assertEqual(Student.objects.count(), 2)
+        student = Student.objects.get(last_name='Петров')
+        self.assertFalse(student.grades.exists())
+
+        with self.assertNumQueries(12):
+            self.assertEqual(self.run_import('students', [['last_name', 'first_name', 'grades'],
+                                                          ['Петров', 'Петр', str(self.grade.pk)]],
+                                             chunk_size=10)[0], (1, 0))
+        self.assertEqual(Student.objects.get(last_name='Петров').pk, student.pk)
+        self.assertEqual(list(student.grades.all()), [self.grade])
+
+    def test_duplicate_rows(self):
+        rows = [['last_name', 'first_name', 'grades'], ['Петров', 'Петр', ''], ['Петров', 'Петр', ''],
+                ['Сидоров', 'Олег', ''], [], ['Петров', 'Петр', str(self.grade.pk)]]
+        (processed, failed), errors = self.run_import('students', rows)
+        self.assertEqual((processed, failed), (4, 2))
+        self.assertEqual([(number, list(details)) for number, details in errors],
+                         [(2, ['non_field_errors']), (5, ['non_field_errors'])])
+        self.assertEqual(Student.objects.filter(last_name='Петров').count(), 1)
+        self.assertFalse(Student.objects.get(last_name='Петров').grades.exists())
+
+    def test_match_on_id(self):
+        namesakes = [Student.objects.create(first_name='Иван', last_name='Иванов') for i in range(2)]
+        rows = [['id', 'last_name', 'first_name', 'grades'],
+                [str(namesakes[0].pk), 'Иванов', 'Иван', str(self.grade.pk)],
+                [str(namesakes[1].pk), 'Иванова', 'Ирина', ''],
+                ['0', 'Петров', 'Петр', ''],
+                ['', 'Иванов', 'Иван', '']]
+        (processed, failed), errors = self.run_import('students', rows)
+        self.assertEqual((processed, failed), (4, 1))
+        # Without an id the name matches both namesakes, one already imported.
+        self.assertEqual([number for number, details in errors], [4])
+        self.assertEqual(list(namesakes[0].grades.all()), [self.grade])
+        self.assertEqual(Student.objects.get(pk=namesakes[1].pk).last_name, 'Иванова')
+        self.assertTrue(Student.objects.filter(last_name='Петров').exclude(pk=0).exists())
+
+    def test_grade_specialization_rule(self):
+        rows = [['title', 'teacher', 'specialization', 'description'],
+                ['5а', str(self.teacher.pk), str(self.physics.pk), 'Обновлен'],
+                ['6а', str(self.teacher.pk), str(self.chemistry.pk), ''],
+                ['7а', '0', str(self.physics.pk), ''],
+                ['8а', str(self.teacher.pk), '', '']]
+        (rows, failed), errors = self.run_import('grades', rows)
+        self.assertEqual((rows, failed), (4, 3))
+        self.assertEqual([(number, list(details)) for number, details in errors],
+                         [(2, ['specialization']), (3, ['teacher']), (4, ['specialization'])])
+        self.assertEqual(list(Grade.objects.values_list('title', 'description')), [('5а', 'Обновлен')])
+
+    def test_enrollments(self):
+        student = Student.objects.create(first_name='Петр', last_name='Петров')
+        other = Grade.objects.create(title='6а', specialization=self.physics, teacher=self.teacher)
+        student.grades.add(self.grade)
+        rows = [['student', 'grade'], [str(student.pk), str(other.pk)], [str(student.pk), str(self.grade.pk)],
+                [str(student.pk), 'x']]
+        (rows, failed), errors = self.run_import('enrollments', rows)
+        self.assertEqual((rows, failed), (3, 1))
+        self.assertEqual(list(errors[0][1]), ['grade'])
+        self.assertEqual(list(student.grades.order_by('pk')), [self.grade, other])
+
+    def test_invalid_header(self):
+        for header, name in [(['first_name', 'specializations'], 'last_name'),
+                             (['first_name', 'last_name', 'nickname'], 'nickname')]:
+            with self.assertRaises(ValueError) as context:
+                import_rows('teachers', [header])
+            self.assertIn(name, six.text_type(context.exception))
+
+    def test_command(self):
+        path = tempfile.mktemp(suffix='.csv')
+        self.addCleanup(os.remove, path)
+        with io.open(path, 'w', encoding='utf-8') as fileobj:
+            fileobj.write('first_name,last_name,specializations\r\nАнна,Смирнова,%d %d\r\n' % (
+                self.physics.pk, self.chemistry.pk))
+        stdout = six.StringIO()
+        call_command('import_file', 'teachers', path, chunk_size=1, stdout=stdout)
+        self.assertIn('1 rows, 0 failed', stdout.getvalue())
+        teacher = Teacher.objects.get(last_name='Смирнова')
+        self.assertEqual(set(teacher.specializations.all()), set([self.physics, self.chemistry]))
+
+    @skipUnless(openpyxl, 'openpyxl is not installed')
+    def test_xlsx(self):
+        workbook = openpyxl.Workbook()
+        workbook.active.append(['last_name', 'first_name', 'grades'])
+        workbook.active.append(['Петров', 'Петр', self.grade.pk])
+        workbook.active.append(['Сидоров', 'Олег', None])
+        content = io.BytesIO()
+        workbook.save(content)
+        content.seek(0)
+        self.assertEqual(self.run_import('students', read_file(content, 'students.xlsx')), ((2, 0), []))
+        self.assertEqual(list(Student.objects.get(last_name='Петров').grades.all()), [self.grade])
+
+
+class ChangeFeedTestCase(APITestCase):
+    def setUp(self):
+        self.specialization = Specialization.objects.create(title='Физика')
+        self.teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов')
+        self.teacher.specializations.add(self.specialization)
+        self.grades = [Grade.objects.create(title=title, specialization=self.specialization, teacher=self.teacher)
+                       for title in ('5а', '6а')]
+        self.since = self.get_changes(since='latest')['next']
+
+    def get_changes(self, **params):
+        response = self.client.get(reverse('change-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def summarize(self, changes):
+        return [(change['model'], change['action'], change['object_id'], change['related_id'])
+                for change in changes['results']]
+
+    @skipUnless(connection.vendor == 'postgresql', 'SQLite serializes writers itself')
+    def test_feed_locked_until_commit(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.patch(reverse('teacher-detail', args=[self.teacher.pk]), {'first_name': 'Петр'})
+        statements = [query['sql'] for query in context.captured_queries]
+        lock = [index for index, sql in enumerate(statements) if sql.startswith('LOCK TABLE')]
+        insert = [index for index, sql in enumerate(statements) if 'INSERT INTO "mediterra_change"' in sql]
+        self.assertTrue(lock and insert)
+        self.assertLess(lock[0], insert[0])
+
+    def test_feed(self):
+        response = self.client.post(reverse('student-list'), {
+            'first_name': 'Петр', 'last_name': 'Петров', 'grades': [self.grades[0].pk]})
+        student = response.data['id']
+        self.client.patch(reverse('student-detail', args=[student]), {'grades': [self.grades[1].pk]})
+        self.client.delete(reverse('student-detail', args=[student]))
+        changes = self.get_changes(since=self.since)
+        self.assertEqual(self.summarize(changes), [
+            ('students', Change.CREATE, student, None),
+            ('students.grades', Change.ADD, student, self.grades[0].pk),
+            ('students', Change.UPDATE, student, None),
+            ('students.grades', Change.REMOVE, student, self.grades[0].pk),
+            ('students.grades', Change.ADD, student, self.grades[1].pk),
+            ('students.grades', Change.REMOVE, student, self.grades[1].pk),
+            ('students', Change.DELETE, student, None),
+        ])
+        self.assertEqual(changes['results'][0]['data'], {'id': student, 'first_name': 'Петр', 'last_name': 'Петров'})
+        self.assertEqual(changes['next'], changes['results'][-1]['id'])
+        self.assertFalse(changes['has_more'])
+
+        student = Student.objects.create(first_name='Анна', last_name='Смирнова')
+        self.grades[1].student_set.add(student)
+        self.grades[1].student_set.clear()
+        changes = self.get_changes(since=changes['next'], models='students.grades')
+        self.assertEqual(self.summarize(changes), [
+            ('students.grades', Change.ADD, student.pk, self.grades[1].pk),
+            ('students.grades', Change.REMOVE, student.pk, self.grades[1].pk),
+        ])
+
+    def test_grade_delete(self):
+        students = [Student.objects.create(first_name='Петр', last_name='Петров %d' % i) for i in range(2)]
+        self.grades[0].student_set.add(*students)
+        since = self.get_changes(since='latest')['next']
+        response = self.client.delete(reverse('grade-detail', args=[self.grades[0].pk]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        changes = self.get_changes(since=since, models='students,students.grades')
+        self.assertEqual(self.summarize(changes), [
+            ('students.grades', Change.REMOVE, student.pk, self.grades[0].pk) for student in students])
+
+    def test_pages(self):
+        self.client.post(reverse('student-bulk'), [{'first_name': 'Петр', 'last_name': 'Петров %d' % i}
+                                                   for i in range(5)])
+        first = self.get_changes(since=self.since, limit=3)
+        self.assertTrue(first['has_more'])
+        second = self.get_changes(since=first['next'], limit=3)
+        self.assertFalse(second['has_more'])
+        ids = [change['id'] for change in first['results'] + second['results']]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(self.get_changes(since=second['next']), {'next': second['next'], 'has_more': False,
+                                                                  'results': []})
+
+    def test_invalid_params(self):
+        for params in ({'since': 'x'}, {'since': '-1'}, {'models': 'students,jobs'}):
+            response = self.client.get(reverse('change-list'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(list(params)[0], response.data)
+
+
+@skipUnless(connection.vendor != 'sqlite' or connection.features.can_share_in_memory_db,
+            'the replica connection cannot open the in-memory test database')
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaTestCase(APITransactionTestCase):
+    # Committed rows are visible through the replica connection, which
+    # mirrors the test database.
+
+    def setUp(self):
+        specialization = Specialization.objects.create(title='Физика')
+        self.teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов')
+        self.teacher.specializations.add(specialization)
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+        state = override_settings(STATE_DIR=self.state_dir)
+        state.enable()
+        self.addCleanup(state.disable)
+
+    def get(self, url, address='127.0.0.1', **params):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(url, params, REMOTE_ADDR=address)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return content, len(primary), len(replica)
+
+    def test_reads_from_replica(self):
+        content, primary, replica = self.get(reverse('teacher-list'))
+        self.assertIn('Иванов', content.decode('utf-8'))
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+        content, primary, replica = self.get(reverse('teacher-export'), format='csv')
+        self.assertEqual(len(content.decode('utf-8').splitlines()), 2)
+        self.assertEqual(primary, 0)
+        self.assertEqual(router.db_for_read(Teacher), 'default')
+
+    def test_pinned_after_write(self):
+        response = self.client.patch(reverse('teacher-detail', args=[self.teacher.pk]), {'first_name': 'Петр'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        content, primary, replica = self.get(reverse('teacher-detail', args=[self.teacher.pk]))
+        self.assertEqual(replica, 0)
+        # Clients dropping cookies stay pinned by their address.
+        self.client.cookies.clear()
+        content, primary, replica = self.get(reverse('teacher-detail', args=[self.teacher.pk]))
+        self.assertEqual(replica, 0)
+        content, primary, replica = self.get(reverse('teacher-detail', args=[self.teacher.pk]), address='10.0.0.1')
+        self.assertEqual(primary, 0)
+
+    @override_settings(DATABASE_REPLICAS=['default', 'replica'])
+    def test_same_replica_per_client(self):
+        # The change feed and the export read after it come from one replica.
+        addresses = ['10.0.0.%d' % number for number in range(20)]
+        replicas = dict((address, get_replica(address)) for address in addresses)
+        self.assertEqual(set(replicas.values()), {'default', 'replica'})
+        for address, alias in replicas.items():
+            for url, params in ((reverse('change-list'), {'since': 'latest'}),
+                                (reverse('teacher-export'), {'format': 'csv'})):
+                content, primary, replica = self.get(url, address=address, **params)
+                self.assertEqual(replica > 0, alias == 'replica')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        response = self.client.patch(reverse('teacher-detail', args=[self.teacher.pk]), {'first_name': 'Петр'})
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        content, primary, replica = self.get(reverse('teacher-list'))
+        self.assertEqual(replica, 0)
+
+
+class RosterTestCase(APITestCase):
+    def setUp(self):
+        self.specializations = [Specialization.objects.create(title=title) for title in ('Физика', 'Химия')]
+        self.teachers = [Teacher.objects.create(first_name='Иван', last_name=last_name)
+                         for last_name in ('Иванов', 'Сидоров')]
+        for teacher in self.teachers:
+            teacher.specializations.add(*self.specializations)
+        self.grades = [Grade.objects.create(title=title, specialization=self.specializations[0],
+                                            teacher=self.teachers[0]) for title in ('6а', '5а')]
+        self.students = [Student.objects.create(first_name='Петр', last_name=last_name)
+                         for last_name in ('Петров', 'Смирнов')]
+        for student in self.students:
+            student.grades.add(self.grades[0])
+
+    def get_roster(self, teacher):
+        response = self.client.get(reverse('roster-detail', args=[teacher.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Responses are cached, so they may come without ``data``.
+        return json.loads(response.content.decode('utf-8'))
+
+    def summarize(self, teacher):
+        return [(grade['title'], grade['specialization']['title'], [student['last_name'] for student in grade['students']])
+                for grade in self.get_roster(teacher)['grades']]
+
+    def assert_consistent(self):
+        rows = list(RosterEntry.objects.values_list(*ROSTER_COLUMNS))
+        rebuild_roster()
+        self.assertEqual(rows, list(RosterEntry.objects.values_list(*ROSTER_COLUMNS)))
+
+    def test_roster(self):
+        roster = self.get_roster(self.teachers[0])
+        self.assertEqual(roster['last_name'], 'Иванов')
+        self.assertEqual(roster['grades'][1], {
+            'id': self.grades[0].pk,
+            'title': '6а',
+            'specialization': {'id': self.specializations[0].pk, 'title': 'Физика'},
+            'students': [{'id': student.pk, 'first_name': 'Петр', 'last_name': student.last_name}
+                         for student in self.students],
+        })
+        self.assertEqual(self.summarize(self.teachers[0]), [('5а', 'Физика', []),
+                                                            ('6а', 'Физика', ['Петров', 'Смирнов'])])
+        self.assertEqual(self.get_roster(self.teachers[1])['grades'], [])
+        self.assert_consistent()
+
+    def test_follows_writes(self):
+        self.client.patch(reverse('student-detail', args=[self.students[0].pk]), {'last_name': 'Яковлев'})
+        self.client.post(reverse('student-enroll', args=[self.students[1].pk]), {'grades': [self.grades[1].pk]})
+        self.client.patch(reverse('grade-detail', args=[self.grades[0].pk]), {'title': '4а'})
+        self.client.patch(reverse('specialization-detail', args=[self.specializations[0].pk]), {'title': 'Астрономия'})
+        self.assertEqual(self.summarize(self.teachers[0]), [('4а', 'Астрономия', ['Смирнов', 'Яковлев']),
+                                                            ('5а', 'Астрономия', ['Смирнов'])])
+
+        self.client.patch(reverse('grade-detail', args=[self.grades[1].pk]), {
+            'teacher': self.teachers[1].pk, 'specialization': self.specializations[1].pk})
+        self.client.delete(reverse('student-detail', args=[self.students[0].pk]))
+        self.grades[0].student_set.clear()
+        self.assertEqual(self.summarize(self.teachers[0]), [('4а', 'Астрономия', [])])
+        self.assertEqual(self.summarize(self.teachers[1]), [('5а', 'Химия', ['Смирнов'])])
+        self.assert_consistent()
+
+        self.client.delete(reverse('teacher-detail', args=[self.teachers[0].pk]))
+        self.assertEqual(RosterEntry.objects.filter(teacher_id=self.teachers[0].pk).count(), 0)
+        self.assert_consistent()
+
+    def test_follows_teacher_specializations(self):
+        specialization = Specialization.objects.create(title='Биология')
+        url = reverse('roster-list')
+        response = self.client.get(url, {'specializations': specialization.pk})
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['results'], [])
+        etag = response['ETag']
+        # Only the relation changes, neither the teacher nor the roster table.
+        self.teachers[1].specializations.add(specialization)
+        response = self.client.get(url, {'specializations': specialization.pk})
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([teacher['last_name'] for teacher in json.loads(response.content.decode('utf-8'))['results']],
+                         ['Сидоров'])
+
+    def test_import(self):
+        rows = [['last_name', 'first_name', 'grades']] + [
+            ['Кузнецов %d' % i, 'Олег', '%d %d' % (self.grades[0].pk, self.grades[1].pk)] for i in range(5)]
+        self.assertEqual(import_rows('students', rows, chunk_size=2)[:2], (5, 0))
+        self.assertEqual([len(grade['students']) for grade in self.get_roster(self.teachers[0])['grades']], [5, 7])
+        self.assert_consistent()
+
+    def test_list_query_count(self):
+        url = reverse('roster-list')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        results = json.loads(response.content.decode('utf-8'))['results']
+        self.assertEqual([teacher['last_name'] for teacher in results], ['Иванов', 'Сидоров'])
+        for i in range(5):
+            teacher = Teacher.objects.create(first_name='Олег', last_name='Кузнецов %d' % i)
+            teacher.specializations.add(self.specializations[0])
+            Grade.objects.create(title='7а', specialization=self.specializations[0], teacher=teacher)
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(url)
+        self.assertEqual(len(json.loads(response.content.decode('utf-8'))['results']), 7)
+        self.assertEqual(len(second), len(context))
+
+    def test_seed(self):
+        seed(specializations=3, teachers=4, grades=6, students=20, enrollments=2)
+        self.assertEqual(RosterEntry.objects.filter(student_id__isnull=True).count(), Grade.objects.count())
+        self.assert_consistent()
+
+
+@override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={'list': '2/min',
+                                                                                       'detail': '3/min'}))
+class ThrottleTestCase(APITestCase):
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+        state = override_settings(STATE_DIR=self.state_dir)
+        state.enable()
+        self.addCleanup(state.disable)
+        # The requests of a test fall into one window, however long they take.
+        RouteRateThrottle.timer = lambda throttle: 600.0
+        self.addCleanup(delattr, RouteRateThrottle, 'timer')
+        self.teacher = Teacher.objects.create(first_name='Иван', last_name='Иванов')
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger('mediterra.requests')
+        self.logger.addHandler(self.handler)
+        self.level = self.logger.level
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+        self.logger.propagate = True
+
+    def get_statuses(self, url, count, **extra):
+        return [self.client.get(url, **extra).status_code for i in range(count)]
+
+    def test_budgets(self):
+        self.assertEqual(self.get_statuses(reverse('teacher-list'), 2), [status.HTTP_200_OK] * 2)
+        response = self.client.get(reverse('teacher-export'), {'format': 'csv'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 60)
+
+        detail = reverse('teacher-detail', args=[self.teacher.pk])
+        self.assertEqual(self.get_statuses(detail, 4), [status.HTTP_200_OK] * 3 + [status.HTTP_429_TOO_MANY_REQUESTS])
+        self.assertEqual(self.get_statuses(detail, 1, REMOTE_ADDR='10.0.0.2'), [status.HTTP_200_OK])
+
+    def test_metrics(self):
+        self.get_statuses(reverse('teacher-list'), 3)
+        metrics = [record.metrics for record in self.handler.records if record.levelno == logging.INFO]
+        self.assertEqual([data.get('throttled') for data in metrics], [None, None, 'list'])
+        warnings = [record for record in self.handler.records if record.levelno == logging.WARNING]
+        self.assertEqual(len(warnings), 1)
+        self.assertIn('list', warnings[0].getMessage())
+
+    def test_counters_across_processes(self):
+        store = FileStore(os.path.join(self.state_dir, 'counters'))
+
+        def count():
+            for i in range(200):
+                store.incr('key', 1)
+            os._exit(0)
+
+        processes = [multiprocessing.Process(target=count) for i in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(store.incr('key', 1), 801)
+        self.assertEqual(store.incr('key', 2), 1)
+
+    @override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={'list': None,
+                                                                                           'detail': None}))
+    def test_unlimited(self):
+        self.assertEqual(self.get_statuses(reverse('teacher-list'), 5), [status.HTTP_200_OK] * 5)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+API rate limits.
+
+Every client, the user when authenticated and the address otherwise, gets a
+budget of requests per scope: ``list`` for the routes that read or write many
+objects at once (lists, exports, bulk writes) and ``detail`` for the rest.
+Rates are set in ``REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']``; a ``None`` rate
+lifts the limit. Throttled requests are answered with 429 and a
+``Retry-After`` header and are marked in the request metrics.
+
+Requests are counted in fixed windows of the rate period, one counter per
+client and scope in the file store (see ``filestore.py``), which increments
+atomically across all the worker processes of a host. Unlike the request
+history of the stock DRF throttles, a request costs one small locked write.
+"""
+from __future__ import unicode_literals, absolute_import
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle, SimpleRateThrottle
+from .filestore import get_store
+from .middleware import get_metrics
+
+LIST = 'list'
+DETAIL = 'detail'
+
+
+def get_ident(request):
+    """
+    Address of the client of ``request``, behind ``NUM_PROXIES`` proxies.
+    """
+    return BaseThrottle().get_ident(request)
+
+
+class RouteRateThrottle(SimpleRateThrottle):
+    list_actions = ('list', 'export', 'bulk', 'errors')
+
+    def __init__(self):
+        # The scope depends on the view and the rates are read per request
+        # rather than at import, so they follow the settings.
+        pass
+
+    def get_scope(self, view):
+        return LIST if getattr(view, 'action', None) in self.list_actions else DETAIL
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = 'user-%s' % request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        self.scope = self.get_scope(view)
+        self.rate = settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'].get(self.scope)
+        if self.rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        self.window_end = (window + 1) * self.duration
+        count = get_store().incr(self.get_cache_key(request, view), window)
+        if count > self.num_requests:
+            metrics = get_metrics()
+            if metrics is not None:
+                metrics.throttled = self.scope
+            return False
+        return True
+
+    def wait(self):
+        return self.window_end - self.now
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Per-table version tokens.
+
+Every write to a table replaces its token with a new random value, inside the
+writing transaction. A rolled back write therefore restores the old token
+together with the old data, and a token never comes back once replaced, so
+anything keyed on tokens can be reused for as long as they match.
+"""
+from __future__ import unicode_literals, absolute_import
+import threading
+import uuid
+from contextlib import contextmanager
+from django.core.signals import request_started, request_finished
+from django.dispatch import receiver
+from .models import TableVersion
+
+_local = threading.local()
+
+
+def get_table(model):
+    return model._meta.db_table
+
+
+def get_versions(models):
+    """
+    Return sorted ``(table, version)`` pairs for ``models`` with one query.
+    """
+    tables = sorted(set(get_table(model) for model in models))
+    versions = dict(TableVersion.objects.filter(table__in=tables).values_list('table', 'version'))
+    return [(table, versions.get(table, '')) for table in tables]
+
+
+def bump_versions(*models):
+    bumped = getattr(_local, 'bumped', None)
+    for table in set(get_table(model) for model in models):
+        # A new token is needed once per request: nothing can read the
+        # intermediate states of its transaction.
+        if bumped is not None:
+            if table in bumped:
+                continue
+            bumped.add(table)
+        version = uuid.uuid4().hex
+        if not TableVersion.objects.filter(table=table).update(version=version):
+            TableVersion.objects.get_or_create(table=table, defaults={'version': version})
+
+
+@contextmanager
+def bump_once():
+    """
+    Give each table a single new token for the writes in the block, as
+    during a request. The block must run in one transaction.
+    """
+    bumped = getattr(_local, 'bumped', None)
+    if bumped is not None:
+        yield
+        return
+    _local.bumped = set()
+    try:
+        yield
+    finally:
+        _local.bumped = None
+
+
+@receiver(request_started)
+def start_request(sender, **kwargs):
+    _local.bumped = set()
+
+
+@receiver(request_finished)
+def finish_request(sender, **kwargs):
+    _local.bumped = None
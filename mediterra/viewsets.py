@@ -1,29 +1,478 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, absolute_import
-from rest_framework import viewsets
-from .models import Teacher, Student, Specialization, Grade
-from .serializers import TeacherSerializer, StudentSerializer, GradeSerializer, SpecializationSerializer
-from .filters import TeacherFilter, StudentFilter, GradeFilter
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework import mixins, serializers, status, viewsets
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from .bulk import MAX_QUERY_PARAMS, in_bulk, remove_related, set_related
+from .changes import FEED_NAMES, collect_changes
+from .counts import annotate_counts, get_counts
+from .export import build_rows, get_export_fields, iter_rows
+from .models import Teacher, Student, Specialization, Grade, Job, Change
+from .serializers import (TeacherSerializer, StudentSerializer, GradeSerializer, SpecializationSerializer,
+                          EnrollmentSerializer, JobSerializer, JobErrorSerializer, ChangeSerializer, RosterSerializer)
+from .filters import TeacherFilter, StudentFilter, GradeFilter, SpecializationFilter
+from .middleware import measure
+from .pagination import ChangeFeedPagination
+from .renderers import NDJSONRenderer, CSVRenderer
+from .versions import get_versions
 
 
-class TeacherViewSet(viewsets.ModelViewSet):
+def prefetch_pks(lookup, model):
+    """
+    Prefetch a to-many relation loading only primary keys of related objects,
+    which is all that ``PrimaryKeyRelatedField`` needs for serialization.
+    """
+    return Prefetch(lookup, queryset=model.objects.only('pk'))
+
+
+class ExportMixin(object):
+    """
+    Adds an ``export`` list route streaming the filtered collection as NDJSON
+    (default) or CSV, selected with ``?format=`` or the ``Accept`` header.
+    """
+    export_chunk_size = 2000
+
+    @list_route(renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        renderer = request.accepted_renderer
+        rows = iter_rows(queryset, chunk_size=self.export_chunk_size)
+        response = StreamingHttpResponse(renderer.render_rows(rows), content_type=renderer.media_type)
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (
+            queryset.model._meta.model_name, renderer.format)
+        return response
+
+
+class BulkMixin(object):
+    """
+    Adds a ``bulk`` list route taking a list of objects: ``POST`` creates
+    them, ``PATCH`` updates them by ``id`` and ``DELETE`` takes a list of ids.
+    Each request runs in one transaction and is rejected as a whole with
+    per-item errors if any item is invalid.
+    """
+    bulk_error_messages = {
+        'not_a_list': 'Ожидался список id.',
+        'does_not_exist': 'Объект с id "{pk_value}" не существует.',
+    }
+
+    @list_route(methods=['post', 'patch', 'delete'])
+    def bulk(self, request, *args, **kwargs):
+        with transaction.atomic(), collect_changes():
+            if request.method == 'DELETE':
+                return self.bulk_destroy(request)
+            if request.method == 'PATCH':
+                serializer = self.get_serializer(self.get_queryset(), data=request.data, many=True, partial=True)
+            else:
+                serializer = self.get_serializer(data=request.data, many=True)
+            serializer.is_valid(raise_exception=True)
+            instances = serializer.save()
+        # Read back through the view queryset for its prefetches and counts,
+        # answering in the order of the request.
+        objects = in_bulk(self.get_queryset(), [instance.pk for instance in instances])
+        data = self.get_serializer([objects[instance.pk] for instance in instances], many=True).data
+        return Response(data, status=status.HTTP_200_OK if request.method == 'PATCH' else status.HTTP_201_CREATED)
+
+    def bulk_destroy(self, request):
+        if not isinstance(request.data, list):
+            raise serializers.ValidationError([self.bulk_error_messages['not_a_list']])
+        field = serializers.IntegerField()
+        errors = []
+        pks = []
+        for value in request.data:
+            try:
+                pks.append(field.run_validation(value))
+            except serializers.ValidationError as exc:
+                errors.append({'id': exc.detail})
+            else:
+                errors.append({})
+        if not any(errors):
+            existing = set()
+            for start in range(0, len(pks), MAX_QUERY_PARAMS):
+                existing.update(self.get_queryset().filter(pk__in=pks[start:start + MAX_QUERY_PARAMS])
+                                .values_list('pk', flat=True))
+            errors = [{} if pk in existing else {'id': [self.bulk_error_messages['does_not_exist'].format(pk_value=pk)]}
+                      for pk in pks]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        for start in range(0, len(pks), MAX_QUERY_PARAMS):
+            self.get_queryset().filter(pk__in=pks[start:start + MAX_QUERY_PARAMS]).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class CollectChangesMixin(object):
+    """
+    Runs every write in one transaction, which inserts its change feed
+    entries together (see ``changes.py``).
+    """
+    def perform_create(self, serializer):
+        with transaction.atomic(), collect_changes():
+            super(CollectChangesMixin, self).perform_create(serializer)
+
+    def perform_update(self, serializer):
+        with transaction.atomic(), collect_changes():
+            super(CollectChangesMixin, self).perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic(), collect_changes():
+            super(CollectChangesMixin, self).perform_destroy(instance)
+
+
+class Expansion(object):
+    """
+    Queryset changes and additional version dependencies for one ``?expand=``
+    value.
+    """
+    def __init__(self, select_related=(), prefetch_related=(), dependencies=()):
+        self.select_related = select_related
+        self.prefetch_related = prefetch_related
+        self.dependencies = dependencies
+
+
+def get_names_param(request, param, choices):
+    """
+    Parse a comma separated list of names from the ``param`` query parameter,
+    rejecting names not in ``choices``.
+    """
+    names = []
+    for name in request.query_params.get(param, '').split(','):
+        name = name.strip()
+        if not name or name in names:
+            continue
+        if name not in choices:
+            message = 'Недопустимое значение "{value}". Допустимые значения: {choices}.'.format(
+                value=name, choices=', '.join(sorted(choices)))
+            raise serializers.ValidationError({param: [message]})
+        names.append(name)
+    return names
+
+
+class ExpandRelatedMixin(object):
+    """
+    Prefetches the to-many relations in ``related_prefetches`` and, on reads,
+    inlines the relations named in ``?expand=`` as declared in ``expansions``.
+    Each expansion costs a fixed number of queries whatever the page size.
+    """
+    expand_param = 'expand'
+    related_prefetches = {}
+    expansions = {}
+
+    def get_expand(self):
+        if self.request.method not in SAFE_METHODS:
+            return []
+        return get_names_param(self.request, self.expand_param, self.expansions)
+
+    def get_related_prefetches(self):
+        expand = self.get_expand()
+        return dict((name, lookup) for name, lookup in self.related_prefetches.items() if name not in expand)
+
+    def get_queryset(self):
+        queryset = super(ExpandRelatedMixin, self).get_queryset()
+        lookups = [lookup for name, lookup in sorted(self.get_related_prefetches().items())]
+        for name in self.get_expand():
+            expansion = self.expansions[name]
+            if expansion.select_related:
+                queryset = queryset.select_related(*expansion.select_related)
+            lookups.extend(expansion.prefetch_related)
+        return queryset.prefetch_related(*lookups)
+
+    def get_serializer_context(self):
+        context = super(ExpandRelatedMixin, self).get_serializer_context()
+        context['expand'] = self.get_expand()
+        return context
+
+    def get_version_dependencies(self):
+        dependencies = list(super(ExpandRelatedMixin, self).get_version_dependencies())
+        for name in self.get_expand():
+            dependencies.extend(self.expansions[name].dependencies)
+        return dependencies
+
+
+class SelectFieldsMixin(ExpandRelatedMixin):
+    """
+    Annotates the counts of the model (see ``counts.py``).
+
+    On reads, ``?fields=`` limits top level objects to the listed fields;
+    expanded relations are always included. Other columns are deferred with
+    ``only()``, other counts are not annotated and other to-many relations
+    are not prefetched.
+    """
+    fields_param = 'fields'
+
+    def get_requested_fields(self):
+        if self.request.method not in SAFE_METHODS:
+            return None
+        choices = list(self.get_serializer_class()().fields)
+        fields = get_names_param(self.request, self.fields_param, choices)
+        if not fields:
+            return None
+        return fields + [name for name in self.get_expand() if name not in fields]
+
+    def get_related_prefetches(self):
+        prefetches = super(SelectFieldsMixin, self).get_related_prefetches()
+        fields = self.get_requested_fields()
+        if fields is None:
+            return prefetches
+        return dict((name, lookup) for name, lookup in prefetches.items() if name in fields)
+
+    def get_queryset(self):
+        queryset = super(SelectFieldsMixin, self).get_queryset()
+        fields = self.get_requested_fields()
+        queryset = annotate_counts(queryset, fields)
+        if fields is None:
+            return queryset
+        model = queryset.model
+        # Pagination reads the ordering values from every object.
+        columns = set(name.lstrip('-') for name in model._meta.ordering)
+        columns.add(model._meta.pk.name)
+        columns.update(field.name for field in model._meta.concrete_fields if field.name in fields)
+        return queryset.only(*sorted(columns))
+
+    def get_serializer_context(self):
+        context = super(SelectFieldsMixin, self).get_serializer_context()
+        context['fields'] = self.get_requested_fields()
+        return context
+
+
+class FastListMixin(object):
+    """
+    With ``fast_list`` set, ``list`` reads plain ``values()`` rows plus one
+    query per to-many relation and builds the output directly instead of
+    going through the serializer fields. The output is the same as the
+    serializer's, which must therefore declare ``fields = '__all__'``;
+    expanded lists are left to the serializer.
+    """
+    fast_list = False
+
+    def list(self, request, *args, **kwargs):
+        context = self.get_serializer_context()
+        if not self.fast_list or context.get('expand'):
+            return super(FastListMixin, self).list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        model = queryset.model
+        names, to_many = get_export_fields(model)
+        names += list(get_counts(model))
+        if context.get('fields') is not None:
+            names = [name for name in names if name in context['fields']]
+        columns = [name for name in names if name not in to_many]
+        # Pagination reads its position from the ordering values.
+        ordering = [name.lstrip('-') for name in queryset.query.order_by or model._meta.ordering]
+        columns += [name for name in [model._meta.pk.name] + ordering if name not in columns]
+        queryset = queryset.prefetch_related(None).values(*columns)
+
+        page = self.paginate_queryset(queryset)
+        with measure('serialize'):
+            data = build_rows(model, list(queryset if page is None else page), names)
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+
+class ConditionalResponseMixin(object):
+    """
+    Tags ``list`` and ``retrieve`` responses with an ``ETag`` derived from the
+    URL, the accepted media type and the versions of the tables listed in
+    ``version_dependencies``. A matching ``If-None-Match`` is answered with
+    304 after the single versions query, before the handler runs.
+    """
+    version_dependencies = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super(ConditionalResponseMixin, self).list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super(ConditionalResponseMixin, self).retrieve, request, *args, **kwargs)
+
+    def get_etag(self, request):
+        query = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+        parts = [request.path, query, request.accepted_media_type, get_versions(self.get_version_dependencies())]
+        return hashlib.md5(force_bytes(repr(parts))).hexdigest()
+
+    def get_version_dependencies(self):
+        return self.version_dependencies
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = self.build_response(handler, request, etag, *args, **kwargs)
+            if response.status_code == 200:
+                response['ETag'] = quote_etag(etag)
+        return response
+
+    def build_response(self, handler, request, etag, *args, **kwargs):
+        return handler(request, *args, **kwargs)
+
+
+class CacheResponseMixin(ConditionalResponseMixin):
+    """
+    Caches rendered responses under their version ``ETag``, so any write to
+    the tables in ``version_dependencies`` invalidates them.
+    """
+    cache_formats = ('json', 'msgpack')
+
+    def build_response(self, handler, request, etag, *args, **kwargs):
+        if request.accepted_renderer.format not in self.cache_formats:
+            return handler(request, *args, **kwargs)
+        cache = caches[settings.API_CACHE_ALIAS]
+        key = 'response:%s' % etag
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = handler(request, *args, **kwargs)
+
+        def store(response):
+            if response.status_code == 200:
+                cache.set(key, (response.content, response['Content-Type']))
+
+        response.add_post_render_callback(store)
+        return response
+
+
+class TeacherViewSet(SelectFieldsMixin, ConditionalResponseMixin, FastListMixin, CollectChangesMixin, ExportMixin,
+                     viewsets.ModelViewSet):
+    fast_list = True
     queryset = Teacher.objects.all()
     serializer_class = TeacherSerializer
     filter_class = TeacherFilter
+    version_dependencies = (Teacher, Teacher.specializations.through, Specialization, Grade)
+    related_prefetches = {
+        'specializations': prefetch_pks('specializations', Specialization),
+    }
+    expansions = {
+        'specializations': Expansion(prefetch_related=['specializations']),
+        'grades': Expansion(prefetch_related=[Prefetch('grade_set', queryset=Grade.objects.all())],
+                            dependencies=(Grade,)),
+    }
 
 
-class StudentViewSet(viewsets.ModelViewSet):
+class StudentViewSet(SelectFieldsMixin, ConditionalResponseMixin, FastListMixin, CollectChangesMixin, BulkMixin,
+                     ExportMixin, viewsets.ModelViewSet):
+    fast_list = True
     queryset = Student.objects.all()
     serializer_class = StudentSerializer
     filter_class = StudentFilter
+    version_dependencies = (Student, Student.grades.through, Grade)
+    related_prefetches = {
+        'grades': prefetch_pks('grades', Grade),
+    }
+    expansions = {
+        'grades': Expansion(prefetch_related=[Prefetch('grades', queryset=Grade.objects.all())]),
+    }
+
+    @detail_route(methods=['post'], serializer_class=EnrollmentSerializer)
+    def enroll(self, request, *args, **kwargs):
+        """
+        Add the student to ``grades``, keeping the grades it is already in.
+        """
+        return self.change_grades(request, set_related)
+
+    @detail_route(methods=['post'], serializer_class=EnrollmentSerializer)
+    def unenroll(self, request, *args, **kwargs):
+        """
+        Remove the student from ``grades``.
+        """
+        return self.change_grades(request, remove_related)
+
+    def change_grades(self, request, write):
+        student = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic(), collect_changes():
+            write([student], 'grades', {student: [grade.pk for grade in serializer.validated_data['grades']]})
+        return Response(StudentSerializer(self.get_object(), context=self.get_serializer_context()).data)
 
 
-class GradeViewSet(viewsets.ModelViewSet):
+class GradeViewSet(SelectFieldsMixin, CacheResponseMixin, CollectChangesMixin, BulkMixin, ExportMixin,
+                   viewsets.ModelViewSet):
+    # ``teacher`` and ``specialization`` are serialized from ``*_id`` attributes,
+    # so no joins are needed unless they are expanded.
     queryset = Grade.objects.all()
     serializer_class = GradeSerializer
     filter_class = GradeFilter
+    version_dependencies = (Grade, Student.grades.through)
+    expansions = {
+        'teacher': Expansion(select_related=['teacher'],
+                             prefetch_related=[prefetch_pks('teacher__specializations', Specialization)],
+                             dependencies=(Teacher, Teacher.specializations.through, Specialization)),
+        'specialization': Expansion(select_related=['specialization'], dependencies=(Specialization,)),
+        'students': Expansion(prefetch_related=[Prefetch('student_set', queryset=Student.objects.prefetch_related(
+                                  prefetch_pks('grades', Grade)))],
+                              dependencies=(Student, Student.grades.through)),
+    }
 
 
-class SpecializationViewSet(viewsets.ModelViewSet):
+class SpecializationViewSet(SelectFieldsMixin, CacheResponseMixin, CollectChangesMixin, ExportMixin,
+                            viewsets.ModelViewSet):
     queryset = Specialization.objects.all()
     serializer_class = SpecializationSerializer
+    filter_class = SpecializationFilter
+    version_dependencies = (Specialization, Teacher.specializations.through)
+
+
+class RosterViewSet(CacheResponseMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Teachers with their grades, each with its specialization and students,
+    read from the roster table (see ``roster.py``).
+    """
+    queryset = Teacher.objects.only('id', 'first_name', 'last_name')
+    serializer_class = RosterSerializer
+    filter_class = TeacherFilter
+    version_dependencies = (Teacher, Teacher.specializations.through, Grade, Specialization, Student,
+                            Student.grades.through)
+
+
+class JobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin,
+                 viewsets.GenericViewSet):
+    """
+    Background jobs: ``POST`` queues one for ``manage.py worker``, the job
+    shows its progress and ``errors`` lists the rows that failed.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+
+    def create(self, request, *args, **kwargs):
+        response = super(JobViewSet, self).create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+    def get_success_headers(self, data):
+        return {'Location': self.request.build_absolute_uri(reverse('job-detail', args=[data['id']]))}
+
+    @detail_route(serializer_class=JobErrorSerializer)
+    def errors(self, request, *args, **kwargs):
+        job = self.get_object()
+        page = self.paginate_queryset(job.errors.all())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class ChangeViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Change feed (see ``changes.py``): writes in commit order after the
+    ``?since=`` cursor, optionally only for the ``?models=`` listed.
+    """
+    queryset = Change.objects.all()
+    serializer_class = ChangeSerializer
+    pagination_class = ChangeFeedPagination
+    filter_backends = ()
+    models_param = 'models'
+
+    def get_queryset(self):
+        queryset = super(ChangeViewSet, self).get_queryset()
+        models = get_names_param(self.request, self.models_param, FEED_NAMES)
+        if models:
+            queryset = queryset.filter(model__in=models)
+        return queryset